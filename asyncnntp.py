@@ -1,15 +1,70 @@
 """
 asyncnntp.py - An asynchronous NNTP client.
 """
-import asyncore
-import asynchat
+import array
+import bisect
 import collections
+import hashlib
+import itertools
 import logging
-import nntplib
+import os
+import random
+import re
 import socket
+import struct
 import sys
-import thread
 import time
+import weakref
+import zlib
+
+try:
+    import thread
+except ImportError:
+    # Python 3
+    import _thread as thread
+
+try:
+    import asyncore
+    import asynchat
+except ImportError:
+    # Removed in Python 3.12, only AsyncNNTP is available
+    asyncore = asynchat = None
+    _async_chat = object
+else:
+    _async_chat = asynchat.async_chat
+
+try:
+    import asyncio
+    from asyncio import BufferedProtocol as _buffered_protocol
+except ImportError:
+    # Python 2 (or older than 3.7), only NNTP is available
+    asyncio = None
+    _buffered_protocol = object
+
+try:
+    from nntplib import NNTPError, NNTPTemporaryError, NNTPPermanentError, \
+                        NNTPDataError
+except ImportError:
+    # Removed in Python 3.13
+    class NNTPError(Exception):
+        """
+        Base class for all NNTP errors.
+        """
+
+    class NNTPTemporaryError(NNTPError):
+        """
+        4xx errors.
+        """
+
+    class NNTPPermanentError(NNTPError):
+        """
+        5xx errors.
+        """
+
+    class NNTPDataError(NNTPError):
+        """
+        Error in response data.
+        """
 
 try:
     import ssl
@@ -18,10 +73,109 @@ except ImportError:
 else:
     _have_ssl = True
 
-CRLF = '\r\n'
+# Python 2 has no ``MemoryBIO``, so :class:`NNTP` uses SSL sockets there
+_have_memory_bio = _have_ssl and hasattr(ssl, "MemoryBIO")
+
+try:
+    import sqlite3
+except ImportError:
+    # Only needed by OverviewCache
+    sqlite3 = None
+
+try:
+    from xml.etree import cElementTree as ElementTree
+except ImportError:
+    from xml.etree import ElementTree
+
+if str is bytes:
+    # Python 2
+    string_types  = (basestring,)
+    integer_types = (int, long)
+    _intern       = intern
+
+    def _native(data):
+        return data
+else:
+    string_types  = (str,)
+    integer_types = (int,)
+    _intern       = sys.intern
+
+    def _native(data):
+        return data.decode("utf-8", "replace")
+
+def _bytes(value):
+    """
+    Returns ``value`` as a UTF-8 encoded byte string.
+    """
+    if isinstance(value, bytes):
+        return value
+    if not isinstance(value, string_types):
+        value = str(value)
+    return value.encode("utf-8")
+
+if hasattr(os, "pwrite"):
+    _pwrite = os.pwrite
+else:
+    # Python 2 and Windows
+    def _pwrite(fd, data, offset):
+        os.lseek(fd, offset, os.SEEK_SET)
+        return os.write(fd, data)
+
+CRLF = b'\r\n'
+
+# Terminates the data block of a multi-line response.  The CRLF which ends the
+# last line of data is part of the terminator.
+MULTILINE_TERMINATOR = CRLF + b'.' + CRLF
 
 SSL_PORTS = [443, 563]
 
+# The context used by connections that weren't given one, see
+# ``default_ssl_context``
+_default_ssl_context = None
+
+# Context -> {(host, port): session}, the last TLS session of each server, see
+# ``_ssl_session``
+_ssl_sessions = weakref.WeakKeyDictionary()
+
+def default_ssl_context():
+    """
+    Returns the :py:class:`ssl.SSLContext` of the SSL connections that weren't
+    given an ``ssl_context``.  It is created once with
+    :py:func:`ssl.create_default_context`, so the certificate of the server is
+    verified, and shared so that the connections can resume each other's TLS
+    sessions.
+    """
+    global _default_ssl_context
+    if _default_ssl_context is None:
+        _default_ssl_context = ssl.create_default_context()
+    return _default_ssl_context
+
+def _ssl_session(context, host, port):
+    """
+    Returns the TLS session of the last connection to ``host`` and ``port``
+    with ``context``, if there is one to resume.
+    """
+    sessions = _ssl_sessions.get(context)
+    if sessions is None:
+        return None
+    return sessions.get((host, port))
+
+def _save_ssl_session(context, host, port, sock):
+    """
+    Keeps the TLS session of ``sock`` for the next connection to ``host`` and
+    ``port``.  TLS 1.3 sends the session after the handshake, so this is done
+    again when the connection is closed.
+    """
+    session = getattr(sock, "session", None)
+    if session is None:
+        # Python 2, or no session yet
+        return
+    try:
+        sessions = _ssl_sessions[context]
+    except KeyError:
+        sessions = _ssl_sessions[context] = {}
+    sessions[(host, port)] = session
+
 LONG_RESP_CODES = ('100',      # HELP
                    '101',      # CAPABILITIES
                    '211',      # LISTGROUP (also GROUP, but *not* multi-line)
@@ -35,6 +189,13 @@ LONG_RESP_CODES = ('100',      # HELP
                    '231',      # NEWGROUPS
                    '282')      # ???
 
+# Multi-line response codes that are single-line for some commands
+SHARED_RESP_CODES = {
+    '211': ('LISTGROUP',),    # GROUP responds with 211, but is single-line
+}
+
+# Only kept for backward compatibility, responses are framed by their code
+# (see ``LONG_RESP_CODES``) and nothing here reads this
 LONG_RESP_COMMANDS = ('HELP',
                       'CAPABILITIES',
                       'LISTGROUP',
@@ -47,6 +208,56 @@ LONG_RESP_COMMANDS = ('HELP',
                       'NEWNEWS',
                       'NEWGROUPS')
 
+# Commands after which nothing else may be pipelined until their response has
+# been received (https://tools.ietf.org/html/rfc3977#section-3.5).
+NO_PIPELINE_COMMANDS = ('AUTHINFO',
+                        'COMPRESS',
+                        'MODE READER',
+                        'STARTTLS',
+                        'QUIT')
+
+# Commands that set up a connection before it's ready, they are sent while the
+# other requests wait for a reconnect to complete
+SETUP_COMMANDS = ('AUTHINFO',
+                  'CAPABILITIES',
+                  'COMPRESS',
+                  'XFEATURE')
+
+# Commands that look up a single article, see :class:`NegativeCache`
+LOOKUP_COMMANDS = ('ARTICLE',
+                   'HEAD',
+                   'BODY',
+                   'STAT')
+
+# yEnc decoding: every byte is shifted by 42, escaped bytes by another 64
+# (http://www.yenc.org/yenc-draft.1.3.txt)
+YENC_TABLE = bytes(bytearray((i - 42) & 255 for i in range(256)))
+
+# Maps the character following a yEnc escape character to its unescaped value
+YENC_UNESCAPE = dict((bytes(bytearray([i])), bytes(bytearray([(i - 64) & 255])))
+                     for i in range(256))
+
+# The overview fields after the article number when the server doesn't
+# provide ``LIST OVERVIEW.FMT`` (https://tools.ietf.org/html/rfc3977#section-8.4)
+DEFAULT_OVERVIEW_FMT = ("Subject:",
+                        "From:",
+                        "Date:",
+                        "Message-ID:",
+                        "References:",
+                        ":bytes",
+                        ":lines")
+
+# Overview fields that are stored as numbers
+OVERVIEW_NUMBER_FIELDS = ("bytes", "lines")
+
+# Array type code of the numeric overview columns, Python 2 has no 'q'
+try:
+    array.array('q')
+except ValueError:
+    _INT64 = 'l'
+else:
+    _INT64 = 'q'
+
 COMMANDS = {
     "DATE":         ("111",),
     "HELP":         ("100",),
@@ -70,591 +281,4294 @@ def loop_forever(target=None, *args, **kwargs):
                 target()
     thread.start_new_thread(loop, ())
 
-class Request:
+class MultilineDecoder:
     """
-    
+    Removes the dot-stuffing from the data block of a multi-line response as
+    it is received in arbitrarily sized chunks.  The data block is expected to
+    start with the CRLF that ended the status line and to exclude the
+    terminating ``.`` line.  The decoded output consists of the lines of the
+    block, each terminated by CRLF.
     """
-    def __init__(self, nntp, command, *args, **kwargs):
-        self.command          = command.upper()
-        self.args             = args
-        self.response_code    = None
-        self.response_message = ""
-        self.response_data    = []
-        self.multiline        = self.command in LONG_RESP_COMMANDS
-        self.lines            = None
-        self.logger           = logging.getLogger("NNTP::Request")
-        self.callbacks        = kwargs.get("callbacks", None)
-        self.nntp             = nntp
-
-    def __repr__(self):
-        return "<%s>" % str(self)
-
-    def __str__(self):
-        return "Request: %s %s" % (self.command, " ".join(self.args))
+    # Proper prefixes of a stuffed line start, which may be split across chunks
+    _PARTIAL = (CRLF + b'.', CRLF, CRLF[:1])
 
-    def getline(self):
-        """
-        Returns a fully formatted request, including terminating characters.
-        """
-        cmd = [self.command]
-        for arg in self.args:
-            if arg:
-                cmd.append(str(arg))
-        return " ".join(cmd).strip()+CRLF
+    def __init__(self):
+        self._tail  = b''
+        self._fed   = False
+        self._start = True
 
-    def getterminator(self):
+    def feed(self, data):
         """
-        Returns the appropriate terminator for the given request, depending on
-        whether a single-line or multi-line response is expected.
+        Decodes the next chunk of the data block and returns as much of the
+        decoded data as is known.
         """
-        if self.multiline:
-            return "%s.%s" % (CRLF,CRLF)
-        return CRLF
+        self._fed = True
+        if self._tail:
+            data = self._tail + data
 
-    def get_callbacks(self):
-        return self.callbacks or ("on_%s" % "_".join(self.command.lower().split()),)
+        keep = 0
+        for partial in self._PARTIAL:
+            if data.endswith(partial):
+                keep = len(partial)
+                break
+        self._tail = data[len(data)-keep:]
+        data = data[:len(data)-keep].replace(CRLF + b'..', CRLF + b'.')
 
-    def handle_data(self, data):
-        """
-        Called when data has been received from the socket.
-        """
-        self.logger.debug("handle_data()")
-        self.response_data.append(data)
+        if self._start and data:
+            # Drop the CRLF which ended the status line
+            self._start = False
+            data = data[len(CRLF):]
+        return data
 
-    def finish(self):
+    def close(self):
         """
-        Called once all data has been received.
+        Returns the rest of the decoded data once the whole data block has
+        been fed.
         """
-        self.logger.debug("%s -> finish()" % self)
-        self.lines = ''.join(self.response_data).split(CRLF)
+        if not self._fed:
+            # An empty data block
+            return b''
 
-        if len(self.lines) < 1:
-            raise nntplib.NNTPDataError("No data received")
+        data, self._tail = self._tail, b''
+        if self._start:
+            data = data[len(CRLF):]
+        return data + CRLF
 
-        self.response_code, self.response_message = self.lines[0][:3], \
-                                                    self.lines[0][3:].strip()
+class YencDecoder:
+    """
+    Decodes a yEnc encoded article body as it is received.  An instance can
+    be given as the ``sink`` of :func:`NNTP.body`, the ``=ybegin``, ``=ypart``
+    and ``=yend`` lines are parsed into attributes of the decoder and the
+    decoded data is passed on as it arrives.
 
-        self.logger.debug("code = %s" % self.response_code)
-        self.logger.debug("msg  = %s" % self.response_message)
+    ``output`` is either a callable which is called with each chunk of
+    decoded data and its ``offset`` within the complete file (see ``begin``
+    from the ``=ypart`` line), or a file-like object which the data is
+    written to.  If no ``output`` is given the decoded data is collected in
+    ``data``.
 
-class NNTP(asynchat.async_chat):
-    """
-    
+    The CRC32 of the decoded data is updated as it is decoded, once the
+    ``=yend`` line has been received ``valid`` tells if the size and CRC32
+    of the data match the trailer.
     """
-    def __init__(self, host, port=119, user=None, password=None,
-                 readermode=None, usenetrc=True, use_ssl=None,
-                 interactive=False):
+    def __init__(self, output=None):
+        self.output = output
+        if hasattr(self.output, "write"):
+            write = self.output.write
+            self.output = lambda data, offset: write(data)
+        self.data = bytearray() if output is None else None
+        self.reset()
 
-        self.host        = host
-        self.port        = port
-        self.__username  = user
-        self.__password  = password
-        self.logger      = logging.getLogger('NNTP')
-        self.interactive = interactive
+    def reset(self):
+        """
+        Discards what has been decoded so far, e.g. when the article is sent
+        again after a connection was lost (see :func:`Request.rewind`).
+        """
+        if self.data is not None:
+            del self.data[:]
 
-        self.use_ssl = use_ssl
-        if self.use_ssl is None:
-            self.use_ssl = port in SSL_PORTS
-        self.established = not self.use_ssl
+        self.name    = None
+        self.size    = None
+        self.line    = None
+        self.part    = None
+        self.total   = None
+        self.begin   = None
+        self.end     = None
+        self.pcrc32  = None
+        self.crc32   = None
+        self.crc     = 0
+        self.decoded = 0
+        self.done    = False
 
-        self._request = None
-        self._fifo    = asynchat.fifo()
+        self._tail   = b''
+        self._escape = False
+        self._begun  = False
+        self._trailer = {}
 
-        asynchat.async_chat.__init__(self)
+    def __call__(self, data):
+        self.feed(data)
 
-        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+    @property
+    def offset(self):
+        """
+        The offset of this part within the complete file.
+        """
+        return (self.begin or 1) - 1
 
-        self.connect((host, port))
+    @property
+    def valid(self):
+        """
+        ``True`` if the complete part has been decoded and both its size and
+        CRC32 match the ``=yend`` trailer.
+        """
+        if not self.done:
+            return False
+        if "size" in self._trailer and \
+           int(self._trailer["size"]) != self.decoded:
+            return False
+        expected = self.pcrc32 if self.part else (self.pcrc32 or self.crc32)
+        if expected is not None and expected != self.crc:
+            return False
+        return True
 
-        self._connected = False
-        self.welcome    = ""
+    def feed(self, data):
+        """
+        Decodes the next chunk of a (dot-unstuffed) article body.  Only
+        complete lines are decoded, the rest is kept until more data arrives.
+        """
+        if self._tail:
+            data = self._tail + data
+        end = data.rfind(CRLF)
+        if end == -1:
+            self._tail = data
+            return
+        end += len(CRLF)
+        self._tail = data[end:]
 
-    def reconnect(self):
-        self.socket.close()
-        del self.socket
+        # Split the complete lines into keyword lines and runs of data lines
+        pos = 0
+        while pos < end:
+            if data.startswith(b'=y', pos):
+                eol = data.find(CRLF, pos)
+                self._keyword(data[pos:eol])
+                pos = eol + len(CRLF)
+                continue
 
-        if hasattr(self, "_socket"):
-            self._socket.close()
-            del self._socket
+            index = data.find(CRLF + b'=y', pos, end)
+            stop = end if index == -1 else index + len(CRLF)
+            if self._begun and not self.done:
+                # Text before ``=ybegin`` (or after ``=yend``) is no data
+                self._decode(data[pos:stop])
+            pos = stop
 
-        self.established = not self.use_ssl
-        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.connect((self.host, self.port))
+    def _keyword(self, line):
+        """
+        Parses a ``=ybegin``, ``=ypart`` or ``=yend`` line.
+        """
+        keyword, _, rest = _native(line).partition(' ')
 
-    def _handshake(self):
-        try:
-            self.socket.do_handshake()
-        except ssl.SSLError as err:
-            self.logger.debug("SSL handshake not complete")
-            self.want_read = self.want_write = False
-            if err.args[0] == ssl.SSL_ERROR_WANT_READ:
-                self.want_read = True
-            elif err.args[0] == ssl.SSL_ERROR_WANT_WRITE:
-                self.want_write = True
-            else:
-                raise
-        else:
-            self.logger.debug("SSL handshake complete")
-            self.want_read = self.want_write = True
-            self.established = True
+        fields = {}
+        index = rest.find('name=')
+        if index != -1:
+            # The name is last and may contain spaces
+            fields['name'] = rest[index+5:].strip()
+            rest = rest[:index]
+        for field in rest.split():
+            key, _, value = field.partition('=')
+            fields[key] = value
 
-    def _do_callback(self, callbacks, *args, **kwargs):
-        if isinstance(callbacks, basestring):
-            callbacks = (callbacks,)
+        if keyword == '=ybegin':
+            self._begun = True
+            self.name = fields.get('name')
+            for key in ('size', 'line', 'part', 'total'):
+                if key in fields:
+                    setattr(self, key, int(fields[key]))
+        elif keyword == '=ypart':
+            self.begin = int(fields.get('begin', 1))
+            self.end   = int(fields.get('end', 0)) or None
+        elif keyword == '=yend':
+            self._trailer = fields
+            for key in ('pcrc32', 'crc32'):
+                if key in fields:
+                    setattr(self, key, int(fields[key], 16))
+            self.done = True
 
-        if not isinstance(callbacks, collections.Iterable):
-            self.logger.error("Callbacks is not an iterable")
-            return
+    def _decode(self, data):
+        """
+        Decodes a run of complete data lines.
+        """
+        data = data.replace(CRLF, b'')
+        if self._escape:
+            data = b'=' + data
+        self._escape = data.endswith(b'=')
+        if self._escape:
+            data = data[:-1]
 
-        for callback in callbacks:
-            if not callback:
-                continue
+        if b'=' in data:
+            # Escapes are rare, so only the character after each escape
+            # character has to be handled separately
+            parts = data.split(b'=')
+            data = parts[0] + b''.join([YENC_UNESCAPE[part[:1]] + part[1:]
+                                       for part in parts[1:] if part])
+        data = data.translate(YENC_TABLE)
 
-            if isinstance(callback, basestring):
-                # Try internal callback first
-                _name = "_%s" % callback
-                if hasattr(self, _name):
-                    self.logger.debug("Calling %s()" % _name)
-                    getattr(self, _name)(*args, **kwargs)
-
-                # Then try user-defined callback
-                if hasattr(self, callback):
-                    self.logger.debug("Calling %s()" % callback)
-                    getattr(self, callback)(*args, **kwargs)
-            
-            elif callable(callback):
-                callback(*args, **kwargs)
+        self.crc = zlib.crc32(data, self.crc) & 0xffffffff
+        if self.output is None:
+            self.data.extend(data)
+        else:
+            self.output(data, self.offset + self.decoded)
+        self.decoded += len(data)
 
-    def handle_connect(self):
-        """
-        If SSL has been requested, this method will wrap the socket in SSL.  If
-        SSL has been requested but is not available a ``ValueError`` will be
-        raised.
-        """
-        self.logger.debug('handle_connect()')
+class InflateDecoder:
+    """
+    Decompresses the data block of a response that was sent compressed, with
+    ``XFEATURE COMPRESS GZIP`` or ``XZVER``, as it is received.  The
+    decompressed block is passed on to ``output`` in the form the data block
+    of an uncompressed response takes (see :class:`MultilineDecoder`).
 
-        # Default terminator
-        self.set_terminator(CRLF)
+    The end of a compressed data block can't be found by searching for a
+    terminator, instead ``done`` is set once the compressed stream has ended.
+    If ``trailer`` is set and the stream didn't end with the terminating
+    line, the uncompressed one that may follow it is consumed as well:
+    servers send it that way unless ``XFEATURE COMPRESS GZIP TERMINATOR``
+    was used.
+    """
+    # The end of the decompressed data, which may be the terminating line
+    _TERMINATOR = CRLF + b'.' + CRLF
+    # The terminating line after the stream, see ``trailer``
+    _TRAILER    = b'.' + CRLF
 
-        # See if we need to wrap the socket in SSL
-        if self.use_ssl:
-            if not _have_ssl:
-                self.logger.error("SSL requested but not available")
-                raise ValueError("SSL not available")
+    def __init__(self, output, wbits=zlib.MAX_WBITS | 32, trailer=False):
+        # The default ``wbits`` accept both zlib and gzip streams
+        self.output   = output
+        self.trailer  = trailer
+        self.done     = False
+        self._inflate = zlib.decompressobj(wbits)
 
-            self.logger.debug('Wrapping in SSL')
-            self._socket = self.socket
-            self.socket = ssl.wrap_socket(self._socket,
-                                          do_handshake_on_connect=False)
+        # The data block starts with the CRLF of the status line
+        self._tail    = CRLF
+        self._started = False
+        self._ended   = False   # The stream, but maybe not the trailer
+        self._matched = 0       # Bytes of the trailer received so far
 
-    def handle_write(self):
+    def feed(self, data):
         """
-        Overload the default ``handle_read`` method to support SSL handshake.
+        Decompresses the next chunk of the data block and returns the number
+        of bytes of ``data`` that were part of it.
         """
-        if self.established:
-            return self.initiate_send()
-        self._handshake()
+        if self.done:
+            return 0
+        if self._ended:
+            return self._skip_trailer(data)
+        try:
+            decoded = self._inflate.decompress(data)
+        except zlib.error as err:
+            raise NNTPDataError("Invalid compressed data: %s" % err)
+        used = len(data) - len(self._inflate.unused_data)
+
+        decoded = self._tail + decoded
+        if self._finished():
+            self._close(decoded)
+            if not self.done and used < len(data):
+                used += self._skip_trailer(data[used:])
+        else:
+            # Keep what could be the terminating line
+            keep = len(self._TERMINATOR)
+            self._tail = decoded[-keep:]
+            if len(decoded) > keep:
+                self._started = True
+                self.output(decoded[:-keep])
+        return used
 
-    def recv(self, buffer_size):
+    def _skip_trailer(self, data):
         """
-        The default ``recv`` function does not support SSL sockets which
-        sometimes will fail when they appear readable but in fact aren't ready
-        to be read yet.  This get's around that issue by catching the error.  If
-        SSL isn't available (or enabled) then this behaves just like the default
-        implementation.
+        Returns how many bytes at the start of ``data`` belong to the
+        terminating line after the stream.  A response that follows starts
+        with a digit instead, so the first byte tells whether there is one.
         """
-        try:
-            return asynchat.async_chat.recv(self, buffer_size)
-        except Exception as e:
-            if _have_ssl:
-                if isinstance(e, ssl.SSLError) and e.args[0] == ssl.SSL_ERROR_WANT_READ:
-                    return ''
-            raise e
+        wanted = self._TRAILER[self._matched:]
+        count  = 0
+        while count < min(len(wanted), len(data)) and \
+              data[count:count+1] == wanted[count:count+1]:
+            count += 1
+        self._matched += count
+        if count < len(data) or self._matched == len(self._TRAILER):
+            self.done = True
+        return count
 
-    def _handle_read(self):
+    def write(self, data):
+        self.feed(data)
+
+    def close(self):
         """
-        We can't use the default ``handle_read`` here because it doesn't support
-        SSL sockets.  This fix is from: http://bugs.python.org/issue16976
+        Passes on the rest of the data block once all of it has been fed.
         """
+        if not self._ended:
+            self._close(self._tail + self._inflate.flush())
+        self.done = True
+
+    def _finished(self):
+        eof = getattr(self._inflate, "eof", None)
+        if eof is not None:
+            return eof
+        if self._inflate.unused_data:
+            return True
+
+        # Python 2 doesn't tell when the stream has ended, but anything fed
+        # after its end is left unused
+        probe = self._inflate.copy()
         try:
-            data = self.recv (self.ac_in_buffer_size)
-        except socket.error, why:
-            self.handle_error()
-            return
+            probe.decompress(b'\0')
+        except zlib.error:
+            return False
+        return bool(probe.unused_data)
 
-        if hasattr(self.socket, 'ssl_version'):
-        # Fix for SSL wrapped sockets, checks if there is any data pending in
-        # the SSL Socket's internal buffer and recv's it before contining.
-            ssl_data_remainder = ''
-            amount_of_data_left_over = self.socket.pending()
-            while amount_of_data_left_over > 0:
-                # while the ssl socket still has some data pending
-                try:
-                    # get the remaining data
-                    ssl_data_remainder += self.recv(amount_of_data_left_over)
-                except socket.error, why:
-                    self.handle_error()
-                    return
-                # check if there is anymore remaining
-                amount_of_data_left_over = self.socket.pending()
-            data += ssl_data_remainder  # add the remainder to the data
-        self.ac_in_buffer = self.ac_in_buffer + data
+    def _close(self, data):
+        self._ended, self._tail = True, b''
 
-        # Continue to search for self.terminator in self.ac_in_buffer,
-        # while calling self.collect_incoming_data.  The while loop
-        # is necessary because we might read several data+terminator
-        # combos with a single recv(4096).
+        # The terminating line may be compressed along with the data
+        if data.endswith(self._TERMINATOR):
+            data = data[:-len(self._TERMINATOR)+len(CRLF)]
+            self.done = True
+        elif not self.trailer:
+            self.done = True
+        if data.endswith(CRLF):
+            data = data[:-len(CRLF)]
+        if data or self._started:
+            self.output(data)
 
-        while self.ac_in_buffer:
-            lb = len(self.ac_in_buffer)
-            terminator = self.get_terminator()
-            if not terminator:
-                # no terminator, collect it all
-                self.collect_incoming_data (self.ac_in_buffer)
-                self.ac_in_buffer = ''
-            elif isinstance(terminator, int) or isinstance(terminator, long):
-                # numeric terminator
-                n = terminator
-                if lb < n:
-                    self.collect_incoming_data (self.ac_in_buffer)
-                    self.ac_in_buffer = ''
-                    self.terminator = self.terminator - lb
-                else:
-                    self.collect_incoming_data (self.ac_in_buffer[:n])
-                    self.ac_in_buffer = self.ac_in_buffer[n:]
-                    self.terminator = 0
-                    self.found_terminator()
-            else:
-                # 3 cases:
-                # 1) end of buffer matches terminator exactly:
-                #    collect data, transition
-                # 2) end of buffer matches some prefix:
-                #    collect data to the prefix
-                # 3) end of buffer does not match any prefix:
-                #    collect data
-                terminator_len = len(terminator)
-                index = self.ac_in_buffer.find(terminator)
-                if index != -1:
-                    # we found the terminator
-                    if index > 0:
-                        # don't bother reporting the empty string
-                        # (source of subtle bugs)
-                        self.collect_incoming_data (self.ac_in_buffer[:index])
-                    self.ac_in_buffer = self.ac_in_buffer[index+terminator_len:]
-                    # This does the Right Thing if the terminator
-                    # is changed here.
-                    self.found_terminator()
-                else:
-                    # check for a prefix of the terminator
-                    index = asynchat.find_prefix_at_end (self.ac_in_buffer, terminator)
-                    if index:
-                        if index != lb:
-                            # we found a prefix, collect up to the prefix
-                            self.collect_incoming_data (self.ac_in_buffer[:-index])
-                            self.ac_in_buffer = self.ac_in_buffer[-index:]
-                        break
-                    else:
-                        # no prefix, collect it all
-                        self.collect_incoming_data (self.ac_in_buffer)
-                        self.ac_in_buffer = ''
+def overview_field(name):
+    """
+    Returns the normalised name of a ``LIST OVERVIEW.FMT`` field, e.g.
+    ``message-id`` for ``Message-ID:`` and ``bytes`` for ``:bytes``, and
+    whether the field's values are prefixed with the header name ("full").
+    """
+    name = name.strip()
+    full = name.lower().endswith(":full")
+    if full:
+        name = name[:-len(":full")]
+    return name.strip(":").lower(), full
 
-    def handle_read(self):
+class PackedStrings:
+    """
+    A list-like column of strings, stored in a single ``bytearray`` with the
+    end offset of every value in an ``array``, so a value costs little more
+    than its length.  Values are decoded when they are read.
+    """
+    def __init__(self):
+        self.data = bytearray()
+        self.ends = array.array(_INT64)
+
+    def __len__(self):
+        return len(self.ends)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self.ends)
+        end   = self.ends[index]
+        start = self.ends[index-1] if index > 0 else 0
+        return _native(bytes(self.data[start:end]))
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def extend(self, values):
         """
-        Overload the default ``handle_read`` method to support SSL handshake
-        and also use the custom ``_handle_read`` method.
+        Appends the byte strings in ``values``.
         """
-        if self.established:
-            return self._handle_read()
-        self._handshake()
+        end  = self.ends[-1] if self.ends else 0
+        ends = []
+        for value in values:
+            end += len(value)
+            ends.append(end)
+        self.ends.extend(ends)
+        self.data.extend(b''.join(values))
 
-    def collect_incoming_data(self, data):
-        self.logger.debug('collect_incoming_data() -> (%d)', len(data))
+class OverviewRecord(object):    # __slots__ need a new-style class
+    """
+    A single article of an :class:`Overview`.  Its fields are read from the
+    columns when they are accessed, as attributes (``subject``,
+    ``message_id``) or items (``record["message-id"]``).
+    """
+    __slots__ = ("overview", "index")
 
-        #print "data =", `data`
-        if self._request is None:
-            notempty, self._request = self._fifo.pop()
+    def __init__(self, overview, index):
+        self.overview = overview
+        self.index    = index
 
-        if self._request is None:
-            # If we still don't have a request, then we need to construct one
-            self._request = Request(self, "UNKNOWN")
+    def __repr__(self):
+        return "<OverviewRecord %d>" % self.number
 
-        self._request.handle_data(data)
+    def __getitem__(self, name):
+        return self.overview.column(name)[self.index]
 
-    def found_terminator(self):
-        #if self.interactive:
-        #    time.sleep(0.3)
+    def __getattr__(self, name):
+        try:
+            return self[name.replace("_", "-")]
+        except KeyError:
+            raise AttributeError(name)
 
-        self.logger.debug('found_terminator()')
+class Overview:
+    """
+    Parses the data block of an ``OVER``/``XOVER`` response into columns as
+    it is received, so no object is created per article.  The article
+    numbers, ``bytes`` and ``lines`` are stored in ``array``s, the other
+    fields in :class:`PackedStrings`.  Values of the fields in
+    ``intern_fields`` repeat a lot, so they are kept in lists of interned
+    strings instead.
 
-        # This should never happen
-        if not self._request:
-            self.logger.error('No request found')
-            return
+    ``fmt`` is the ``LIST OVERVIEW.FMT`` of the server (see
+    :func:`NNTP.over`), by default the format of RFC 3977.  If ``fields``
+    is given only those fields (see :func:`overview_field` for the names)
+    are kept.  The format can be changed until data has been fed.
 
-        # Finish the request
-        self._request.finish()
+    An instance can be used as the ``sink`` of a request.  Indexing or
+    iterating it gives :class:`OverviewRecord` objects.
+    """
+    def __init__(self, fmt=None, fields=None, intern_fields=("from",)):
+        self.format        = fmt or DEFAULT_OVERVIEW_FMT
+        self.fields        = fields
+        self.intern_fields = intern_fields
 
-        # Reset request
-        request = self._request
-        self._request = None
+        self.number   = array.array(_INT64)
+        self._columns = None
+        self._tail    = b''
 
-        # Reset terminator
-        self.set_terminator(CRLF)
+    def __call__(self, data):
+        self.feed(data)
 
-        if request.command == "UNKNOWN":
-            # An "UNKNOWN" request means that we received an unsolicited
-            # response from the server.  This happens on initial connection
-            # to the server.  Some servers also disconnect the client due to
-            # idleness
-            code = request.response_code
-            if code in ("200", "201"):
-                self._do_callback("on_connect", request)
-            elif code == "400":
-                # XXX: Is this general enough?
-                self._do_callback("on_disconnect", request)
-            else:
-                self.logger.warn("UNKNOWN Request; code %s" % request.response_code)
+    def __len__(self):
+        return len(self.number)
 
-        # Get the name of the callback and try to call it
-        callbacks = request.get_callbacks()
-        self._do_callback(callbacks, request)
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Overview index out of range")
+        return OverviewRecord(self, index)
 
-        # Send the next request in the FIFO
-        self.sendrequest()
+    def __iter__(self):
+        for index in range(len(self)):
+            yield OverviewRecord(self, index)
 
-    def addrequest(self, request):
+    def column(self, name):
         """
-        Adds a :class:`Request` to the request FIFO.  If there isn't a currently
-        pending request then this will also initiate the request.
+        Returns the values of the field ``name`` for every article.
         """
-        self._fifo.push(request)
-        if self._request is None:
-            self.sendrequest()
+        if name == "number":
+            return self.number
+        self._setup()
+        for field, _, _, values in self._columns:
+            if field == name:
+                return values
+        raise KeyError(name)
 
-    def sendrequest(self):
+    def clear(self):
         """
-        Gets the next :class:`Request` from the request FIFO and sends the
-        command to the server.
+        Discards every parsed record.
         """
-        #if not self._connected:
-        #    # We're not ready yet
-        #    return
+        self.number   = array.array(_INT64)
+        self._columns = None
+        self._tail    = b''
 
-        _, request = self._fifo.pop()
+    def _setup(self):
+        """
+        Creates the columns once the format is final: a tuple of the name,
+        the index of the field in a line, whether it is "full" and the
+        values for every field that is kept.
+        """
+        if self._columns is not None:
+            return
+        self._columns = []
+        for index, name in enumerate(self.format):
+            name, full = overview_field(name)
+            if self.fields is not None and name not in self.fields:
+                continue
+            if name in OVERVIEW_NUMBER_FIELDS:
+                values = array.array(_INT64)
+            elif name in self.intern_fields:
+                values = []
+            else:
+                values = PackedStrings()
+            self._columns.append((name, index + 1, full, values))
 
-        if request:
-            self._request = request
+    def feed(self, data):
+        """
+        Parses the complete lines in the next chunk of the (decoded) data
+        block, the rest is kept until more data arrives.
+        """
+        if self._tail:
+            data = self._tail + data
+        end = data.rfind(CRLF)
+        if end == -1:
+            self._tail = data
+            return
+        self._tail = data[end+len(CRLF):]
+        if not end:
+            return
+        self._setup()
 
-            terminator = self._request.getterminator()
+        rows  = [line.split(b'\t') for line in data[:end].split(CRLF)]
+        width = len(self.format) + 1
+        for row in rows:
+            if len(row) < width:
+                row.extend([b''] * (width - len(row)))
+        # Transpose once, so each column is handled in a single pass
+        fields = list(zip(*rows))
 
-            self.logger.debug("terminator = %s" % `terminator`)
-            self.set_terminator(terminator)
+        self.number.extend(self._numbers(fields[0]))
+        for name, index, full, values in self._columns:
+            column = fields[index]
+            if full:
+                # "Xref: host group:1" -> "host group:1"
+                column = [value[value.find(b':')+1:].lstrip()
+                          for value in column]
+            if name in OVERVIEW_NUMBER_FIELDS:
+                values.extend(self._numbers(column))
+            elif name in self.intern_fields:
+                values.extend([_intern(_native(value)) for value in column])
+            else:
+                values.extend(column)
 
-            line = self._request.getline()
-            self.logger.debug("sending command: %s" % line.strip())
-            self.push(line)
+    @staticmethod
+    def _numbers(column):
+        try:
+            return array.array(_INT64, [int(value) for value in column])
+        except ValueError:
+            # Missing or malformed, count them as 0
+            return array.array(_INT64, [int(value) if value.isdigit() else 0
+                                        for value in column])
 
-    def ready(self):
-        return self._connected
+_callback_names = {}
 
-    def verbose(self, stream=sys.stdout, level=logging.DEBUG,
-                format="[%(levelname)-8s] %(message)s"):
-        logging.basicConfig(stream=stream, level=level, format=format)
+def callback_name(command):
+    """
+    Returns the name of the default callback for ``command``, for example
+    ``on_mode_reader`` for ``MODE READER``.
+    """
+    try:
+        return _callback_names[command]
+    except KeyError:
+        name = "on_%s" % "_".join(command.lower().split())
+        _callback_names[command] = name
+        return name
 
-    ############################################################################
-    # Client functions
-    ############################################################################
-    def username(self, username, callback=None):
-        """
-        Send an
-        `AUTHINFO USER <https://tools.ietf.org/html/rfc2980#section-3.1.1>`_
-        command with the given ``username``.
+class Future:
+    """
+    A lightweight handle for the result of a :class:`Request`, returned by
+    the client methods of :class:`NNTP` and :class:`NNTPPool`.  Once the
+    request has been completed the future resolves to the request itself, so
+    ``result()`` gives access to its ``response_code``, ``payload`` and so on.
 
-        :callback: ``on_username``
-        """
-        self.addrequest(Request(self, "AUTHINFO", "USER", username,
-                                callbacks=(callback, "on_username")))
+    ``created`` and ``completed`` are the times the future was created and
+    resolved, ``elapsed`` the number of seconds in between.  Use
+    :func:`then` to chain further work and :func:`gather` to wait for a
+    number of futures at once.
+    """
+    def __init__(self, request=None):
+        self.request   = request
+        self.created   = time.time()
+        self.completed = None
 
-    def password(self, password, callback=None):
-        """
-        Send an
-        `AUTHINFO PASS <https://tools.ietf.org/html/rfc2980#section-3.1.1>`_
-        command with the given ``password``.
+        self._done      = False
+        self._result    = None
+        self._exception = None
+        self._callbacks = []
 
-        :callback: ``on_username``.
-        """
-        self.addrequest(Request(self, "AUTHINFO", "PASS", password,
-                                callbacks=(callback, "on_password")))
+    def __repr__(self):
+        state = "done" if self._done else "pending"
+        return "<Future %s: %r>" % (state, self.request)
 
-    def capabilities(self, callback=None):
-        """
-        Send a `CAPABILITIES <https://tools.ietf.org/html/rfc3977#section-5.2>`_
-        command.
+    @property
+    def elapsed(self):
+        if self.completed is None:
+            return None
+        return self.completed - self.created
 
-        :callback: `on_capabilities`
-        """
-        self.addrequest(Request(self, "CAPABILITIES",
-                                callbacks=(callback, "on_capabilities")))
+    def done(self):
+        return self._done
 
-    def mode_reader(self, callback=None):
+    def result(self):
         """
-        Send a `MODE READER <https://tools.ietf.org/html/rfc3977#section-5.3>`_
-        command.
-
-        :callback: ``on_mode_reader``
+        Returns the result, or raises the exception, of the future.  Raises
+        :class:`NNTPError` if the future hasn't been resolved yet.
         """
-        self.addrequest(Request(self, "MODE READER",
-                                callbacks=(callback, "on_mode_reader")))
+        if not self._done:
+            raise NNTPError("Result is not ready")
+        if self._exception is not None:
+            raise self._exception
+        return self._result
 
-    def quit(self, callback=None):
-        """
-        Send a `QUIT <https://tools.ietf.org/html/rfc3977#section-5.4>`_
-        command.
+    def exception(self):
+        return self._exception
 
-        :callback: ``on_quit``
+    def add_done_callback(self, callback):
         """
-        self.addrequest(Request(self, "QUIT",
-                                callbacks=(callback, "on_quit")))
-
-    def group(self, name, callback=None):
+        Calls ``callback`` with the future once it has been resolved, or
+        right away if it already has been.
         """
-        Send a `GROUP <https://tools.ietf.org/html/rfc3977#section-6.1.1>`_
-        command, where ``name`` is a `string` of the desired group.
+        if self._done:
+            callback(self)
+        else:
+            self._callbacks.append(callback)
 
-        :callback: ``do_group``
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def set_exception(self, exception):
+        self._exception = exception
+        self._finish()
+
+    def _finish(self):
+        self._done     = True
+        self.completed = time.time()
+
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def _copy(self, other):
         """
-        self.addrequest(Request(self, "GROUP", name,
-                                callbacks=(callback, "on_group")))
+        Resolves this future the same way as the resolved future ``other``.
+        """
+        if other.exception() is not None:
+            self.set_exception(other.exception())
+        else:
+            self.set_result(other.result())
 
-    def listgroup(self, group=None, range=None, callback=None):
+    def then(self, callback):
         """
-        Send a `LISTGROUP <https://tools.ietf.org/html/rfc3977#section-6.1.2>`_
-        command.  If ``group`` is provided, then that group will be selected,
-        otherwise the previously selected group will be used.  See link for 
-        format of ``range``.
+        Returns a new future which resolves to the value returned by
+        ``callback`` when called with the result of this future.  If
+        ``callback`` returns a future, the new future resolves to its result.
+        Exceptions are passed on to the new future.
+        """
+        future = Future(self.request)
 
-        :callback: ``on_listgroup``
+        def chain(done):
+            if done.exception() is not None:
+                future.set_exception(done.exception())
+                return
+            try:
+                value = callback(done.result())
+            except Exception as e:
+                future.set_exception(e)
+                return
+            if isinstance(value, Future):
+                value.add_done_callback(future._copy)
+            else:
+                future.set_result(value)
+
+        self.add_done_callback(chain)
+        return future
+
+def gather(*futures):
+    """
+    Returns a :class:`Future` which resolves to the list of results of the
+    given ``futures``, in the same order, once all of them have been
+    resolved.  If any of them fails, the returned future fails with the
+    first exception.
+    """
+    gathered  = Future()
+    remaining = [len(futures)]
+
+    def done(future):
+        if gathered.done():
+            return
+        if future.exception() is not None:
+            gathered.set_exception(future.exception())
+            return
+        remaining[0] -= 1
+        if not remaining[0]:
+            gathered.set_result([f.result() for f in futures])
+
+    if not futures:
+        gathered.set_result([])
+    for future in futures:
+        future.add_done_callback(done)
+    return gathered
+
+class Request:
+    """
+    
+    """
+    # Shared by every request, there can be a great many of them
+    logger = logging.getLogger("NNTP::Request")
+
+    def __init__(self, nntp, command, *args, **kwargs):
+        self.command          = command.upper()
+        self.args             = args
+        self.pipeline         = self.command not in NO_PIPELINE_COMMANDS
+        self.callbacks        = kwargs.get("callbacks", None)
+        self.nntp             = nntp
+        self.future           = None
+        self.queued_at        = None
+
+        # The :class:`Overview` an overview response is parsed into
+        self.overview         = None
+
+        # The resolved callbacks, set by the connection the request is added to
+        self.handlers = ()
+
+        # A callable (or file-like object) that the decoded data block of a
+        # multi-line response is passed to as it arrives, instead of being
+        # collected in ``payload``
+        self.sink = kwargs.get("sink", None)
+        self._sink_reset = getattr(self.sink, "reset", None)
+        self._sink_file  = None
+        if hasattr(self.sink, "write"):
+            if hasattr(self.sink, "tell") and hasattr(self.sink, "truncate"):
+                # Data written to it can be taken back, see ``rewind``
+                self._sink_file = self.sink
+            self.sink = self.sink.write
+
+        self.reset()
+
+    def rewind(self):
         """
-        self.addrequest(Request(self, "LISTGROUP", group, range,
-                                callbacks=(callback, "on_listgroup")))
+        Prepares the request to be sent again, e.g. on another connection
+        after its own was lost.  A ``sink`` with a ``reset`` method is reset,
+        a seekable file is truncated to where the data began, along with the
+        response received so far.  Returns ``False`` if data already went to
+        a sink that can't be taken back, the request mustn't be sent again.
+        """
+        if self._sink_reset is not None:
+            self._sink_reset()
+        elif self._sink_started:
+            if self._sink_offset is None:
+                return False
+            self._sink_file.seek(self._sink_offset)
+            self._sink_file.truncate()
+        self.reset()
+        return True
 
-    def last(self, callback=None):
+    def reset(self):
         """
-        Send a `LAST <https://tools.ietf.org/html/rfc3977#section-6.1.3>`_
-        command.
+        Discards any response received so far.  The ``sink`` is left alone,
+        see :func:`rewind`.
+        """
+        self.response_code    = None
+        self._sink_started    = False
+        self._sink_offset     = None
+        self.response_message = ""
+        self.response_data    = []
+        if self.overview is not None:
+            self.overview.clear()
+        self.status_line      = None
+        self.multiline        = False
+        self.payload          = None
+        self._decoder         = None
+        self._lines           = None
 
-        :callback: ``on_last``
+        # Decoders of a compressed data block, see :class:`InflateDecoder`
+        self._inflater        = None
+        self._encoded         = None
+        self._yenc            = None
+
+        # Only recorded if the connection has :class:`Metrics`
+        self.sent_at          = None
+        self.first_byte_at    = None
+        self.completed_at     = None
+        self.bytes_received   = 0
+
+    @property
+    def latency(self):
         """
-        self.addrequest(Request(self, "LAST",
-                                callbacks=(callback, "on_last")))
+        The number of seconds from sending the request to receiving the whole
+        response, if metrics were recorded.
+        """
+        if self.sent_at is None or self.completed_at is None:
+            return None
+        return self.completed_at - self.sent_at
 
-    def next(self, callback=None):
+    def __repr__(self):
+        return "<%s>" % str(self)
+
+    def __str__(self):
+        return "Request: %s %s" % (self.command,
+                                   " ".join(str(arg) for arg in self.args
+                                            if arg))
+
+    def getline(self):
         """
-        Send a `NEXT <https://tools.ietf.org/html/rfc3977#section-6.1.4>`_
-        command.
+        Returns a fully formatted request, including terminating characters.
+        """
+        cmd = [self.command]
+        for arg in self.args:
+            if arg:
+                cmd.append(str(arg))
+        return _bytes(" ".join(cmd).strip())+CRLF
 
-        :callback: ``on_next``
+    def getterminator(self):
         """
-        self.addrequest(Request(self, "NEXT",
-                                callbacks=(callback, "on_next")))
+        Returns the terminator for the part of the response that is currently
+        expected.  Every response begins with a single status line, whether a
+        multi-line data block follows is only known once the response code
+        has been read.
+        """
+        if self.multiline:
+            return MULTILINE_TERMINATOR
+        return CRLF
 
-    def article(self, article, callback=None):
+    def is_multiline(self, code):
         """
-        Send a `ARTICLE <https://tools.ietf.org/html/rfc3977#section-6.2.1>`_
-        command.  If a group has been selected (via a prior call to
-        :func:`group`), then ``article`` can be an integer.  Alternativley,
-        ``article`` can be a unique message-id string of the format
-        ``<message-id>``.
+        Returns ``True`` if a response to this request with the status ``code``
+        is followed by a multi-line data block.
+        """
+        if code not in LONG_RESP_CODES:
+            return False
+        commands = SHARED_RESP_CODES.get(code)
+        return commands is None or self.command in commands
 
-        :callback: ``on_article``
+    def handle_terminator(self):
         """
-        self.addrequest(Request(self, "ARTICLE", article,
-                                callbacks=(callback, "on_article")))
+        Called when the current terminator has been found.  Returns the
+        terminator for the next part of the response, or ``None`` if the
+        response is complete.
+        """
+        if self.status_line is None:
+            self.status_line = b''.join(self.response_data)
+            self.response_data = []
+
+            status = _native(self.status_line)
+            self.response_code, self.response_message = \
+                status[:3], status[3:].strip()
+
+            if self.is_multiline(self.response_code):
+                self.multiline = True
+                self._decoder  = MultilineDecoder()
+                if self.sink is None:
+                    self.payload = bytearray()
+
+                if "COMPRESS=GZIP" in self.response_message.upper():
+                    # ``XFEATURE COMPRESS GZIP``, the data block is only
+                    # complete once it has been decompressed
+                    self._inflater = InflateDecoder(self._decode_block,
+                                                    trailer=True)
+                    return self._inflater
+                if self.command == "XZVER":
+                    # A yEnc encoded, raw deflate compressed data block
+                    self._inflater = InflateDecoder(self._decode_block,
+                                                    -zlib.MAX_WBITS)
+                    self._encoded  = MultilineDecoder()
+                    self._yenc     = YencDecoder(self._inflater)
+                return MULTILINE_TERMINATOR
+
+        self.finish()
+        return None
+
+    def get_callbacks(self):
+        return self.callbacks or (callback_name(self.command),)
 
-    def head(self, article, callback=None):
+    def handle_data(self, data):
         """
-        Send a `HEAD <https://tools.ietf.org/html/rfc3977#section-6.2.2>`_
-        command.  See :func:`article` for a description of allowable forms for
-        ``article``.
+        Called when data has been received from the socket.
+        """
+        self.logger.debug("handle_data()")
+        if self._decoder is None:
+            # Part of the status line
+            self.response_data.append(data)
+            return
 
-        :callback: ``on_head``
+        if self._encoded is not None:
+            # The decompressed data is passed on to ``_decode_block``
+            self._yenc.feed(self._encoded.feed(data))
+            return
+        self._decode_block(data)
+
+    def _decode_block(self, data):
         """
-        self.addrequest(Request(self, "HEAD", article,
-                                callbacks=(callback, "on_head")))
+        Decodes the data block as it arrives.
+        """
+        data = self._decoder.feed(data)
+        if data:
+            if self.sink is None:
+                self.payload.extend(data)
+            else:
+                if not self._sink_started:
+                    self._start_sink()
+                self.sink(data)
 
-    def body(self, article, callback=None):
+    def _start_sink(self):
         """
-        Send a `BODY <https://tools.ietf.org/html/rfc3977#section-6.2.3>`_
-        command.  See :func:`article` for a description of allowable forms for
-        ``article``.
+        Called before the first data goes to the ``sink``.
+        """
+        self._sink_started = True
+        if self._sink_file is not None:
+            try:
+                self._sink_offset = self._sink_file.tell()
+            except (IOError, OSError, ValueError):
+                # Not seekable after all
+                pass
 
-        :callback: ``on_body``
+    @property
+    def lines(self):
         """
-        self.addrequest(Request(self, "BODY", article,
-                                callbacks=(callback, "on_body")))
+        A list of the status line followed by every line of the decoded data
+        block.  The list is built when first accessed, see :func:`iterlines`
+        for a lazy alternative.
+        """
+        if self.status_line is None:
+            return None
+        if self._lines is None:
+            self._lines = [self.status_line]
+            if self.payload:
+                # The payload ends with a CRLF, so the last item is empty
+                self._lines.extend(bytes(self.payload).split(CRLF)[:-1])
+        return self._lines
 
-    def stat(self, article, callback=None):
+    def iterlines(self):
         """
-        Send a `STAT <https://tools.ietf.org/html/rfc3977#section-6.2.4>`_
-        command.  See :func:`article` for a description of allowable forms for
-        ``article``.
+        Lazily yields the lines of the decoded data block, without their
+        CRLF.  Unlike :attr:`lines` the status line is not included.
+        """
+        if not self.payload:
+            return
+        view, start, end = memoryview(self.payload), 0, len(self.payload)
+        while start < end:
+            index = self.payload.find(CRLF, start)
+            yield view[start:index].tobytes()
+            start = index + len(CRLF)
 
-        :callback: ``on_stat``
+    def finish(self):
         """
-        self.addrequest(Request(self, "STAT", article,
-                                callbacks=(callback, "on_stat")))
+        Called once all data has been received.
+        """
+        self.logger.debug("%s -> finish()", self)
 
-    def date(self, callback=None):
+        if self.status_line is None:
+            raise NNTPDataError("No data received")
+
+        if self._encoded is not None:
+            self._yenc.feed(self._encoded.close())
+        if self._inflater is not None:
+            self._inflater.close()
+
+        if self._decoder is not None:
+            data = self._decoder.close()
+            if data:
+                if self.sink is None:
+                    self.payload.extend(data)
+                else:
+                    if not self._sink_started:
+                        self._start_sink()
+                    self.sink(data)
+
+        self.logger.debug("code = %s", self.response_code)
+        self.logger.debug("msg  = %s", self.response_message)
+
+class Metrics:
+    """
+    Collects request timings and throughput from the connections it is given
+    to (see the ``metrics`` argument of :class:`NNTP` and
+    :class:`AsyncNNTP`).  A connection with metrics records when each
+    request was queued, sent, started to receive its response and completed,
+    and how many bytes the response took.
+
+    For each command the number of requests, bytes and the latency (from
+    sending the request to receiving the whole response) are aggregated,
+    the latencies into a histogram with ``buckets`` as upper bounds in
+    seconds.  :func:`snapshot` returns the current state as a ``dict`` and
+    the callables in ``exporters`` are called with the connection and each
+    completed request.  An :class:`NNTPPool` given ``metrics`` registers
+    itself as well, so that the requests waiting in its queue are counted.
+    """
+    buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+               2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self.started     = time.time()
+        self.commands    = {}
+        self.connections = []
+        self.pools       = []
+        self.exporters   = []
+
+    def register(self, conn):
         """
-        Send a `DATE <https://tools.ietf.org/html/rfc3977#section-7.1>`_
-        command.
+        Adds ``conn`` to the connections included in snapshots.
+        """
+        conn._metrics_started   = time.time()
+        conn._metrics_completed = 0
+        self.connections.append(conn)
 
-        :callback: ``on_date``
+    def register_pool(self, pool):
         """
-        self.addrequest(Request(self, "DATE",
-                                callbacks=(callback, "on_date")))
+        Adds ``pool`` to the pools whose queues are included in snapshots.
+        """
+        self.pools.append(pool)
 
-    def list(self, callback=None):
+    def add_exporter(self, exporter):
         """
-        Send a `LIST <https://tools.ietf.org/html/rfc3977#section-7.6.1>`_
-        command.
+        Calls ``exporter`` with the connection and each completed request.
+        """
+        self.exporters.append(exporter)
 
-        :callback: ``on_list``
+    def record(self, conn, request):
         """
-        self.addrequest(Request(self, "LIST",
-                                callbacks=(callback, "on_list")))
+        Called by ``conn`` when ``request`` has been completed.
+        """
+        stats = self.commands.get(request.command)
+        if stats is None:
+            stats = self.commands[request.command] = {
+                "count":            0,
+                "bytes":            0,
+                "latency_total":    0.0,
+                "latency_max":      0.0,
+                "first_byte_total": 0.0,
+                "wait_total":       0.0,
+                "histogram":        [0] * (len(self.buckets) + 1),
+            }
 
-    ############################################################################
-    # Internal callback functions
-    ############################################################################
-    def _on_connect(self, request):
-        self.welcome = request.response_message
+        latency = request.latency
+        stats["count"]            += 1
+        stats["bytes"]            += request.bytes_received
+        stats["latency_total"]    += latency
+        stats["latency_max"]       = max(stats["latency_max"], latency)
+        stats["first_byte_total"] += request.first_byte_at - request.sent_at
+        if request.queued_at is not None:
+            stats["wait_total"] += request.sent_at - request.queued_at
+        stats["histogram"][bisect.bisect_left(self.buckets, latency)] += 1
 
-        # If we were given a username, try to authenticate
-        if self.__username:
-            self.username(self.__username)
-        else:
-            self._connected = True
-            self._do_callback("on_ready")
+        conn._metrics_completed += 1
 
-    def _on_quit(self, request):
-        self._connected = False
+        for exporter in self.exporters:
+            exporter(conn, request)
 
-    def _on_disconnect(self, request):
-        self._connected = False
+    def snapshot(self):
+        """
+        Returns the aggregated statistics.  Averages are in seconds, the
+        last histogram bucket counts the latencies above the largest bound.
+        """
+        now = time.time()
 
-    def _on_username(self, request):
-        if request.response_code == "381":
-            # Password is required
-            if self.__password:
-                self.password(self.__password)
-            else:
-                self.logger.error("Password required but not provided")
-        elif request.response_code == "281":
-            self._connected = True
-            self._do_callback("on_ready")
+        commands = {}
+        for command, stats in self.commands.items():
+            count = stats["count"]
+            commands[command] = {
+                "count":          count,
+                "bytes":          stats["bytes"],
+                "latency_avg":    stats["latency_total"] / count,
+                "latency_max":    stats["latency_max"],
+                "first_byte_avg": stats["first_byte_total"] / count,
+                "wait_avg":       stats["wait_total"] / count,
+                "histogram":      list(zip(self.buckets + (None,),
+                                           stats["histogram"])),
+            }
+
+        connections = []
+        for conn in self.connections:
+            elapsed = max(now - conn._metrics_started, 1e-9)
+            connections.append({
+                "host":             conn.host,
+                "port":             conn.port,
+                "ready":            conn.ready(),
+                "outstanding":      conn.outstanding(),
+                "queued":           conn.queued(),
+                "completed":        conn._metrics_completed,
+                "bytes":            conn.bytes_received,
+                "bytes_per_second": conn.bytes_received / elapsed,
+            })
+
+        pools = []
+        for pool in self.pools:
+            pools.append({
+                "host":      pool.host,
+                "port":      pool.port,
+                "queued":    len(pool._queue),
+                "pending":   pool.pending,
+                "completed": pool.completed,
+            })
+
+        # Requests wait in a pool's queue until a connection has room
+        queued = sum(conn["queued"] for conn in connections) + \
+                 sum(pool["queued"] for pool in pools)
+        return {
+            "elapsed":     now - self.started,
+            "commands":    commands,
+            "connections": connections,
+            "pools":       pools,
+            "queued":      queued,
+        }
+
+class BaseNNTP:
+    """
+    The parts of an NNTP client that don't depend on how it talks to the
+    server: queueing and pipelining of requests, framing of the responses,
+    callbacks and the client commands.  :class:`NNTP` and :class:`AsyncNNTP`
+    add the network transport, ``push`` to send data, a terminator (see
+    ``set_terminator``) and feeding the receive buffer to
+    ``_process_input``.
+
+    Every client method returns the future of its request (a :class:`Future`
+    for :class:`NNTP`), which is resolved directly once the response has
+    been received, after the callbacks have been called.
+    """
+    # Size of the receive buffer and of each read from the socket
+    recv_buffer_size = 256 * 1024
+
+    # Compression level used for the commands sent once ``COMPRESS DEFLATE``
+    # is active, they are short so there is little to gain from a high level
+    compress_level = 1
+
+    # Seconds before reconnecting with ``auto_reconnect``, doubled after every
+    # attempt that fails up to ``reconnect_max_delay``.  The actual delay is
+    # picked at random from the upper half, so that the connections of a
+    # pool don't all come back at the same moment.
+    reconnect_delay     = 1.0
+    reconnect_max_delay = 60.0
+
+    def __init__(self, host, port=119, user=None, password=None,
+                 use_ssl=None, pipeline_depth=1, metrics=None,
+                 compress=False, negative_cache=None, auto_reconnect=False,
+                 timeout=None):
+        self.host        = host
+        self.port        = port
+        self.__username  = user
+        self.__password  = password
+        self.logger      = logging.getLogger('NNTP')
+
+        # The :class:`NNTPPool` this connection belongs to, if any
+        self.pool = None
+
+        self.use_ssl = use_ssl
+        if self.use_ssl is None:
+            self.use_ssl = port in SSL_PORTS
+
+        # ``pipeline_depth`` is the maximum number of requests that will be
+        # written to the server before their responses have been received.
+        self.pipeline_depth = max(1, int(pipeline_depth))
+
+        self._request  = None                # Request receiving a response
+        self._inflight = collections.deque() # Sent, awaiting a response
+        self._fifo     = collections.deque() # Not yet sent
+
+        # Receive buffer, data between ``_rstart`` and ``_rend`` has been
+        # received but not consumed yet
+        self._rbuf   = bytearray(self.recv_buffer_size)
+        self._rmv    = memoryview(self._rbuf)
+        self._rstart = 0
+        self._rend   = 0
+
+        # Set while received data is handled, see ``_process_input``
+        self._processing = False
+
+        # Total number of (decompressed) bytes put in the receive buffer
+        self._rtotal = 0
+
+        # If set, ``COMPRESS DEFLATE`` (RFC 8054) is negotiated once
+        # authenticated.  While it is active ``_inflate`` decompresses the
+        # received data before it is framed and ``_deflate`` compresses the
+        # commands sent.
+        self.compress = compress
+        self._inflate = None
+        self._deflate = None
+
+        # Keyword -> arguments, from the last ``CAPABILITIES`` response
+        self.server_capabilities = {}
+
+        # The fields of the ``LIST OVERVIEW.FMT`` response, once received,
+        # and the :class:`Overview` objects waiting for them
+        self.overview_format   = None
+        self._overview_waiting = None
+
+        # How :func:`over` responses are compressed, if at all: "GZIP" once
+        # ``XFEATURE COMPRESS GZIP`` has been enabled, or "XZVER" to use the
+        # ``XZVER`` command.  Set by the negotiation of ``compress``.
+        self.overview_compression = None
+
+        self._connected = False
+        self.welcome    = ""
+
+        # Callback name -> bound methods, see ``_handlers``
+        self._handler_cache = {}
+
+        # Total number of bytes received from the server, as sent on the wire
+        self.bytes_received = 0
+
+        # The :class:`Metrics` to record request timings in, if any
+        self.metrics = metrics
+        if self.metrics is not None:
+            self.metrics.register(self)
+
+        # The :class:`NegativeCache` of articles known to be missing, if any
+        self.negative_cache = negative_cache
+
+        # The group selected on the server, and the one that will be once
+        # the queued requests have been sent
+        self.group_name      = None
+        self._selected_group = None
+
+        # Reconnect when the connection is lost, see ``_connection_dropped``,
+        # and drop it if the server sends nothing for ``timeout`` seconds
+        # while a response is awaited
+        self.auto_reconnect = auto_reconnect
+        self.timeout        = timeout
+        self._closing       = False  # Closed on purpose, no reconnect
+        self._attempts      = 0      # Reconnects since the last success
+        self._replay        = None   # Requests held until reconnected
+        self._last_activity = time.time()
+
+    def _do_callback(self, callbacks, *args, **kwargs):
+        for handler in self._resolve_callbacks(callbacks):
+            handler(*args, **kwargs)
+
+    def _resolve_callbacks(self, callbacks):
+        """
+        Returns a tuple of the callables to call for ``callbacks``, which can
+        be a callback name, a callable or an iterable of those.  A name
+        resolves to the internal ``_<name>`` method followed by the
+        user-defined ``<name>`` method, if they exist.
+        """
+        if isinstance(callbacks, string_types):
+            return self._handlers(callbacks)
+
+        if not hasattr(callbacks, "__iter__"):
+            self.logger.error("Callbacks is not an iterable")
+            return ()
+
+        handlers = ()
+        for callback in callbacks:
+            if not callback:
+                continue
+
+            if isinstance(callback, string_types):
+                handlers += self._handlers(callback)
+            elif callable(callback):
+                handlers += (callback,)
+        return handlers
+
+    def _handlers(self, name):
+        """
+        Returns the bound methods for the callback ``name``.  They are only
+        looked up the first time a name is used on this connection, so
+        callbacks should be defined before the connection is used.
+        """
+        try:
+            return self._handler_cache[name]
+        except KeyError:
+            pass
+
+        handlers = ()
+        # Try internal callback first, then the user-defined callback
+        for attr in ("_%s" % name, name):
+            if hasattr(self, attr):
+                handlers += (getattr(self, attr),)
+
+        self._handler_cache[name] = handlers
+        return handlers
+
+    def _reserve(self, size):
+        """
+        Makes sure there are at least ``size`` free bytes at the end of the
+        receive buffer.  Consumed data is dropped by moving the offsets, so
+        data is only ever moved when the free space runs out, and then only
+        the (small) unconsumed remainder is copied.
+        """
+        if self._rstart == self._rend:
+            self._rstart = self._rend = 0
+
+        if len(self._rbuf) - self._rend >= size:
+            return
+
+        pending = self._rmv[self._rstart:self._rend].tobytes()
+        if len(pending) + size > len(self._rbuf):
+            self._rbuf = bytearray(len(pending) + size)
+            self._rmv  = memoryview(self._rbuf)
+        self._rbuf[:len(pending)] = pending
+        self._rstart, self._rend = 0, len(pending)
+
+    def _data_received(self, count):
+        """
+        Called by the transport once ``count`` bytes have been received at
+        the end of the receive buffer.  If compression is active they are
+        replaced by the data they decompress to.
+        """
+        self.bytes_received += count
+        if self.timeout is not None:
+            self._last_activity = time.time()
+        if self._inflate is None:
+            self._rend   += count
+            self._rtotal += count
+        else:
+            self._inflate_data(self._rmv[self._rend:self._rend+count].tobytes())
+
+    def _inflate_data(self, data):
+        """
+        Decompresses ``data`` to the end of the receive buffer, at most
+        ``recv_buffer_size`` bytes at a time.
+        """
+        while data:
+            try:
+                output = self._inflate.decompress(data, self.recv_buffer_size)
+            except zlib.error as err:
+                raise NNTPDataError("Invalid compressed data: %s" % err)
+            data = self._inflate.unconsumed_tail
+
+            self._reserve(len(output))
+            self._rbuf[self._rend:self._rend+len(output)] = output
+            self._rend   += len(output)
+            self._rtotal += len(output)
+
+    def _start_compression(self):
+        """
+        Compresses both directions of the stream from now on.  Anything left
+        in the receive buffer was sent after the ``206`` response, so it is
+        already compressed.
+        """
+        self.logger.debug("COMPRESS DEFLATE active")
+        self._inflate = zlib.decompressobj(-zlib.MAX_WBITS)
+        self._deflate = zlib.compressobj(self.compress_level, zlib.DEFLATED,
+                                         -zlib.MAX_WBITS)
+
+        pending = self._rmv[self._rstart:self._rend].tobytes()
+        self._rtotal -= len(pending)
+        self._rend    = self._rstart
+        self._inflate_data(pending)
+
+    def _stop_compression(self):
+        """
+        Called when the connection is (re)established, compression has to be
+        negotiated again.
+        """
+        self._inflate = self._deflate = None
+        self.overview_compression = None
+
+    def _send(self, data):
+        """
+        Writes ``data`` to the server, compressed if compression is active.
+        Every write is flushed, so that the server can act on it right away.
+        """
+        if self._deflate is not None:
+            data = self._deflate.compress(data) + \
+                   self._deflate.flush(zlib.Z_SYNC_FLUSH)
+        if self.timeout is not None:
+            # The wait for a response starts now at the latest
+            self._last_activity = time.time()
+        self.push(data)
+
+    def _process_input(self):
+        """
+        Hands the data in the receive buffer to ``collect_incoming_data`` and
+        ``found_terminator``.  Every byte is searched for a terminator at most
+        once, so the cost of reading a response is linear in its size.
+        """
+        # Requests added while the responses are handled are sent at the
+        # end, in a single write
+        self._processing = True
+        try:
+            self._consume_input()
+        finally:
+            self._processing = False
+        self.sendrequest()
+
+    def _consume_input(self):
+        # Continue to search for self.terminator in the receive buffer, while
+        # calling self.collect_incoming_data.  The while loop is necessary
+        # because we might read several data+terminator combos with a single
+        # read.
+
+        while self._rstart < self._rend:
+            terminator = self.get_terminator()
+            if not terminator:
+                # no terminator, collect it all
+                self.collect_incoming_data(
+                    self._rmv[self._rstart:self._rend].tobytes())
+                self._rstart = self._rend
+            elif isinstance(terminator, integer_types):
+                # numeric terminator
+                n = min(terminator, self._rend - self._rstart)
+                self.collect_incoming_data(
+                    self._rmv[self._rstart:self._rstart+n].tobytes())
+                self._rstart += n
+                self.terminator = self.terminator - n
+                if not self.terminator:
+                    self.found_terminator()
+            elif hasattr(terminator, "feed"):
+                # A compressed data block, the decoder tells how much of the
+                # data belongs to it (see :class:`InflateDecoder`)
+                n = terminator.feed(
+                    self._rmv[self._rstart:self._rend].tobytes())
+                self._rstart += n
+                if terminator.done:
+                    self.found_terminator()
+            else:
+                index = self._rbuf.find(terminator, self._rstart, self._rend)
+                if index != -1:
+                    # we found the terminator
+                    if index > self._rstart:
+                        # don't bother reporting the empty string
+                        # (source of subtle bugs)
+                        self.collect_incoming_data(
+                            self._rmv[self._rstart:index].tobytes())
+                    self._rstart = index + len(terminator)
+                    # This does the Right Thing if the terminator
+                    # is changed here.
+                    self.found_terminator()
+                else:
+                    # Collect everything except what could be the start of
+                    # the terminator, so the next search only has to resume
+                    # from there
+                    end = max(self._rstart,
+                              self._rend - (len(terminator) - 1))
+                    if end > self._rstart:
+                        self.collect_incoming_data(
+                            self._rmv[self._rstart:end].tobytes())
+                        self._rstart = end
+                    break
+
+    def collect_incoming_data(self, data):
+        self.logger.debug('collect_incoming_data() -> (%d)', len(data))
+
+        #print "data =", `data`
+        self._current_request().handle_data(data)
+
+    def _current_request(self):
+        """
+        Returns the :class:`Request` the incoming response belongs to.
+        """
+        if self._request is None:
+            if self._inflight:
+                # Responses arrive in the same order the requests were sent
+                self._request = self._inflight.popleft()
+                if self.metrics is not None:
+                    self._request.first_byte_at  = time.time()
+                    self._request.bytes_received = -self._stream_offset()
+            else:
+                # Nothing was sent, so this is an unsolicited response
+                self._request = Request(self, "UNKNOWN")
+                self._request.handlers = self._handlers("on_unknown")
+        return self._request
+
+    def found_terminator(self):
+        #if self.interactive:
+        #    time.sleep(0.3)
+
+        self.logger.debug('found_terminator()')
+
+        # Let the request decide how the response is framed, based on the
+        # response code in its status line
+        terminator = self._current_request().handle_terminator()
+        if terminator is not None:
+            if terminator == MULTILINE_TERMINATOR:
+                # The CRLF that ended the status line is also the start of the
+                # terminator of an empty data block, so put it back.  It is
+                # still in the receive buffer, right before ``_rstart``.
+                self._rstart -= len(CRLF)
+            self.set_terminator(terminator)
+            return
+
+        # Reset request
+        request = self._request
+        if self.auto_reconnect and (request.response_code == "400" or
+                                    request.command == "UNKNOWN" and
+                                    request.response_code == "502"):
+            # The server is closing the connection, the request (unless it's
+            # the greeting) is sent again once reconnected
+            self.logger.warning("Server closing the connection: %s",
+                                _native(request.status_line))
+            self._drop()
+            return
+        self._request = None
+
+        if self.metrics is not None and request.first_byte_at is not None:
+            request.completed_at    = time.time()
+            request.bytes_received += self._stream_offset()
+            self.metrics.record(self, request)
+
+        if self.negative_cache is not None:
+            self.negative_cache.record(NegativeCache.server(self), request,
+                                       self.group_name)
+
+        # Reset terminator, the next response belongs to the oldest request
+        # that is still in flight
+        if self._inflight:
+            self.set_terminator(self._inflight[0].getterminator())
+        else:
+            self.set_terminator(CRLF)
+
+        if request.command == "UNKNOWN":
+            # An "UNKNOWN" request means that we received an unsolicited
+            # response from the server.  This happens on initial connection
+            # to the server.  Some servers also disconnect the client due to
+            # idleness
+            code = request.response_code
+            if code in ("200", "201"):
+                self._do_callback("on_connect", request)
+            elif code == "400":
+                # XXX: Is this general enough?
+                self._do_callback("on_disconnect", request)
+            else:
+                self.logger.warn("UNKNOWN Request; code %s" % request.response_code)
+
+        # Call the callbacks resolved when the request was added
+        for handler in request.handlers:
+            handler(request)
+
+        # Complete the future of the request
+        self._resolve(request)
+
+        # Refill the pipeline from the FIFO
+        self.sendrequest()
+
+    def _stream_offset(self):
+        """
+        Returns the number of (decompressed) bytes consumed so far.
+        """
+        return self._rtotal - (self._rend - self._rstart)
+
+    def outstanding(self):
+        """
+        Returns the number of requests that have been sent to the server but
+        whose responses have not yet been fully received.
+        """
+        count = len(self._inflight)
+        if self._request is not None and self._request.command != "UNKNOWN":
+            count += 1
+        return count
+
+    def queued(self):
+        """
+        Returns the number of requests that have not been completed yet,
+        whether they have been sent or not.
+        """
+        return self.outstanding() + len(self._fifo)
+
+    def pop_requests(self):
+        """
+        Removes every request that has not been completed yet from this
+        connection and returns them in the order they were added.  The
+        requests are rewound, so they can be added to another connection.
+        Those that can't be, as part of their response already went to a
+        ``sink`` that can't take it back, fail instead and are left out.
+        """
+        requests = []
+        if self._request is not None and self._request.command != "UNKNOWN":
+            requests.append(self._request)
+        requests.extend(self._inflight)
+        requests.extend(self._fifo)
+        self._fifo.clear()
+
+        self._request = None
+        self._inflight.clear()
+        self.set_terminator(CRLF)
+
+        rewound = []
+        for request in requests:
+            if request.rewind():
+                rewound.append(request)
+            else:
+                self._request_failed(request, NNTPDataError(
+                    "Connection lost after part of the response was passed "
+                    "to the sink"))
+        return rewound
+
+    def _request_failed(self, request, error):
+        self.logger.error("%s: %s", request, error)
+        if self.pool is not None:
+            self.pool._request_failed(request, error)
+        elif request.future is not None and not request.future.done():
+            request.future.set_exception(error)
+
+    def _pipeline_blocked(self):
+        """
+        Returns ``True`` if a request that must not be pipelined is awaiting
+        its response.
+        """
+        if self._request is not None and not self._request.pipeline:
+            return True
+        for request in self._inflight:
+            if not request.pipeline:
+                return True
+        return False
+
+    def addrequest(self, request):
+        """
+        Adds a :class:`Request` to the request FIFO.  If the pipeline isn't
+        full then this will also initiate the request.  Returns the future of
+        the request, which resolves to the request once it has been completed.
+        """
+        if request.future is None:
+            request.future = self._create_future(request)
+        request.handlers = self._resolve_callbacks(request.get_callbacks())
+
+        if self.negative_cache is not None and self.negative_cache.check(
+                NegativeCache.server(self), request, self._selected_group):
+            # Known to be missing, so it's completed without being sent
+            for handler in request.handlers:
+                handler(request)
+            self._resolve(request)
+            return request.future
+
+        if self._replay is not None and \
+           request.command not in SETUP_COMMANDS:
+            # Reconnecting, it's sent once the connection is ready again
+            self._replay.append(request)
+            return request.future
+
+        if self.metrics is not None and request.queued_at is None:
+            request.queued_at = time.time()
+        self._fifo.append(request)
+        self.sendrequest()
+        return request.future
+
+    def _create_future(self, request):
+        return Future(request)
+
+    def _resolve(self, request):
+        if request.future is not None:
+            request.future.set_result(request)
+
+    def sendrequest(self):
+        """
+        Gets requests from the request FIFO and sends their commands to the
+        server until ``pipeline_depth`` requests are in flight.  Requests in
+        ``NO_PIPELINE_COMMANDS`` are only sent once every earlier response has
+        been received, and nothing is sent after them until their own response
+        has arrived.
+        """
+        #if not self._connected:
+        #    # We're not ready yet
+        #    return
+
+        if self._processing:
+            # Sent once the received data has been handled
+            return
+
+        lines = []
+        while self._fifo and self.outstanding() < self.pipeline_depth:
+            if self.outstanding():
+                if self._pipeline_blocked() or not self._fifo[0].pipeline:
+                    break
+
+            request = self._fifo.popleft()
+
+            if self._request is None and not self._inflight:
+                # The response to this request is the next one to arrive
+                terminator = request.getterminator()
+                self.logger.debug("terminator = %r", terminator)
+                self.set_terminator(terminator)
+
+            self._inflight.append(request)
+            if self.metrics is not None:
+                request.sent_at = time.time()
+
+            line = request.getline()
+            self.logger.debug("sending command: %r", line.strip())
+            lines.append(line)
+
+        if lines:
+            # Write all of the pipelined commands at once
+            self._send(b''.join(lines))
+
+    def ready(self):
+        return self._connected
+
+    def _ready(self):
+        """
+        Called once the connection has been established and any
+        authentication has been completed.  After a reconnect the group is
+        selected again and the requests that weren't completed are sent.
+        """
+        self._connected = True
+
+        if self._replay is not None:
+            replay, self._replay = self._replay, None
+            if self.group_name and self.pool is None:
+                # The pool selects its group itself
+                self.addrequest(Request(self, "GROUP", self.group_name,
+                                        callbacks=(self._on_group,)))
+            self.logger.info("Reconnected, sending %d requests again",
+                             len(replay))
+            self._fifo.extend(replay)
+            self.sendrequest()
+
+        self._do_callback("on_ready")
+        if self.pool is not None:
+            self.pool._connection_ready(self)
+
+        # Only now, a connection that fails right away still backs off
+        self._attempts = 0
+
+    def verbose(self, stream=sys.stdout, level=logging.DEBUG,
+                format="[%(levelname)-8s] %(message)s"):
+        logging.basicConfig(stream=stream, level=level, format=format)
+
+    ############################################################################
+    # Client functions
+    ############################################################################
+
+    def username(self, username, callback=None):
+        """
+        Send an
+        `AUTHINFO USER <https://tools.ietf.org/html/rfc2980#section-3.1.1>`_
+        command with the given ``username``.
+
+        :callback: ``on_username``
+        """
+        return self.addrequest(Request(self, "AUTHINFO", "USER", username,
+                                callbacks=(callback, "on_username")))
+
+    def password(self, password, callback=None):
+        """
+        Send an
+        `AUTHINFO PASS <https://tools.ietf.org/html/rfc2980#section-3.1.1>`_
+        command with the given ``password``.
+
+        :callback: ``on_username``.
+        """
+        return self.addrequest(Request(self, "AUTHINFO", "PASS", password,
+                                callbacks=(callback, "on_password")))
+
+    def capabilities(self, callback=None):
+        """
+        Send a `CAPABILITIES <https://tools.ietf.org/html/rfc3977#section-5.2>`_
+        command.
+
+        :callback: `on_capabilities`
+        """
+        return self.addrequest(Request(self, "CAPABILITIES",
+                                callbacks=(callback, "on_capabilities")))
+
+    def compress_deflate(self, callback=None):
+        """
+        Send a `COMPRESS DEFLATE <https://tools.ietf.org/html/rfc8054>`_
+        command.  If the server responds with ``206`` the rest of the
+        connection is compressed in both directions.  This is done
+        automatically once authenticated if the connection was created with
+        ``compress=True`` and the server supports it.
+
+        :callback: ``on_compress``
+        """
+        return self.addrequest(Request(self, "COMPRESS", "DEFLATE",
+                                callbacks=(callback, "on_compress")))
+
+    def xfeature_compress_gzip(self, callback=None):
+        """
+        Send an ``XFEATURE COMPRESS GZIP`` command, which some providers that
+        don't support ``COMPRESS DEFLATE`` offer instead.  If the server
+        responds with ``290`` the data blocks of overview responses are
+        compressed, they are decompressed as they arrive.
+
+        :callback: ``on_xfeature_compress_gzip``
+        """
+        return self.addrequest(Request(self, "XFEATURE", "COMPRESS GZIP",
+                                callbacks=(callback,
+                                           "on_xfeature_compress_gzip")))
+
+    def mode_reader(self, callback=None):
+        """
+        Send a `MODE READER <https://tools.ietf.org/html/rfc3977#section-5.3>`_
+        command.
+
+        :callback: ``on_mode_reader``
+        """
+        return self.addrequest(Request(self, "MODE READER",
+                                callbacks=(callback, "on_mode_reader")))
+
+    def quit(self, callback=None):
+        """
+        Send a `QUIT <https://tools.ietf.org/html/rfc3977#section-5.4>`_
+        command.
+
+        :callback: ``on_quit``
+        """
+        self._closing = True
+        return self.addrequest(Request(self, "QUIT",
+                                callbacks=(callback, "on_quit")))
+
+    def group(self, name, callback=None):
+        """
+        Send a `GROUP <https://tools.ietf.org/html/rfc3977#section-6.1.1>`_
+        command, where ``name`` is a `string` of the desired group.
+
+        :callback: ``do_group``
+        """
+        self._selected_group = name
+        return self.addrequest(Request(self, "GROUP", name,
+                                callbacks=(callback, "on_group")))
+
+    def listgroup(self, group=None, range=None, callback=None):
+        """
+        Send a `LISTGROUP <https://tools.ietf.org/html/rfc3977#section-6.1.2>`_
+        command.  If ``group`` is provided, then that group will be selected,
+        otherwise the previously selected group will be used.  See link for 
+        format of ``range``.
+
+        :callback: ``on_listgroup``
+        """
+        if group:
+            self._selected_group = group
+        return self.addrequest(Request(self, "LISTGROUP", group, range,
+                                callbacks=(callback, "on_listgroup")))
+
+    def last(self, callback=None):
+        """
+        Send a `LAST <https://tools.ietf.org/html/rfc3977#section-6.1.3>`_
+        command.
+
+        :callback: ``on_last``
+        """
+        return self.addrequest(Request(self, "LAST",
+                                callbacks=(callback, "on_last")))
+
+    def next(self, callback=None):
+        """
+        Send a `NEXT <https://tools.ietf.org/html/rfc3977#section-6.1.4>`_
+        command.
+
+        :callback: ``on_next``
+        """
+        return self.addrequest(Request(self, "NEXT",
+                                callbacks=(callback, "on_next")))
+
+    def article(self, article, callback=None, sink=None):
+        """
+        Send a `ARTICLE <https://tools.ietf.org/html/rfc3977#section-6.2.1>`_
+        command.  If a group has been selected (via a prior call to
+        :func:`group`), then ``article`` can be an integer.  Alternativley,
+        ``article`` can be a unique message-id string of the format
+        ``<message-id>``.
+
+        The article is collected in the request's ``payload``, a ``bytearray``
+        with dot-stuffing removed and every line terminated by CRLF, which can
+        also be read with ``iterlines()`` or as ``lines``.
+
+        If ``sink`` is given, the article is not collected in the request's
+        ``payload``.  Instead it is passed on as it arrives, with dot-stuffing
+        removed and every line terminated by CRLF, in chunks to ``sink``
+        which may be a callable or a file-like object.  The callback is then
+        called once the whole article has been passed on.
+
+        :callback: ``on_article``
+        """
+        return self.addrequest(Request(self, "ARTICLE", article, sink=sink,
+                                callbacks=(callback, "on_article")))
+
+    def head(self, article, callback=None, sink=None):
+        """
+        Send a `HEAD <https://tools.ietf.org/html/rfc3977#section-6.2.2>`_
+        command.  See :func:`article` for a description of allowable forms for
+        ``article`` and for the use of ``sink``.
+
+        :callback: ``on_head``
+        """
+        return self.addrequest(Request(self, "HEAD", article, sink=sink,
+                                callbacks=(callback, "on_head")))
+
+    def body(self, article, callback=None, sink=None):
+        """
+        Send a `BODY <https://tools.ietf.org/html/rfc3977#section-6.2.3>`_
+        command.  See :func:`article` for a description of allowable forms for
+        ``article`` and for the use of ``sink``.
+
+        :callback: ``on_body``
+        """
+        return self.addrequest(Request(self, "BODY", article, sink=sink,
+                                callbacks=(callback, "on_body")))
+
+    def stat(self, article, callback=None):
+        """
+        Send a `STAT <https://tools.ietf.org/html/rfc3977#section-6.2.4>`_
+        command.  See :func:`article` for a description of allowable forms for
+        ``article``.
+
+        :callback: ``on_stat``
+        """
+        return self.addrequest(Request(self, "STAT", article,
+                                callbacks=(callback, "on_stat")))
+
+    def date(self, callback=None):
+        """
+        Send a `DATE <https://tools.ietf.org/html/rfc3977#section-7.1>`_
+        command.
+
+        :callback: ``on_date``
+        """
+        return self.addrequest(Request(self, "DATE",
+                                callbacks=(callback, "on_date")))
+
+    def over(self, range=None, callback=None, sink=None, fields=None):
+        """
+        Send an `OVER <https://tools.ietf.org/html/rfc3977#section-8.3>`_
+        command for the articles in ``range`` of the selected group (see
+        link for the format), or for the current article.  ``XOVER`` is
+        sent instead if the server hasn't advertised ``OVER``, and ``XZVER``
+        if ``overview_compression`` is set to it.  A compressed response is
+        decompressed as it arrives.
+
+        The response is parsed as it arrives into the request's
+        ``overview``, an :class:`Overview` which keeps only ``fields`` if
+        given.  Its format is requested with :func:`list_overview_fmt` first
+        if it isn't known yet.  If ``sink`` is given the plain overview data
+        is passed to it instead (see :func:`article`).
+
+        :callback: ``on_over``
+        """
+        if self.overview_compression == "XZVER":
+            command = "XZVER"
+        elif "OVER" in self.server_capabilities:
+            command = "OVER"
+        else:
+            command = "XOVER"
+        return self._overview(command, range, callback, sink, fields)
+
+    def xover(self, range=None, callback=None, sink=None, fields=None):
+        """
+        Send an ``XOVER`` command (``XZVER`` if ``overview_compression`` is
+        set to it), for servers which predate RFC 3977.  See :func:`over`.
+
+        :callback: ``on_over``
+        """
+        if self.overview_compression == "XZVER":
+            command = "XZVER"
+        else:
+            command = "XOVER"
+        return self._overview(command, range, callback, sink, fields)
+
+    def _overview(self, command, range, callback, sink, fields):
+        request = Request(self, command, range, sink=sink,
+                          callbacks=(callback, "on_over"))
+        if sink is None:
+            request.overview = request.sink = \
+                Overview(self.overview_format, fields)
+
+            if self.overview_format is None:
+                # The response arrives before the overview data, which is
+                # only parsed after its callbacks have been called
+                if self._overview_waiting is None:
+                    self._overview_waiting = []
+                    self.addrequest(Request(self, "LIST", "OVERVIEW.FMT",
+                        callbacks=("on_list_overview_fmt",
+                                   self._overview_format_known)))
+                self._overview_waiting.append(request.overview)
+        return self.addrequest(request)
+
+    def _overview_format_known(self, request):
+        for overview in self._overview_waiting:
+            overview.format = self.overview_format
+        self._overview_waiting = None
+
+    def hdr(self, header, range=None, callback=None, sink=None):
+        """
+        Send an `HDR <https://tools.ietf.org/html/rfc3977#section-8.5>`_
+        command for ``header`` (e.g. ``Subject`` or ``:bytes``) of the
+        articles in ``range``, or of the current article.  ``XHDR`` is sent
+        instead if the server hasn't advertised ``HDR``.  Every line of the
+        payload is an article number and the value, separated by a space.
+        See :class:`HeaderScan` to fetch a large range.
+
+        :callback: ``on_hdr``
+        """
+        command = "HDR" if "HDR" in self.server_capabilities else "XHDR"
+        return self.addrequest(Request(self, command, header, range,
+                                sink=sink, callbacks=(callback, "on_hdr")))
+
+    def list_overview_fmt(self, callback=None):
+        """
+        Send a `LIST OVERVIEW.FMT
+        <https://tools.ietf.org/html/rfc3977#section-8.4>`_ command.  The
+        fields are kept in ``overview_format``, or the default format if the
+        server doesn't support the command.
+
+        :callback: ``on_list_overview_fmt``
+        """
+        return self.addrequest(Request(self, "LIST", "OVERVIEW.FMT",
+                                callbacks=(callback, "on_list_overview_fmt")))
+
+    def list(self, callback=None):
+        """
+        Send a `LIST <https://tools.ietf.org/html/rfc3977#section-7.6.1>`_
+        command.
+
+        :callback: ``on_list``
+        """
+        return self.addrequest(Request(self, "LIST",
+                                callbacks=(callback, "on_list")))
+
+    ############################################################################
+    # Internal callback functions
+    ############################################################################
+
+    def _on_connect(self, request):
+        self.welcome = request.response_message
+
+        # If we were given a username, try to authenticate
+        if self.__username:
+            self.username(self.__username)
+        else:
+            self._authenticated()
+
+    def _authenticated(self):
+        """
+        Called once any authentication has been completed.  Compression is
+        negotiated first if it was requested, the capabilities may differ
+        after authentication.
+        """
+        if self.compress and self._inflate is None:
+            self.addrequest(Request(self, "CAPABILITIES",
+                callbacks=("on_capabilities", self._negotiate_compression)))
+        else:
+            self._ready()
+
+    def _negotiate_compression(self, request):
+        """
+        Compresses the whole connection if the server supports it, otherwise
+        tries the overview compression some providers offer instead.
+        """
+        if "DEFLATE" in self.server_capabilities.get("COMPRESS", ()):
+            self.addrequest(Request(self, "COMPRESS", "DEFLATE",
+                callbacks=("on_compress", self._negotiate_overview)))
+        else:
+            self._negotiate_overview(request)
+
+    def _negotiate_overview(self, request):
+        if self._inflate is not None:
+            self._ready()
+            return
+        self.addrequest(Request(self, "XFEATURE", "COMPRESS GZIP",
+            callbacks=("on_xfeature_compress_gzip", self._negotiated)))
+
+    def _negotiated(self, request):
+        if self.overview_compression is None and \
+           "XZVER" in self.server_capabilities:
+            self.overview_compression = "XZVER"
+        self.logger.debug("overview compression = %s",
+                          self.overview_compression)
+        self._ready()
+
+    def _on_capabilities(self, request):
+        self.server_capabilities = {}
+        for line in request.iterlines():
+            words = _native(line).upper().split()
+            if words:
+                self.server_capabilities[words[0]] = words[1:]
+
+    def _on_list_overview_fmt(self, request):
+        if request.response_code == "215":
+            self.overview_format = tuple(_native(line)
+                                         for line in request.iterlines())
+        else:
+            self.overview_format = DEFAULT_OVERVIEW_FMT
+
+    def _on_compress(self, request):
+        if request.response_code == "206":
+            self._start_compression()
+        else:
+            self.logger.warning("COMPRESS DEFLATE failed: %s",
+                                _native(request.status_line))
+
+    def _on_xfeature_compress_gzip(self, request):
+        if request.response_code == "290":
+            self.overview_compression = "GZIP"
+
+    def _on_group(self, request):
+        if request.response_code == "211":
+            self.group_name = request.args[0]
+        else:
+            # The server keeps the group that was selected before
+            self._selected_group = self.group_name
+
+    def _on_listgroup(self, request):
+        if request.args[0]:
+            self._on_group(request)
+
+    def _on_quit(self, request):
+        self._connected = False
+
+    def _on_disconnect(self, request):
+        self._connected = False
+        if self.pool is not None:
+            self.pool._connection_lost(self)
+
+    def _on_username(self, request):
+        if request.response_code == "381":
+            # Password is required
+            if self.__password:
+                self.password(self.__password)
+            else:
+                self.logger.error("Password required but not provided")
+                self._auth_failed(request)
+        elif request.response_code == "281":
+            self._authenticated()
+        else:
+            self._auth_failed(request)
 
     def _on_password(self, request):
         if request.response_code == "281":
-            self._connected = True
-            self._do_callback("on_ready")
+            self._authenticated()
+        else:
+            self._auth_failed(request)
+
+    def _auth_failed(self, request):
+        """
+        Called when authentication with the server has failed.  While
+        reconnecting that may be temporary, e.g. too many connections, so it
+        is tried again later.
+        """
+        self.logger.error("Authentication failed: %s" %
+                          _native(request.status_line))
+        if self._replay is not None:
+            self._drop()
+
+    ############################################################################
+    # Reconnecting
+    ############################################################################
+
+    def _connection_dropped(self):
+        """
+        Called by the transport once the connection has been lost.  Returns
+        the delay before reconnecting, or ``None`` if it won't be.  The
+        requests that weren't completed are sent again once reconnected,
+        unless the connection belongs to a pool which hands them to the other
+        connections.  Requests that set up the connection are repeated anyway.
+        """
+        was_ready = self._connected
+        self._connected = False
+        self._rstart = self._rend = 0
+
+        if not self.auto_reconnect or self._closing:
+            return None
+
+        requests = []
+        if self.pool is None:
+            requests = self.pop_requests()
+            if not was_ready:
+                requests = [request for request in requests
+                            if request.command not in SETUP_COMMANDS]
+        self._replay = requests + (self._replay or [])
+
+        delay = min(self.reconnect_max_delay,
+                    self.reconnect_delay * 2 ** min(self._attempts, 30))
+        delay *= random.uniform(0.5, 1.0)
+        self._attempts += 1
+        self.logger.warning("Connection to %s:%s lost, reconnecting in %.1fs",
+                            self.host, self.port, delay)
+        return delay
+
+    def _timed_out(self):
+        """
+        Returns ``True`` if the server has sent nothing for ``timeout``
+        seconds while a response, or the greeting, is awaited.
+        """
+        if time.time() - self._last_activity < self.timeout:
+            return False
+        return bool(self.outstanding()) or not self._connected
+
+    def _drop(self):
+        """
+        Closes the connection as if it was lost, see ``_connection_dropped``.
+        Nothing more is read from the receive buffer.
+        """
+        self._rstart = self._rend
+        self._abort()
+
+class NNTP(BaseNNTP, _async_chat):
+    """
+    An NNTP client built on :py:mod:`asynchat`, driven by ``asyncore.loop``
+    (see :func:`loop_forever`).  These modules were removed in Python 3.12,
+    use :class:`AsyncNNTP` there.
+
+    TLS runs through an :py:class:`ssl.SSLObject` and a pair of
+    :py:class:`ssl.MemoryBIO`, except on Python 2 which uses SSL sockets.
+
+    With ``auto_reconnect`` a lost connection is opened again after a delay
+    (see ``reconnect_delay``), also when the server responds with ``400``
+    or greets with ``502``, or sends nothing for ``timeout`` seconds while
+    a response is awaited.  Once authenticated again the group is selected
+    and the requests that weren't completed are sent again, requests made
+    in the meantime wait for it.  A request whose response had partly been
+    passed to a ``sink`` that can't be rewound fails instead, see
+    :func:`Request.rewind`.  The delays are only as precise as the
+    ``timeout`` of ``asyncore.loop``.
+    """
+    # The most a TLS record decrypts to, at least this much of the receive
+    # buffer is kept free while decrypting
+    tls_record_size = 16384
+
+    # The TLS layer, see ``handle_connect``, and the encrypted data it
+    # produced that the socket hasn't taken yet
+    _tls         = None
+    _tls_pending = b""
+
+    # When to connect again, see ``readable``
+    _reconnect_at = None
+
+    def __init__(self, host, port=119, user=None, password=None,
+                 readermode=None, usenetrc=True, use_ssl=None,
+                 interactive=False, pipeline_depth=1, metrics=None,
+                 compress=False, negative_cache=None, ssl_context=None,
+                 auto_reconnect=False, timeout=None):
+        if asynchat is None:
+            raise RuntimeError("asynchat is not available, use AsyncNNTP")
+
+        BaseNNTP.__init__(self, host, port, user, password, use_ssl,
+                          pipeline_depth, metrics, compress, negative_cache,
+                          auto_reconnect, timeout)
+        self.interactive = interactive
+        self.established = not self.use_ssl
+        self.ssl_context = ssl_context
+
+        asynchat.async_chat.__init__(self)
+
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+
+        self.connect((host, port))
+
+    def reconnect(self):
+        """
+        Closes the connection and opens a new one right away.  The requests
+        that weren't completed are sent again once it is ready, as after a
+        lost connection with ``auto_reconnect``.
+        """
+        self._save_ssl_session()
+        self._connected = False
+        self._rstart = self._rend = 0
+        if self.pool is not None:
+            self.pool._connection_lost(self)
+        else:
+            self._replay = self.pop_requests() + (self._replay or [])
+        self._reconnect_at = None
+        self._new_socket()
+        self.connect((self.host, self.port))
+
+    def _new_socket(self):
+        """
+        Replaces the socket with a new one that isn't connected yet, anything
+        that was still to be sent is dropped.
+        """
+        self.del_channel()
+        self.socket.close()
+        del self.socket
+
+        if hasattr(self, "_socket"):
+            self._socket.close()
+            del self._socket
+
+        self._tls         = None
+        self._tls_pending = b""
+        self.established  = not self.use_ssl
+        self.discard_buffers()
+        self._last_activity = time.time()
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+
+    def _abort(self):
+        self.handle_close()
+
+    def readable(self):
+        """
+        Connects again once the delay of a reconnect has passed, and drops a
+        connection that has timed out.  ``asyncore.loop`` asks before every
+        wait.
+        """
+        if self._reconnect_at is not None:
+            if time.time() < self._reconnect_at:
+                return False
+            self._reconnect_at = None
+            self._last_activity = time.time()
+            self.connect((self.host, self.port))
+        elif self.timeout is not None and self._timed_out():
+            self.logger.warning("No response from %s:%s in %ss",
+                                self.host, self.port, self.timeout)
+            self._drop()
+            return False
+        return True
+
+    def _handshake(self):
+        # Python 2, see ``_tls_handshake`` otherwise
+        try:
+            self.socket.do_handshake()
+        except ssl.SSLError as err:
+            self.logger.debug("SSL handshake not complete")
+            self.want_read = self.want_write = False
+            if err.args[0] == ssl.SSL_ERROR_WANT_READ:
+                self.want_read = True
+            elif err.args[0] == ssl.SSL_ERROR_WANT_WRITE:
+                self.want_write = True
+            else:
+                raise
+        else:
+            self.logger.debug("SSL handshake complete%s" %
+                              (", session resumed"
+                               if getattr(self.socket, "session_reused", False)
+                               else ""))
+            self.want_read = self.want_write = True
+            self.established = True
+
+    def _ready(self):
+        # The session of a TLS 1.3 connection has arrived with the greeting
+        self._save_ssl_session()
+        BaseNNTP._ready(self)
+
+    def _save_ssl_session(self):
+        if not self.established:
+            return
+        sock = self._tls if self._tls is not None else self.socket
+        if hasattr(sock, "context"):
+            _save_ssl_session(sock.context, self.host, self.port, sock)
+
+    def _tls_handshake(self):
+        try:
+            self._tls.do_handshake()
+        except ssl.SSLWantReadError:
+            self.logger.debug("SSL handshake not complete")
+        else:
+            self.logger.debug("SSL handshake complete%s" %
+                              (", session resumed"
+                               if self._tls.session_reused else ""))
+            self.established = True
+        self._tls_flush()
+
+        if self.established:
+            # Anything pushed during the handshake
+            self.initiate_send()
+
+    def _tls_flush(self):
+        """
+        Writes the data encrypted by the TLS layer to the socket, what it
+        doesn't take is kept for ``handle_write``.
+        """
+        data = self._tls_out.read()
+        if self._tls_pending:
+            data = self._tls_pending + data
+        if not data:
+            return
+        sent = asyncore.dispatcher.send(self, data)
+        self._tls_pending = data[sent:]
+
+    def _tls_read(self):
+        """
+        Reads everything the socket has in one go and decrypts it record by
+        record straight into the receive buffer.  Handshake, renegotiation
+        and alerts are handled by the ``SSLObject`` on the way, whatever it
+        has to send in return is written afterwards.
+        """
+        try:
+            count = self.recv_into(self._tls_rmv)
+        except socket.error:
+            self.handle_error()
+            return
+        if not count:
+            return
+        self._tls_in.write(self._tls_rmv[:count])
+
+        if not self.established:
+            self._tls_handshake()
+            if not self.established:
+                return
+
+        tls = self._tls
+        while True:
+            self._reserve(self.tls_record_size)
+            free = self._rmv[self._rend:]
+            try:
+                count = tls.read(len(free), free)
+            except ssl.SSLWantReadError:
+                break
+            except ssl.SSLZeroReturnError:
+                # The server closed the TLS session
+                self._process_input()
+                self.handle_close()
+                return
+            if not count:
+                break
+            self._data_received(count)
+
+        self._tls_flush()
+        self._process_input()
+
+    def handle_connect(self):
+        """
+        If SSL has been requested, this method will wrap the socket in SSL with
+        ``ssl_context``, or :func:`default_ssl_context` if none was given, and
+        resume the TLS session of an earlier connection to the same server
+        with that context.  If SSL has been requested but is not available a
+        ``ValueError`` will be raised.
+        """
+        self.logger.debug('handle_connect()')
+
+        # Default terminator
+        self.set_terminator(CRLF)
+        self._stop_compression()
+
+        # See if we need to wrap the socket in SSL
+        if self.use_ssl:
+            if not _have_ssl:
+                self.logger.error("SSL requested but not available")
+                raise ValueError("SSL not available")
+
+            self.logger.debug('Wrapping in SSL')
+            context = self.ssl_context or default_ssl_context()
+            kwargs  = {}
+            session = _ssl_session(context, self.host, self.port)
+            if session is not None:
+                kwargs["session"] = session
+
+            if _have_memory_bio:
+                self._tls_in  = ssl.MemoryBIO()
+                self._tls_out = ssl.MemoryBIO()
+                self._tls = context.wrap_bio(self._tls_in, self._tls_out,
+                                             server_hostname=self.host,
+                                             **kwargs)
+                self._tls_pending = b""
+                if not hasattr(self, "_tls_rmv"):
+                    self._tls_rmv = memoryview(
+                        bytearray(self.recv_buffer_size))
+                self._tls_handshake()
+                return
+
+            self._socket = self.socket
+            self.socket = context.wrap_socket(self._socket,
+                                              server_hostname=self.host,
+                                              do_handshake_on_connect=False,
+                                              **kwargs)
+
+    def writable(self):
+        if self._reconnect_at is not None:
+            return False
+        if self._tls is not None and not self.established:
+            # Nothing but the handshake can be sent yet
+            return bool(self._tls_pending)
+        return bool(self._tls_pending) or _async_chat.writable(self)
+
+    def send(self, data):
+        """
+        Sends ``data`` through the TLS layer if there is one.  It takes
+        nothing before the handshake is complete or while encrypted data is
+        waiting for the socket, ``initiate_send`` tries again later.
+        """
+        if self._tls is None:
+            return _async_chat.send(self, data)
+
+        if self._tls_pending:
+            self._tls_flush()
+        if self._tls_pending or not self.established:
+            return 0
+        try:
+            count = self._tls.write(data)
+        except ssl.SSLWantReadError:
+            # Renegotiating, the server has to answer first
+            return 0
+        self._tls_flush()
+        return count
+
+    def handle_write(self):
+        """
+        Overload the default ``handle_write`` method to support SSL handshake.
+        """
+        if self._tls is not None:
+            if self._tls_pending:
+                self._tls_flush()
+            if self.established and not self._tls_pending:
+                self.initiate_send()
+            return
+        if self.established:
+            return self.initiate_send()
+        self._handshake()
+
+    def recv_into(self, buffer, nbytes=0):
+        """
+        Reads up to ``nbytes`` bytes from the socket directly into ``buffer``
+        and returns the number of bytes read.  SSL sockets sometimes appear
+        readable when they aren't ready to be read yet, in which case 0 is
+        returned.  If the connection has been closed ``handle_close`` is called
+        and 0 is returned, just like the default ``recv`` does.
+        """
+        try:
+            count = self.socket.recv_into(buffer, nbytes)
+        except socket.error as why:
+            if _have_ssl and isinstance(why, ssl.SSLError):
+                if why.args[0] == ssl.SSL_ERROR_WANT_READ:
+                    return 0
+            if why.args[0] in asyncore._DISCONNECTED:
+                self.handle_close()
+                return 0
+            raise
+
+        if not count:
+            # A closed connection
+            self.handle_close()
+        return count
+
+    def _handle_read(self):
+        """
+        We can't use the default ``handle_read`` here because it doesn't support
+        SSL sockets, which are only used on Python 2 (see ``_tls_read``).  This
+        fix is from: http://bugs.python.org/issue16976
+
+        Data is received straight into the preallocated receive buffer, and
+        decompressed there if ``COMPRESS DEFLATE`` is active.
+        """
+        self._reserve(self.recv_buffer_size)
+        try:
+            count = self.recv_into(self._rmv[self._rend:])
+        except socket.error:
+            self.handle_error()
+            return
+        self._data_received(count)
+
+        if count and hasattr(self.socket, 'ssl_version'):
+        # Fix for SSL wrapped sockets, checks if there is any data pending in
+        # the SSL Socket's internal buffer and recv's it before contining.
+            amount_of_data_left_over = self.socket.pending()
+            while amount_of_data_left_over > 0:
+                # while the ssl socket still has some data pending
+                self._reserve(amount_of_data_left_over)
+                try:
+                    # get the remaining data
+                    count = self.recv_into(self._rmv[self._rend:],
+                                           amount_of_data_left_over)
+                except socket.error:
+                    self.handle_error()
+                    return
+                if not count:
+                    break
+                self._data_received(count)
+                # check if there is anymore remaining
+                amount_of_data_left_over = self.socket.pending()
+
+        self._process_input()
+
+    def handle_read(self):
+        """
+        Overload the default ``handle_read`` method to support SSL handshake
+        and also use the custom ``_handle_read`` method.
+        """
+        if self._tls is not None:
+            return self._tls_read()
+        if self.established:
+            return self._handle_read()
+        self._handshake()
+
+    def handle_close(self):
+        self.logger.debug('handle_close()')
+        self._save_ssl_session()
+        self.close()
+
+        delay = self._connection_dropped()
+        if self.pool is not None:
+            self.pool._connection_lost(self)
+        if delay is not None:
+            # The new socket waits in ``readable`` until it's time
+            self._new_socket()
+            self._reconnect_at = time.time() + delay
+
+class AsyncNNTP(BaseNNTP, _buffered_protocol):
+    """
+    An NNTP client implemented as an :py:class:`asyncio.BufferedProtocol`,
+    so it runs on any :py:mod:`asyncio` event loop (including ``uvloop``)
+    and uses the loop's native TLS support.  Incoming data is received
+    straight into the receive buffer.
+
+    The client methods return a future which resolves to the completed
+    :class:`Request`, the usual callbacks are called as well.  Use
+    :func:`connect` to open a connection::
+
+        nntp = await AsyncNNTP.connect("news.example.com", 563, user, password)
+        request = await nntp.stat("<message-id>")
+
+    If the connection is lost, the futures of the requests that haven't been
+    completed raise :py:exc:`ConnectionError`.  With ``auto_reconnect`` the
+    connection is opened again instead, once it has been opened, and the
+    requests are sent again, see :class:`NNTP`.
+    """
+    def __init__(self, host, port=119, user=None, password=None,
+                 use_ssl=None, pipeline_depth=1, ssl_context=None, loop=None,
+                 metrics=None, compress=False, negative_cache=None,
+                 auto_reconnect=False, timeout=None):
+        if asyncio is None:
+            raise RuntimeError("asyncio is not available, use NNTP")
+
+        BaseNNTP.__init__(self, host, port, user, password, use_ssl,
+                          pipeline_depth, metrics, compress, negative_cache,
+                          auto_reconnect, timeout)
+        self.ssl_context = ssl_context
+        self.transport   = None
+        self.terminator  = CRLF
+
+        self._loop  = loop or asyncio.get_event_loop()
+        self._ready_future = self._loop.create_future()
+
+        # The pending reconnect and timeout check, if any
+        self._reconnect_handle = None
+        self._timeout_handle   = None
+
+    @classmethod
+    def connect(cls, host, port=119, user=None, password=None, **kwargs):
+        """
+        Creates a client and opens its connection, see :func:`open`.
+        """
+        return cls(host, port, user, password, **kwargs).open()
+
+    def open(self):
+        """
+        Opens the connection to the server and returns a future which
+        resolves to this client once it is connected and authenticated.  If
+        ``use_ssl`` is set the connection uses ``ssl_context``, or
+        :func:`default_ssl_context` if none was given.
+        """
+        self._create_connection().add_done_callback(self._connect_done)
+        return self._ready_future
+
+    def _create_connection(self):
+        context = None
+        if self.use_ssl:
+            if not _have_ssl:
+                self.logger.error("SSL requested but not available")
+                raise ValueError("SSL not available")
+            context = self.ssl_context or default_ssl_context()
+
+        self._last_activity = time.time()
+        return self._loop.create_task(self._loop.create_connection(
+            lambda: self, self.host, self.port, ssl=context))
+
+    def _connect_done(self, future):
+        if self._ready_future.done():
+            return
+        if future.cancelled():
+            self._ready_future.cancel()
+        elif future.exception() is not None:
+            self._ready_future.set_exception(future.exception())
+
+    def _reconnect(self):
+        self._reconnect_handle = None
+        self._create_connection().add_done_callback(self._reconnect_done)
+
+    def _reconnect_done(self, future):
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            self.logger.warning("Reconnecting failed: %s", future.exception())
+            # As if the new connection had been lost right away
+            self.connection_lost(future.exception())
+        elif self._closing:
+            future.result()[0].close()
+
+    def close(self):
+        """
+        Closes the connection without sending a ``QUIT`` command.
+        """
+        self._closing = True
+        if self._reconnect_handle is not None:
+            self._reconnect_handle.cancel()
+            self._reconnect_handle = None
+        if self.transport is not None:
+            self.transport.close()
+
+    def _abort(self):
+        if self.transport is not None:
+            self.transport.abort()
+
+    def _check_timeout(self):
+        """
+        Drops the connection if it has timed out, otherwise checks again
+        when it could have.
+        """
+        self._timeout_handle = None
+        if self.transport is None:
+            return
+        if self._timed_out():
+            self.logger.warning("No response from %s:%s in %ss",
+                                self.host, self.port, self.timeout)
+            self._drop()
+            return
+        self._timeout_handle = self._loop.call_later(
+            max(self._last_activity + self.timeout - time.time(), 0.1),
+            self._check_timeout)
+
+    def set_terminator(self, term):
+        self.terminator = term
+
+    def get_terminator(self):
+        return self.terminator
+
+    def push(self, data):
+        self.transport.write(data)
+
+    def addrequest(self, request):
+        """
+        Adds a :class:`Request` to the request FIFO and returns a future
+        which resolves to the request once it has been completed.
+        """
+        if self.transport is None and self._ready_future.done() and \
+           self._replay is None:
+            # The connection has been closed (or could not be opened)
+            future = self._create_future(request)
+            future.set_exception(ConnectionError("Not connected"))
+            return future
+
+        return BaseNNTP.addrequest(self, request)
+
+    def _create_future(self, request):
+        return self._loop.create_future()
+
+    def sendrequest(self):
+        # Nothing can be sent until the connection has been made
+        if self.transport is not None:
+            BaseNNTP.sendrequest(self)
+
+    def _resolve(self, request):
+        if request.future is not None and not request.future.done():
+            request.future.set_result(request)
+
+    def _ready(self):
+        BaseNNTP._ready(self)
+        if not self._ready_future.done():
+            self._ready_future.set_result(self)
+
+    def _auth_failed(self, request):
+        BaseNNTP._auth_failed(self, request)
+        if not self._ready_future.done():
+            if request.response_code.startswith("4"):
+                error = NNTPTemporaryError
+            else:
+                error = NNTPPermanentError
+            self._ready_future.set_exception(
+                error(_native(request.status_line)))
+
+    ############################################################################
+    # asyncio.BufferedProtocol
+    ############################################################################
+    def connection_made(self, transport):
+        self.logger.debug('connection_made()')
+        self.transport = transport
+        self.set_terminator(CRLF)
+        self._stop_compression()
+        if self.timeout is not None:
+            self._last_activity  = time.time()
+            self._timeout_handle = self._loop.call_later(self.timeout,
+                                                         self._check_timeout)
+
+    def get_buffer(self, sizehint):
+        self._reserve(max(sizehint, self.recv_buffer_size))
+        return self._rmv[self._rend:]
+
+    def buffer_updated(self, nbytes):
+        self._data_received(nbytes)
+        self._process_input()
+
+    def eof_received(self):
+        # Let the transport close itself
+        return False
+
+    def connection_lost(self, exc):
+        self.logger.debug('connection_lost()')
+        self.transport = None
+        if self._timeout_handle is not None:
+            self._timeout_handle.cancel()
+            self._timeout_handle = None
+
+        delay = self._connection_dropped()
+        if delay is not None:
+            self._reconnect_handle = self._loop.call_later(delay,
+                                                           self._reconnect)
+            return
+
+        error = exc or ConnectionError("Connection lost")
+        for request in self.pop_requests():
+            if not request.future.done():
+                request.future.set_exception(error)
+        if not self._ready_future.done():
+            self._ready_future.set_exception(error)
+
+class NNTPPool:
+    """
+    A pool of ``connections`` :class:`NNTP` connections to a single server,
+    sharing one work queue.  The arguments not used by the pool itself are
+    passed on to ``connection_class``, which should be :class:`NNTP` or a
+    subclass of it.
+
+    Requests are held in the pool's queue and handed to the ready connection
+    with the fewest requests, but never more than fill its pipeline.  So a
+    fast connection keeps taking work from the queue while a slow one only
+    holds what it is working on.  When a connection is lost, every request
+    it hadn't completed is put back at the front of the queue to be picked
+    up by the remaining connections.  A request whose response had partly
+    been passed to a ``sink`` that can't be rewound (see
+    :func:`Request.rewind`) fails with :class:`NNTPDataError` instead.
+    With ``auto_reconnect`` the connection itself comes back as well, once
+    it is ready again it takes requests from the queue like the others.
+
+    With SSL the first connection is opened on its own and the others once
+    it is ready, so that they resume its TLS session instead of each doing a
+    full handshake.
+
+    Like :class:`NNTP` a subclass can define ``on_<command>`` methods which
+    are called with each completed request, as well as ``on_complete`` which
+    is called once every submitted request has been completed.
+    """
+    def __init__(self, host, port=119, user=None, password=None,
+                 connections=4, connection_class=None, **kwargs):
+        self.host             = host
+        self.port             = port
+        self.logger           = logging.getLogger('NNTP::Pool')
+        self.connection_class = connection_class or NNTP
+        self.group_name       = None
+        self.metrics          = kwargs.get("metrics", None)
+        self.negative_cache   = kwargs.get("negative_cache", None)
+
+        self.pending   = 0   # Submitted but not completed
+        self.completed = 0
+
+        self._queue = collections.deque()
+        if self.metrics is not None:
+            self.metrics.register_pool(self)
+
+        # Command -> ``on_<command>`` method, or None
+        self._handler_cache = {}
+
+        use_ssl = kwargs.get("use_ssl", None)
+        if use_ssl is None:
+            use_ssl = port in SSL_PORTS
+
+        self.connections   = []
+        self._unopened     = connections
+        self._connect_args = (user, password, kwargs)
+        self._open_connections(1 if use_ssl else connections)
+
+    def _open_connections(self, count):
+        user, password, kwargs = self._connect_args
+        for i in range(min(count, self._unopened)):
+            self._unopened -= 1
+            conn = self.connection_class(self.host, self.port, user, password,
+                                         **kwargs)
+            conn.pool = self
+            self.connections.append(conn)
+
+    def ready(self):
+        """
+        Returns the connections that are ready to take requests.
+        """
+        return [conn for conn in self.connections if conn.ready()]
+
+    def done(self):
+        """
+        Returns ``True`` if every submitted request has been completed.
+        """
+        return self.pending == 0
+
+    def _connection_ready(self, conn):
+        if self._unopened:
+            self._open_connections(self._unopened)
+        if self.group_name:
+            conn.group(self.group_name)
+        self._dispatch()
+
+    def _connection_lost(self, conn):
+        if self._unopened:
+            # The first SSL connection failed, the others may still work
+            self._open_connections(self._unopened)
+
+        requests = conn.pop_requests()
+        if requests:
+            self.logger.warn("Connection lost, requeueing %d requests" %
+                             len(requests))
+            self._queue.extendleft(reversed(requests))
+
+        self._dispatch()
+        if self._queue and not self.ready() and \
+           not any(c.auto_reconnect and not c._closing
+                   for c in self.connections):
+            self.logger.error("No connections left to send %d requests" %
+                              len(self._queue))
+
+    def _dispatch(self, conn=None):
+        """
+        Hands queued requests to the least loaded ready connections, until
+        every pipeline is full.  If ``conn`` is given only it has gained
+        room, the other pipelines were already full if requests are queued.
+        """
+        if not self._queue:
+            return
+
+        if conn is not None:
+            while self._queue and conn.ready() and \
+                  conn.queued() < conn.pipeline_depth:
+                request = self._queue.popleft()
+                request.nntp = conn
+                conn.addrequest(request)
+            return
+
+        # [load, index, connection] of the connections with room left
+        free = []
+        for index, conn in enumerate(self.connections):
+            if conn.ready():
+                load = conn.queued()
+                if load < conn.pipeline_depth:
+                    free.append([load, index, conn])
+
+        while self._queue and free:
+            entry = min(free)
+            conn  = entry[2]
+
+            request = self._queue.popleft()
+            request.nntp = conn
+            conn.addrequest(request)
+
+            entry[0] += 1
+            if entry[0] >= conn.pipeline_depth:
+                free.remove(entry)
+
+    def _request_failed(self, request, error):
+        self.pending -= 1
+        request.future.set_exception(error)
+        if self.done() and hasattr(self, "on_complete"):
+            self.on_complete()
+
+    def _request_done(self, request):
+        self.pending   -= 1
+        self.completed += 1
+
+        try:
+            handler = self._handler_cache[request.command]
+        except KeyError:
+            handler = getattr(self, callback_name(request.command), None)
+            self._handler_cache[request.command] = handler
+        if handler is not None:
+            handler(request)
+
+        self._dispatch(request.nntp)
+
+        if self.done() and hasattr(self, "on_complete"):
+            self.on_complete()
+
+    def submit(self, command, *args, **kwargs):
+        """
+        Queues a ``command`` with the given ``args`` to be sent on any of the
+        connections and returns its :class:`Future`.  ``callback`` and
+        ``sink`` are used as with the methods of :class:`NNTP`.
+        """
+        callback = kwargs.get("callback", None)
+        request = Request(None, command, *args, sink=kwargs.get("sink", None),
+                          callbacks=(callback, self._request_done))
+        request.future = Future(request)
+        self.pending += 1
+
+        if self.negative_cache is not None and self.negative_cache.check(
+                NegativeCache.server(self), request, self.group_name):
+            # Known to be missing, so it's completed without being queued
+            if callback is not None:
+                callback(request)
+            self._request_done(request)
+            request.future.set_result(request)
+            return request.future
+
+        if self.metrics is not None:
+            request.queued_at = time.time()
+        self._queue.append(request)
+        if len(self._queue) == 1:
+            # Otherwise every pipeline is full
+            self._dispatch()
+        return request.future
+
+    def _create_future(self, request):
+        return Future(request)
+
+    def group(self, name):
+        """
+        Selects the group ``name`` on every connection, including those that
+        are connected later on.  Returns a :class:`Future` which resolves to
+        the list of ``GROUP`` requests of the connections that are ready now,
+        once each of them has been answered.
+        """
+        self.group_name = name
+        return gather(*[conn.group(name) for conn in self.ready()])
+
+    def article(self, article, callback=None, sink=None):
+        """
+        See :func:`NNTP.article`.
+
+        :callback: ``on_article``
+        """
+        return self.submit("ARTICLE", article, callback=callback, sink=sink)
+
+    def head(self, article, callback=None, sink=None):
+        """
+        See :func:`NNTP.head`.
+
+        :callback: ``on_head``
+        """
+        return self.submit("HEAD", article, callback=callback, sink=sink)
+
+    def body(self, article, callback=None, sink=None):
+        """
+        See :func:`NNTP.body`.
+
+        :callback: ``on_body``
+        """
+        return self.submit("BODY", article, callback=callback, sink=sink)
+
+    def stat(self, article, callback=None):
+        """
+        See :func:`NNTP.stat`.
+
+        :callback: ``on_stat``
+        """
+        return self.submit("STAT", article, callback=callback)
+
+    def hdr(self, header, range=None, callback=None, sink=None):
+        """
+        Sends an ``HDR`` command, see :func:`NNTP.hdr`.  The connections
+        are not asked for their capabilities, so the server has to support
+        ``HDR``.
+
+        :callback: ``on_hdr``
+        """
+        return self.submit("HDR", header, range, callback=callback, sink=sink)
+
+    def quit(self):
+        """
+        Sends a ``QUIT`` command on every ready connection, the others (still
+        connecting, or waiting to reconnect) are closed.  Returns a
+        :class:`Future` which resolves to the list of ``QUIT`` requests once
+        each of them has been answered.
+        """
+        futures = []
+        for conn in self.connections:
+            if conn.ready():
+                futures.append(conn.quit())
+            else:
+                conn._closing = True
+                conn.close()
+        return gather(*futures)
+
+class OverviewCache:
+    """
+    Stores the overview of groups in an SQLite database at ``path``, keyed by
+    server and group, so that only new articles have to be fetched.  Use
+    :func:`sync` to bring a group up to date::
+
+        cache = OverviewCache("overview.db")
+        cache.sync(nntp, "alt.binaries.test").add_done_callback(...)
+        for row in cache.articles(nntp, "alt.binaries.test"):
+            ...
+
+    The overview of a group is fetched in ranges of at most ``chunk_size``
+    articles, which are pipelined as far as the connection allows.
+    """
+    # The overview fields that are stored, in the order of ``COLUMNS``
+    FIELDS  = ("subject", "from", "date", "message-id", "references",
+               "bytes", "lines", "xref")
+    COLUMNS = ("number", "subject", "sender", "date", "message_id",
+               "refs", "bytes", "lines", "xref")
+
+    chunk_size = 10000
+
+    def __init__(self, path):
+        if sqlite3 is None:
+            raise RuntimeError("sqlite3 is not available")
+
+        self.path   = path
+        self.logger = logging.getLogger('NNTP::OverviewCache')
+        self.db     = sqlite3.connect(path)
+        if str is bytes:
+            # Python 2, overview values are byte strings
+            self.db.text_factory = str
+
+        with self.db:
+            self.db.execute("""CREATE TABLE IF NOT EXISTS groups (
+                                   id     INTEGER PRIMARY KEY,
+                                   server TEXT NOT NULL,
+                                   name   TEXT NOT NULL,
+                                   low    INTEGER NOT NULL DEFAULT 0,
+                                   high   INTEGER NOT NULL DEFAULT 0,
+                                   UNIQUE (server, name))""")
+            self.db.execute("""CREATE TABLE IF NOT EXISTS overview (
+                                   group_id   INTEGER NOT NULL,
+                                   number     INTEGER NOT NULL,
+                                   subject    TEXT,
+                                   sender     TEXT,
+                                   date       TEXT,
+                                   message_id TEXT,
+                                   refs       TEXT,
+                                   bytes      INTEGER,
+                                   lines      INTEGER,
+                                   xref       TEXT,
+                                   PRIMARY KEY (group_id, number))""")
+
+    def close(self):
+        self.db.close()
+
+    @staticmethod
+    def server(nntp):
+        """
+        Returns the key the groups of the server of ``nntp`` are stored by.
+        """
+        return "%s:%d" % (nntp.host, nntp.port)
+
+    def _group_id(self, server, name, create=False):
+        row = self.db.execute("SELECT id FROM groups "
+                              "WHERE server = ? AND name = ?",
+                              (server, name)).fetchone()
+        if row is not None:
+            return row[0]
+        if not create:
+            return None
+        with self.db:
+            cursor = self.db.execute("INSERT INTO groups (server, name) "
+                                     "VALUES (?, ?)", (server, name))
+        return cursor.lastrowid
+
+    def water_marks(self, nntp, name):
+        """
+        Returns the lowest article number still stored for the group ``name``
+        and the highest one that has been synced, as a tuple, or ``None`` if
+        the group has never been synced.
+        """
+        row = self.db.execute("SELECT low, high FROM groups "
+                              "WHERE server = ? AND name = ?",
+                              (self.server(nntp), name)).fetchone()
+        return tuple(row) if row is not None else None
+
+    def articles(self, nntp, name, start=None, end=None):
+        """
+        Returns an iterator over the stored overview of the group ``name``,
+        optionally limited to the articles ``start`` to ``end``, in article
+        order.  Each row is a tuple of the values in ``COLUMNS``.
+        """
+        group_id = self._group_id(self.server(nntp), name)
+        if group_id is None:
+            return iter(())
+        return self.db.execute(
+            "SELECT %s FROM overview WHERE group_id = ? "
+            "AND number >= ? AND number <= ? ORDER BY number"
+            % ", ".join(self.COLUMNS),
+            (group_id, start or 0, end if end is not None else 2**62))
+
+    def count(self, nntp, name):
+        """
+        Returns the number of articles stored for the group ``name``.
+        """
+        group_id = self._group_id(self.server(nntp), name)
+        if group_id is None:
+            return 0
+        return self.db.execute("SELECT COUNT(*) FROM overview "
+                               "WHERE group_id = ?", (group_id,)).fetchone()[0]
+
+    def expire(self, group_id, low):
+        """
+        Removes the articles below ``low``, which the server no longer has.
+        """
+        with self.db:
+            cursor = self.db.execute("DELETE FROM overview "
+                                     "WHERE group_id = ? AND number < ?",
+                                     (group_id, low))
+            self.db.execute("UPDATE groups SET low = ? WHERE id = ?",
+                            (low, group_id))
+        if cursor.rowcount > 0:
+            self.logger.debug("expired %d articles below %d",
+                              cursor.rowcount, low)
+
+    def store(self, group_id, overview, high):
+        """
+        Stores the records of the :class:`Overview` ``overview`` and marks
+        the group as synced up to ``high``.  Returns the number of records.
+        """
+        columns = []
+        for field in self.FIELDS:
+            try:
+                columns.append(overview.column(field))
+            except KeyError:
+                columns.append([None] * len(overview))
+
+        rows = zip([group_id] * len(overview), overview.number, *columns)
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO overview "
+                                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.db.execute("UPDATE groups SET high = ? WHERE id = ?",
+                            (high, group_id))
+        return len(overview)
+
+    def sync(self, nntp, name):
+        """
+        Selects the group ``name`` on ``nntp`` and fetches the overview of
+        the articles after the highest one synced before, removing stored
+        articles which are below the server's low water mark.  Returns a
+        future (see :func:`NNTP.group`) which resolves to the number of
+        articles fetched.  Ranges are stored as they arrive, so an
+        interrupted sync resumes from the last complete range.
+        """
+        result = nntp._create_future(None)
+
+        def group_done(future):
+            try:
+                request = future.result()
+            except Exception as e:
+                result.set_exception(e)
+                return
+
+            if request.response_code != "211":
+                if request.response_code.startswith("4"):
+                    error = NNTPTemporaryError
+                else:
+                    error = NNTPPermanentError
+                result.set_exception(error(_native(request.status_line)))
+                return
+
+            # "211 count low high group"
+            count, low, high = [int(value) for value in
+                                request.response_message.split()[:3]]
+            self._fetch(nntp, name, low, high, result)
+
+        nntp.group(name).add_done_callback(group_done)
+        return result
+
+    def _fetch(self, nntp, name, low, high, result):
+        server   = self.server(nntp)
+        group_id = self._group_id(server, name, create=True)
+        _, synced = self.water_marks(nntp, name)
+
+        if high < synced:
+            # The group has been renumbered
+            self.logger.warning("%s: high water mark went down from %d to %d",
+                                name, synced, high)
+            synced = 0
+            self.expire(group_id, 2**62)
+        self.expire(group_id, low)
+
+        ranges = []
+        for first in range(max(synced + 1, low), high + 1, self.chunk_size):
+            ranges.append((first, min(first + self.chunk_size - 1, high)))
+        self.logger.debug("%s: syncing %d-%d in %d ranges", name,
+                          max(synced + 1, low), high, len(ranges))
+        if not ranges:
+            result.set_result(0)
+            return
+
+        state = {"remaining": len(ranges), "fetched": 0}
+
+        def range_done(last, future):
+            if result.done():
+                # An earlier range failed, don't leave a gap
+                return
+            try:
+                request = future.result()
+            except Exception as e:
+                result.set_exception(e)
+                return
+
+            if request.response_code == "224":
+                state["fetched"] += self.store(group_id, request.overview, last)
+            elif request.response_code == "423":
+                # No articles left in the range
+                self.store(group_id, Overview(), last)
+            else:
+                result.set_exception(NNTPTemporaryError(
+                    _native(request.status_line)))
+                return
+
+            state["remaining"] -= 1
+            if not state["remaining"]:
+                result.set_result(state["fetched"])
+
+        for first, last in ranges:
+            future = nntp.over("%d-%d" % (first, last))
+            future.add_done_callback(
+                lambda future, last=last: range_done(last, future))
+
+class _TeeSink:
+    """
+    Passes the data of a response on to ``sink`` while keeping a copy.
+    """
+    def __init__(self, sink):
+        self.sink   = sink
+        self.data   = bytearray()
+        self._write = getattr(sink, "write", sink)
+
+    def __call__(self, data):
+        self.data.extend(data)
+        self._write(data)
+
+    def reset(self):
+        del self.data[:]
+        reset = getattr(self.sink, "reset", None)
+        if reset is not None:
+            reset()
+
+class ArticleCache:
+    """
+    A cache of the ``ARTICLE``, ``HEAD`` and ``BODY`` commands of
+    ``target``, a connection or an :class:`NNTPPool`, keyed by message-id.
+    Articles requested by number are always fetched, as numbers depend on
+    the selected group.
+
+    The head and the body of an article are cached separately, so ``HEAD``
+    and ``BODY`` are answered from a cached ``ARTICLE`` (and ``ARTICLE``
+    from a cached head and body) without asking the server.  A hit resolves
+    to a :class:`Request` just like a response from the server, with the
+    data in its ``payload`` or passed to ``sink``.
+
+    Up to ``max_bytes`` are held in memory, the least recently used heads
+    and bodies are evicted first.  If a ``directory`` is given, evicted
+    entries are moved there, up to ``max_disk_bytes``, instead of being
+    dropped.  :func:`close` moves the rest, so the cache can be used again
+    by a later process.
+
+    Anything else is passed on to ``target``, so the cache can stand in for
+    it, e.g. as the target of a :class:`Downloader`.
+    """
+    # The cached parts that make up the response to each command
+    PARTS = {"ARTICLE": ("head", "body"), "HEAD": ("head",),
+             "BODY": ("body",)}
+    CODES = {"ARTICLE": "220", "HEAD": "221", "BODY": "222"}
+
+    logger = logging.getLogger('NNTP::ArticleCache')
+
+    def __init__(self, target, max_bytes=64*1024*1024, directory=None,
+                 max_disk_bytes=1024*1024*1024):
+        self.target         = target
+        self.max_bytes      = max_bytes
+        self.directory      = directory
+        self.max_disk_bytes = max_disk_bytes
+
+        self.hits         = 0
+        self.misses       = 0
+        self.memory_bytes = 0
+        self.disk_bytes   = 0
+
+        # (message-id, part) -> data, least recently used first
+        self._memory = collections.OrderedDict()
+        # File name -> size, least recently used first
+        self._disk = collections.OrderedDict()
+
+        if directory is not None:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            files = []
+            for name in os.listdir(directory):
+                if name.endswith((".head", ".body")):
+                    stat = os.stat(os.path.join(directory, name))
+                    files.append((stat.st_mtime, name, stat.st_size))
+            for mtime, name, size in sorted(files):
+                self._disk[name] = size
+                self.disk_bytes += size
+
+    def __getattr__(self, name):
+        if name == "target":
+            raise AttributeError(name)
+        return getattr(self.target, name)
+
+    def article(self, article, callback=None, sink=None):
+        """
+        See :func:`NNTP.article`.
+        """
+        return self._request("ARTICLE", article, callback, sink)
+
+    def head(self, article, callback=None, sink=None):
+        """
+        See :func:`NNTP.head`.
+        """
+        return self._request("HEAD", article, callback, sink)
+
+    def body(self, article, callback=None, sink=None):
+        """
+        See :func:`NNTP.body`.
+        """
+        return self._request("BODY", article, callback, sink)
+
+    def discard(self, message_id):
+        """
+        Removes the article ``message_id`` from the cache.
+        """
+        for part in ("head", "body"):
+            data = self._memory.pop((message_id, part), None)
+            if data is not None:
+                self.memory_bytes -= len(data)
+            name = self._file_name((message_id, part))
+            if name in self._disk:
+                self._remove_file(name)
+
+    def close(self):
+        """
+        Moves everything held in memory to the ``directory``, if any.
+        """
+        while self._memory:
+            self._evict_oldest()
+
+    def _request(self, command, article, callback, sink):
+        fetch = getattr(self.target, command.lower())
+        if not isinstance(article, string_types) or \
+           not article.startswith("<"):
+            return fetch(article, callback=callback, sink=sink)
+
+        parts = []
+        for part in self.PARTS[command]:
+            data = self._get((article, part))
+            if data is None:
+                break
+            parts.append(data)
+        else:
+            self.hits += 1
+            return self._hit(command, article, CRLF.join(parts), callback,
+                             sink)
+
+        self.misses += 1
+        tee = None
+        if sink is not None:
+            tee = sink = _TeeSink(sink)
+        future = fetch(article, callback=callback, sink=sink)
+        future.add_done_callback(
+            lambda future: self._fetched(future, command, article, tee))
+        return future
+
+    def _hit(self, command, message_id, data, callback, sink):
+        target = self.target
+        if isinstance(target, NNTPPool):
+            # Counted and handed to the pool's ``on_<command>`` like a
+            # submitted request, see :func:`NNTPPool.submit`
+            target.pending += 1
+            request = Request(None, command, message_id, sink=sink,
+                              callbacks=(callback, target._request_done))
+            handlers = tuple(handler for handler in request.callbacks
+                             if handler is not None)
+        else:
+            request = Request(target, command, message_id, sink=sink,
+                              callbacks=(callback, callback_name(command)))
+            handlers = target._resolve_callbacks(request.get_callbacks())
+
+        request.response_code    = self.CODES[command]
+        request.response_message = "0 %s" % message_id
+        request.status_line      = _bytes("%s %s" % (request.response_code,
+                                                     request.response_message))
+        request.multiline        = True
+        if request.sink is None:
+            request.payload = bytearray(data)
+        else:
+            request.sink(data)
+
+        request.future   = target._create_future(request)
+        request.handlers = handlers
+        for handler in handlers:
+            handler(request)
+        request.future.set_result(request)
+        return request.future
+
+    def _fetched(self, future, command, message_id, tee):
+        try:
+            request = future.result()
+        except Exception:
+            return
+        if request.response_code != self.CODES[command]:
+            return
+
+        data = request.payload if tee is None else tee.data
+        if data is None:
+            return
+        data = bytes(data)
+        if command == "ARTICLE":
+            index = data.find(CRLF + CRLF)
+            if index == -1:
+                return
+            self._put((message_id, "head"), data[:index + len(CRLF)])
+            self._put((message_id, "body"), data[index + 2 * len(CRLF):])
+        else:
+            self._put((message_id, self.PARTS[command][0]), data)
+
+    def _file_name(self, key):
+        message_id, part = key
+        return "%s.%s" % (hashlib.sha1(_bytes(message_id)).hexdigest(), part)
+
+    def _get(self, key):
+        data = self._memory.pop(key, None)
+        if data is not None:
+            # Now the most recently used
+            self._memory[key] = data
+            return data
+
+        name = self._file_name(key)
+        if name not in self._disk:
+            return None
+        try:
+            with open(os.path.join(self.directory, name), "rb") as f:
+                data = f.read()
+        except (IOError, OSError) as e:
+            self.logger.warning("Couldn't read %s: %s", name, e)
+            data = None
+        self._remove_file(name)
+        if data is not None:
+            self._put(key, data)
+        return data
+
+    def _put(self, key, data):
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self.memory_bytes -= len(old)
+        if len(data) > self.max_bytes:
+            self._to_disk(key, data)
+            return
+
+        self._memory[key] = data
+        self.memory_bytes += len(data)
+        while self.memory_bytes > self.max_bytes:
+            self._evict_oldest()
+
+    def _evict_oldest(self):
+        key, data = self._memory.popitem(last=False)
+        self.memory_bytes -= len(data)
+        self._to_disk(key, data)
+
+    def _to_disk(self, key, data):
+        if self.directory is None or len(data) > self.max_disk_bytes:
+            return
+
+        name = self._file_name(key)
+        with open(os.path.join(self.directory, name), "wb") as f:
+            f.write(data)
+        if name in self._disk:
+            self.disk_bytes -= self._disk.pop(name)
+        self._disk[name] = len(data)
+        self.disk_bytes += len(data)
+        while self.disk_bytes > self.max_disk_bytes:
+            self._remove_file(next(iter(self._disk)))
+
+    def _remove_file(self, name):
+        self.disk_bytes -= self._disk.pop(name)
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except OSError:
+            pass
+
+class NegativeCache:
+    """
+    Remembers which articles a server doesn't have, so that looking them up
+    again is answered without asking it.  Give it to a connection or an
+    :class:`NNTPPool` as ``negative_cache``: the ``430`` responses to
+    ``ARTICLE``, ``HEAD``, ``BODY`` and ``STAT`` with a message-id, and the
+    ``423`` responses to those with an article number, are recorded, and
+    the same lookup gets the same response right away.  Entries are kept
+    per server, so one cache can be shared by connections to several.
+
+    An entry expires at most ``ttl`` seconds after it was added, as the
+    article may still reach the server.  Entries are added to one of
+    ``buckets`` time windows, each of which expires as a whole.  Only a
+    64-bit hash of each message-id (or group and number) is kept, and once a
+    window fills up or is no longer added to its hashes are moved to a
+    sorted array, so each entry takes about 8 bytes.
+
+    If ``path`` is given, the cache is loaded from it and :func:`save`
+    writes it back.
+    """
+    buckets    = 8
+    batch_size = 100000   # Hashes held in a set before they are sorted
+
+    _magic  = b"asyncnntp-negative-cache 1\n"
+    _int64  = struct.Struct("<q")
+
+    def __init__(self, ttl=6*3600, path=None):
+        self.ttl  = ttl
+        self.path = path
+        self.hits = 0
+
+        # Server -> windows, oldest first.  A window is
+        # [expires, sorted arrays of hashes, set of recent hashes].
+        self._servers = {}
+
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def __len__(self):
+        return sum(len(recent) + sum(len(hashes) for hashes in arrays)
+                   for windows in self._servers.values()
+                   for expires, arrays, recent in windows)
+
+    @staticmethod
+    def server(nntp):
+        """
+        Returns the key the entries of the server of ``nntp`` are kept by.
+        """
+        return "%s:%d" % (nntp.host, nntp.port)
+
+    @classmethod
+    def _hash(cls, key):
+        return cls._int64.unpack_from(hashlib.sha1(_bytes(key)).digest())[0]
+
+    @staticmethod
+    def _key(request, group):
+        """
+        Returns the key of the article looked up by ``request``, if any.
+        """
+        if request.command not in LOOKUP_COMMANDS or not request.args:
+            return None
+        article = request.args[0]
+        if isinstance(article, string_types) and article.startswith("<"):
+            return article
+        if group and str(article).isdigit():
+            return "%s:%s" % (group, article)
+        return None
+
+    def add(self, server, key):
+        """
+        Records that the article ``key``, a message-id or "group:number", is
+        missing from ``server``.
+        """
+        now     = time.time()
+        windows = self._servers.setdefault(server, [])
+        while windows and windows[0][0] <= now:
+            windows.pop(0)
+
+        if not windows or \
+           windows[-1][0] - now < self.ttl - self.ttl / self.buckets:
+            if windows:
+                self._freeze(windows[-1])
+            windows.append([now + self.ttl, [], set()])
+
+        window = windows[-1]
+        window[2].add(self._hash(key))
+        if len(window[2]) >= self.batch_size:
+            self._freeze(window)
+
+    def contains(self, server, key):
+        """
+        Returns ``True`` if the article ``key`` is known to be missing from
+        ``server``.
+        """
+        windows = self._servers.get(server)
+        if not windows:
+            return False
+
+        value = self._hash(key)
+        now   = time.time()
+        for expires, arrays, recent in windows:
+            if expires <= now:
+                continue
+            if value in recent:
+                return True
+            for hashes in arrays:
+                index = bisect.bisect_left(hashes, value)
+                if index < len(hashes) and hashes[index] == value:
+                    return True
+        return False
+
+    def check(self, server, request, group=None):
+        """
+        Returns ``True`` if the article looked up by ``request`` is known to
+        be missing from ``server``, after filling in the response the server
+        gave.  ``group`` is the selected group, for article numbers.
+        """
+        key = self._key(request, group)
+        if key is None or not self.contains(server, key):
+            return False
+
+        self.hits += 1
+        request.response_code    = "430" if key.startswith("<") else "423"
+        request.response_message = "No such article (cached)"
+        request.status_line      = _bytes("%s %s" % (request.response_code,
+                                                     request.response_message))
+        return True
+
+    def record(self, server, request, group=None):
+        """
+        Adds the article looked up by ``request`` if the response says it's
+        missing.
+        """
+        if request.response_code not in ("423", "430"):
+            return
+        key = self._key(request, group)
+        if key is not None:
+            self.add(server, key)
+
+    def _freeze(self, window):
+        if window[2]:
+            window[1].append(array.array(_INT64, sorted(window[2])))
+            window[2] = set()
+
+    def save(self, path=None):
+        """
+        Writes the entries that haven't expired to ``path``, by default the
+        one the cache was loaded from.
+        """
+        path = path or self.path
+        now  = time.time()
+        with open(path + ".tmp", "wb") as f:
+            f.write(self._magic)
+            for server, windows in self._servers.items():
+                for window in windows:
+                    if window[0] <= now:
+                        continue
+                    self._freeze(window)
+                    hashes = array.array(_INT64,
+                                         sorted(itertools.chain(*window[1])))
+                    window[1] = [hashes]
+
+                    f.write(_bytes("%s\t%d\t%d\n" % (server, window[0],
+                                                      len(hashes))))
+                    if sys.byteorder != "little":
+                        hashes = array.array(_INT64, hashes)
+                        hashes.byteswap()
+                    hashes.tofile(f)
+
+        if os.path.exists(path) and not hasattr(os, "replace"):
+            # Python 2 on Windows can't rename over a file
+            os.remove(path)
+        getattr(os, "replace", os.rename)(path + ".tmp", path)
+
+    def load(self, path):
+        """
+        Adds the entries saved at ``path`` that haven't expired yet.
+        """
+        now = time.time()
+        with open(path, "rb") as f:
+            if f.readline() != self._magic:
+                raise ValueError("%s is not a negative cache" % path)
+            for line in iter(f.readline, b""):
+                server, expires, count = _native(line).rstrip("\n").split("\t")
+                hashes = array.array(_INT64)
+                hashes.fromfile(f, int(count))
+                if sys.byteorder != "little":
+                    hashes.byteswap()
+                if int(expires) > now:
+                    windows = self._servers.setdefault(server, [])
+                    windows.append([int(expires), [hashes], set()])
+                    windows.sort(key=lambda window: window[0])
+
+class HeaderScan:
+    """
+    Fetches ``header`` of the articles ``first`` to ``last`` of the selected
+    group with ``HDR``, split into ranges, through ``target``: a connection,
+    which pipelines the ranges, or an :class:`NNTPPool`, which also spreads
+    them over its connections.  At most ``window`` ranges are outstanding.
+
+    The size of the ranges adapts to the response time of the server, so
+    that a range takes about ``target_time`` seconds to be received: large
+    enough to keep the overhead per command low, small enough not to run
+    into server timeouts.
+
+    The results are passed on in article order, whatever order the ranges
+    complete in, by calling ``output`` with the article number and value.
+    If no ``output`` is given they are collected in ``numbers`` (an
+    ``array``) and ``values`` (:class:`PackedStrings`).
+    """
+    chunk_size     = 5000
+    min_chunk_size = 100
+    max_chunk_size = 100000
+    target_time    = 2.0
+
+    def __init__(self, target, header, first, last, output=None, window=4):
+        self.target = target
+        self.header = header
+        self.first  = first
+        self.last   = last
+        self.output = output
+        self.window = max(1, window)
+        self.logger = logging.getLogger('NNTP::HeaderScan')
+
+        if self.output is None:
+            self.numbers = array.array(_INT64)
+            self.values  = PackedStrings()
+
+        self.future = None
+
+        self._next        = first   # First article of the next range
+        self._outstanding = 0
+        self._sequence    = 0       # Of the next range to be sent
+        self._emitted     = 0       # Of the next range to be passed on
+        self._completed   = {}      # Sequence -> request, not passed on yet
+        self._last_done   = None
+
+    def start(self):
+        """
+        Starts the scan and returns a future (of the kind ``target`` uses)
+        which resolves to this scan once every range has been passed on.
+        """
+        self.future = self.target._create_future(None)
+        self._fill()
+        return self.future
+
+    def _fill(self):
+        """
+        Sends ranges until ``window`` are outstanding.
+        """
+        while self._outstanding < self.window and self._next <= self.last:
+            first = self._next
+            last  = min(first + int(self.chunk_size) - 1, self.last)
+            self._next = last + 1
+
+            sequence = self._sequence
+            self._sequence    += 1
+            self._outstanding += 1
+
+            sent = time.time()
+            future = self.target.hdr(self.header, "%d-%d" % (first, last))
+            future.add_done_callback(
+                lambda future, sequence=sequence, sent=sent, size=last-first+1:
+                    self._range_done(future, sequence, sent, size))
+
+        if not self._outstanding and not self.future.done():
+            self.future.set_result(self)
+
+    def _adapt(self, sent, size):
+        """
+        Scales the range size by how far the response time of the last range
+        was from ``target_time``.  While ranges are pipelined the response
+        time is counted from when the previous range was completed.
+        """
+        now = time.time()
+        start = sent if self._last_done is None else max(sent, self._last_done)
+        self._last_done = now
+
+        elapsed = now - start
+        if elapsed <= 0:
+            return
+        wanted = size * self.target_time / elapsed
+        # Smooth out the variation between single responses
+        wanted = (self.chunk_size + wanted) / 2.0
+        self.chunk_size = int(max(self.min_chunk_size,
+                                  min(self.max_chunk_size, wanted)))
+        self.logger.debug("range of %d took %.3fs, chunk size now %d",
+                          size, elapsed, self.chunk_size)
+
+    def _range_done(self, future, sequence, sent, size):
+        self._outstanding -= 1
+        if self.future.done():
+            return
+
+        try:
+            request = future.result()
+        except Exception as e:
+            self.future.set_exception(e)
+            return
+
+        if request.response_code not in ("221", "225", "423"):
+            # 423: no articles in the range
+            if request.response_code.startswith("4"):
+                error = NNTPTemporaryError
+            else:
+                error = NNTPPermanentError
+            self.future.set_exception(error(_native(request.status_line)))
+            return
+
+        self._adapt(sent, size)
+        self._completed[sequence] = request
+        while self._emitted in self._completed:
+            self._emit(self._completed.pop(self._emitted))
+            self._emitted += 1
+        self._fill()
+
+    def _emit(self, request):
+        """
+        Passes on the results of a range.
+        """
+        numbers, values = [], []
+        for line in request.iterlines():
+            number, _, value = line.partition(b' ')
+            numbers.append(int(number))
+            values.append(value)
+
+        if self.output is None:
+            self.numbers.extend(numbers)
+            self.values.extend(values)
+        else:
+            for number, value in zip(numbers, values):
+                self.output(number, _native(value))
+
+class NZBSegment:
+    """
+    A segment (article) of an :class:`NZBFile`.
+    """
+    def __init__(self, message_id, number=0, bytes=0, file=None):
+        if not message_id.startswith("<"):
+            message_id = "<%s>" % message_id
+        self.message_id = message_id
+        self.number     = number
+        self.bytes      = bytes
+        self.file       = file
+
+    def __repr__(self):
+        return "<NZBSegment %s>" % self.message_id
+
+class NZBFile:
+    """
+    A file of an NZB, see :func:`parse_nzb`.  ``segments`` are the
+    :class:`NZBSegment` objects of the file, in order.
+    """
+    _filename = re.compile(r'"([^"]+)"')
+
+    def __init__(self, subject, poster=None, date=None, groups=()):
+        self.subject  = subject
+        self.poster   = poster
+        self.date     = date
+        self.groups   = list(groups)
+        self.segments = []
+
+        match = self._filename.search(subject)
+        self.filename = match.group(1) if match else subject
+
+    def __repr__(self):
+        return "<NZBFile %s>" % self.filename
+
+    @property
+    def bytes(self):
+        return sum(segment.bytes for segment in self.segments)
+
+    @property
+    def is_par2(self):
+        return self.filename.lower().endswith(".par2")
+
+    @property
+    def is_recovery(self):
+        """
+        ``True`` for a par2 volume holding recovery blocks, as opposed to the
+        index par2 file.
+        """
+        return self.is_par2 and ".vol" in self.filename.lower()
+
+def parse_nzb(source):
+    """
+    Parses an NZB from ``source``, a path or file-like object, and returns its
+    files as a list of :class:`NZBFile`.
+    """
+    try:
+        root = ElementTree.parse(source).getroot()
+    except (ElementTree.ParseError, SyntaxError) as e:
+        raise ValueError("Couldn't parse NZB: %s" % e)
+
+    def tag(element):
+        # Without the namespace, which isn't always the same
+        return element.tag.rpartition("}")[2]
+
+    files = []
+    for element in root.iter():
+        if tag(element) != "file":
+            continue
+        nzb_file = NZBFile(element.get("subject", ""), element.get("poster"),
+                           element.get("date"))
+        for child in element.iter():
+            if tag(child) == "group" and child.text:
+                nzb_file.groups.append(child.text.strip())
+            elif tag(child) == "segment" and child.text:
+                nzb_file.segments.append(NZBSegment(
+                    child.text.strip(), int(child.get("number", 0)),
+                    int(child.get("bytes", 0)), nzb_file))
+        nzb_file.segments.sort(key=lambda segment: segment.number)
+        files.append(nzb_file)
+    return files
+
+class _SegmentJob:
+    """
+    Sends a command for every segment of an NZB, spread over ``target``: an
+    :class:`NNTPPool`, a connection or a list of connections (e.g. of
+    :class:`AsyncNNTP`).  Up to ``window`` commands are outstanding at a
+    time, by default twice the pipeline depth of all connections.
+
+    ``send`` is called with a target and a segment to send its command and
+    returns the future of the request.  ``status`` is called with the
+    segment and the completed request (``None`` if it failed) and returns
+    the status of the segment, ``None`` meaning that it is retried up to
+    ``retries`` times before it gets the status ``failed_status``.
+    """
+    retries       = 2
+    failed_status = "failed"
+
+    def __init__(self, target, send, status, output=None, window=None):
+        self._send_segment   = send
+        self._segment_status = status
+        if isinstance(target, (list, tuple)):
+            self.targets = list(target)
+        else:
+            self.targets = [target]
+        self.output = output
+
+        if window is None:
+            window = 0
+            for target in self.targets:
+                for conn in getattr(target, "connections", [target]):
+                    window += 2 * conn.pipeline_depth
+        self.window = max(1, window)
+
+        self.total   = 0
+        self.stopped = False
+        self.future  = None
+
+        self._pending     = collections.deque()
+        self._outstanding = 0
+        self._filling     = False
+
+    def _add(self, segment):
+        self._pending.append((segment, 0))
+        self.total += 1
+
+    def start(self):
+        """
+        Starts sending commands and returns a future (of the kind the target
+        uses) which resolves to this object once every segment is done, or
+        once it has stopped early.
+        """
+        self.future = self.targets[0]._create_future(None)
+        self._fill()
+        return self.future
+
+    def _load(self, target):
+        if hasattr(target, "queued"):
+            return target.queued()
+        return target.pending
+
+    def _fill(self):
+        if self._filling:
+            # A command was answered right away (e.g. from a cache), the
+            # loop below carries on once it returns
+            return
+
+        self._filling = True
+        try:
+            while self._outstanding < self.window and self._pending and \
+                  not self.stopped:
+                segment, attempts = self._pending.popleft()
+                target = self.targets[0]
+                if len(self.targets) > 1:
+                    target = min(self.targets, key=self._load)
+
+                self._outstanding += 1
+                future = self._send_segment(target, segment)
+                future.add_done_callback(
+                    lambda future, segment=segment, attempts=attempts:
+                        self._segment_done(future, segment, attempts))
+        finally:
+            self._filling = False
+
+        if not self._outstanding and not self.future.done():
+            self._finish()
+            self.future.set_result(self)
+
+    def _segment_done(self, future, segment, attempts):
+        self._outstanding -= 1
+        try:
+            request = future.result()
+        except Exception as e:
+            self.logger.debug("%s failed: %s", segment.message_id, e)
+            request = None
+
+        status = self._segment_status(segment, request)
+        if status is None:
+            if attempts < self.retries:
+                self._pending.appendleft((segment, attempts + 1))
+                self._fill()
+                return
+            status = self.failed_status
+
+        self._done(segment, status)
+        if self.output is not None:
+            self.output(segment, status)
+        self._fill()
+
+    def _done(self, segment, status):
+        pass
+
+    def _finish(self):
+        pass
+
+class Verifier(_SegmentJob):
+    """
+    Checks with ``STAT`` commands which articles of an NZB are available,
+    spread over ``target``: an :class:`NNTPPool`, a connection or a list of
+    connections (e.g. of :class:`AsyncNNTP`).  Up to ``window`` commands are
+    outstanding at a time, by default twice the pipeline depth of all
+    connections.
+
+    ``source`` is a list of :class:`NZBFile` (see :func:`parse_nzb`) or an
+    iterable of message-ids.  The result of every segment is passed on as it
+    arrives by calling ``output`` with the :class:`NZBSegment` and
+    "available", "missing" or "unknown".  Segments with any other response
+    than ``223`` or ``430`` are retried up to ``retries`` times before they
+    are reported as unknown.
+
+    For an NZB the par2 recovery volumes are the budget for missing data:
+    once more data bytes are missing than there are recovery bytes left the
+    NZB can't be repaired, and if ``stop_early`` is set no further segments
+    are checked.  Data files are checked before par2 files for this reason.
+    """
+    failed_status = "unknown"
+    logger        = logging.getLogger('NNTP::Verifier')
+
+    def __init__(self, target, source, output=None, window=None,
+                 stop_early=True):
+        _SegmentJob.__init__(self, target, self._send, self._status,
+                             output, window)
+        self.stop_early = stop_early
+
+        files = None
+        if isinstance(source, (list, tuple)) and source and \
+           isinstance(source[0], NZBFile):
+            files = source
+
+        if files is None:
+            # No par2 information, so there is no budget
+            self.recovery_bytes = None
+            for message_id in source:
+                self._add(NZBSegment(message_id))
+        else:
+            self.recovery_bytes = 0
+            for nzb_file in sorted(files, key=lambda f: f.is_par2):
+                if nzb_file.is_recovery:
+                    self.recovery_bytes += nzb_file.bytes
+                for segment in nzb_file.segments:
+                    self._add(segment)
+
+        self.available     = 0
+        self.missing       = 0
+        self.unknown       = 0
+        self.missing_bytes = 0     # Of data files
+
+    @property
+    def checked(self):
+        return self.available + self.missing + self.unknown
+
+    @property
+    def recoverable(self):
+        """
+        ``False`` once the missing data can't be repaired with the recovery
+        volumes that are left, ``None`` if there is no par2 information.
+        """
+        if self.recovery_bytes is None:
+            return None
+        return self.missing_bytes <= self.recovery_bytes
+
+    @property
+    def complete(self):
+        return self.available == self.total
+
+    def _send(self, target, segment):
+        return target.stat(segment.message_id)
+
+    def _status(self, segment, request):
+        code = request.response_code if request is not None else None
+        if code == "223":
+            return "available"
+        elif code == "430":
+            return "missing"
+        return None
+
+    def _done(self, segment, status):
+        setattr(self, status, getattr(self, status) + 1)
+        if status == "missing":
+            self._missing(segment)
+
+    def _missing(self, segment):
+        nzb_file = segment.file
+        if nzb_file is None or self.recovery_bytes is None:
+            return
+        if nzb_file.is_recovery:
+            self.recovery_bytes -= segment.bytes
+        elif not nzb_file.is_par2:
+            self.missing_bytes += segment.bytes
+
+        if self.stop_early and not self.recoverable and not self.stopped:
+            self.logger.info("Missing %d bytes, only %d recovery bytes left",
+                             self.missing_bytes, self.recovery_bytes)
+            self.stopped = True
+
+class Downloader(_SegmentJob):
+    """
+    Downloads the ``files`` of an NZB (see :func:`parse_nzb`) into
+    ``directory``, spread over ``target`` like :class:`Verifier`.  The body
+    of every segment is yEnc decoded as it arrives and written straight to
+    its offset in the file, so neither segments nor whole files are held in
+    memory and nothing has to be joined afterwards.
+
+    The message-ids of the segments that have been written are appended to
+    the ``state`` file, by default ``.asyncnntp-state`` in ``directory``.
+    A download that is started again with the same state only fetches the
+    segments that are not in it (or whose file no longer exists).
+
+    ``output`` is called with each :class:`NZBSegment` and "done",
+    "missing" or "failed".  Segments that fail their CRC check or get any
+    other response than ``222`` or ``430`` are retried up to ``retries``
+    times; the data of a failed segment is left in place for par2 to repair.
+    """
+    state_name = ".asyncnntp-state"
+    logger     = logging.getLogger('NNTP::Downloader')
+
+    def __init__(self, target, files, directory, state=None, output=None,
+                 window=None):
+        _SegmentJob.__init__(self, target, self._send, self._status,
+                             output, window)
+        self.files     = files
+        self.directory = directory
+        self.state     = state or os.path.join(directory, self.state_name)
+
+        self.done          = 0
+        self.missing       = 0
+        self.failed        = 0
+        self.skipped       = 0   # Already in the state
+        self.bytes_written = 0
+
+        self._fds       = {}     # NZBFile -> file descriptor
+        self._sized     = set()  # NZBFiles that have been preallocated
+        self._remaining = {}     # NZBFile -> number of segments to go
+        self._decoders  = {}     # NZBSegment -> YencDecoder
+        self._state     = None
+
+        written = set()
+        if os.path.exists(self.state):
+            with open(self.state) as f:
+                written.update(line.strip() for line in f)
+
+        for nzb_file in files:
+            exists = os.path.exists(self.path(nzb_file))
+            for segment in nzb_file.segments:
+                if exists and segment.message_id in written:
+                    self.skipped += 1
+                    continue
+                self._add(segment)
+                self._remaining[nzb_file] = \
+                    self._remaining.get(nzb_file, 0) + 1
+        self.total += self.skipped
+
+    @property
+    def complete(self):
+        return self.done + self.skipped == self.total
+
+    def path(self, nzb_file):
+        """
+        Returns the path that ``nzb_file`` is written to.
+        """
+        # The name comes from the NZB, it mustn't point elsewhere
+        name = os.path.basename(nzb_file.filename.replace("\\", "/"))
+        if name in ("", ".", ".."):
+            name = "file%d" % self.files.index(nzb_file)
+        return os.path.join(self.directory, name)
+
+    def start(self):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self._state = open(self.state, "a")
+        return _SegmentJob.start(self)
+
+    def _open(self, nzb_file):
+        fd = self._fds.get(nzb_file)
+        if fd is None:
+            fd = os.open(self.path(nzb_file),
+                         os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0),
+                         0o644)
+            self._fds[nzb_file] = fd
+        return fd
+
+    def _send(self, target, segment):
+        nzb_file = segment.file
+        fd       = self._open(nzb_file)
+
+        def write(data, offset):
+            if decoder.size and nzb_file not in self._sized:
+                # Allocated once, so later parts only fill it in
+                self._sized.add(nzb_file)
+                if os.fstat(fd).st_size < decoder.size:
+                    os.ftruncate(fd, decoder.size)
+            _pwrite(fd, data, offset)
+            self.bytes_written += len(data)
+
+        decoder = YencDecoder(write)
+        self._decoders[segment] = decoder
+        return target.body(segment.message_id, sink=decoder)
+
+    def _status(self, segment, request):
+        decoder = self._decoders.pop(segment)
+        code = request.response_code if request is not None else None
+        if code == "430":
+            return "missing"
+        if code == "222":
+            if decoder.valid:
+                return "done"
+            self.logger.warning("%s failed its yEnc check",
+                                segment.message_id)
+        return None
+
+    def _done(self, segment, status):
+        setattr(self, status, getattr(self, status) + 1)
+        if status == "done":
+            self._state.write(segment.message_id + "\n")
+            self._state.flush()
+
+        nzb_file = segment.file
+        self._remaining[nzb_file] -= 1
+        if not self._remaining[nzb_file]:
+            os.close(self._fds.pop(nzb_file))
+
+    def _finish(self):
+        for fd in self._fds.values():
+            os.close(fd)
+        self._fds.clear()
+        if self._state is not None:
+            self._state.close()
+            self._state = None
@@ -0,0 +1,97 @@
+"""
+The parts shared by the benchmarks: timing, the description of the
+environment and the output, one JSON object per line.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+
+import asyncnntp
+
+timer = getattr(time, "perf_counter", time.time)
+
+def best_of(repeat, func, *args):
+    """
+    Calls ``func`` ``repeat`` times and returns the shortest time it took.
+    The slower runs are mostly the machine doing something else.
+    """
+    best = None
+    for i in range(repeat):
+        start = timer()
+        func(*args)
+        elapsed = timer() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def revision():
+    """
+    Returns the git revision of the checkout, if it is one.
+    """
+    try:
+        output = subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(asyncnntp.__file__)),
+            stderr=open(os.devnull, "w"))
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode("ascii").strip()
+
+def environment():
+    return {
+        "name":           "environment",
+        "time":           time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python":         platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform":       platform.platform(),
+        "cpus":           getattr(os, "cpu_count", lambda: None)(),
+        "revision":       revision(),
+        "asyncore":       asyncnntp.asyncore is not None,
+        "asyncio":        asyncnntp.asyncio is not None,
+    }
+
+def parser(description):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--quick", action="store_true",
+                        help="fewer and shorter runs, for a smoke test")
+    parser.add_argument("--repeat", type=int, default=None,
+                        help="runs of each benchmark, the best one counts")
+    parser.add_argument("--filter", default="",
+                        help="only run the benchmarks whose name contains "
+                             "this")
+    parser.add_argument("--output", help="file to append the results to "
+                                         "(default: stdout)")
+    return parser
+
+class Output:
+    """
+    Writes the results as JSON lines, starting with the environment.  Each
+    result has the ``name`` of the benchmark, its ``params`` and the measured
+    ``results``.
+    """
+    def __init__(self, path=None):
+        self.file = open(path, "a") if path else sys.stdout
+        self.write(environment())
+
+    def write(self, record):
+        self.file.write(json.dumps(record, sort_keys=True) + "\n")
+        self.file.flush()
+
+    def result(self, name, params, **results):
+        self.write({"name": name, "params": params, "results": results})
+
+    def skipped(self, name, params, reason):
+        self.write({"name": name, "params": params, "skipped": reason})
+
+    def close(self):
+        if self.file is not sys.stdout:
+            self.file.close()
@@ -0,0 +1,77 @@
+"""
+Compares two result files of the benchmarks and prints the change of every
+result they have in common.
+
+    python compare.py before.jsonl after.jsonl [--threshold 5]
+
+Changes by more than ``--threshold`` percent are marked, and the exit status
+is 1 if any result got worse by more than that.  Every result is a rate, so
+higher is better, except for times per call (``us_per_call`` and
+``ns_per_call``).
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import sys
+
+def load(path):
+    """
+    Returns ``{(name, params): results}`` of the results in ``path``.  Of a
+    result that was measured more than once the best run counts.
+    """
+    results = {}
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            if "results" not in record:
+                continue
+            key = (record["name"], json.dumps(record["params"],
+                                              sort_keys=True))
+            best = results.setdefault(key, {})
+            for field, value in record["results"].items():
+                if field not in best or better(field, value, best[field]):
+                    best[field] = value
+    return results
+
+def lower_is_better(field):
+    return field.endswith("_per_call")
+
+def better(field, value, other):
+    return value < other if lower_is_better(field) else value > other
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=5.0,
+                        help="percentage of change that is reported")
+    args = parser.parse_args()
+
+    before = load(args.before)
+    after  = load(args.after)
+
+    regressions = 0
+    for key in sorted(set(before) & set(after)):
+        name, params = key
+        for field in sorted(set(before[key]) & set(after[key])):
+            old, new = before[key][field], after[key][field]
+            if not old:
+                continue
+            change = (new - old) / float(old) * 100
+            if lower_is_better(field):
+                change = -change
+
+            mark = ""
+            if change < -args.threshold:
+                mark = "  worse"
+                regressions += 1
+            elif change > args.threshold:
+                mark = "  better"
+            print("%-15s %-20s %+7.1f%%  %s%s" % (name, field, change, params,
+                                                  mark))
+
+    sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""
+End-to-end benchmarks against a :class:`mocknntp.MockNNTPServer` on the
+loopback interface, running in a process of its own (see ``server.py``).
+
+    python endtoend.py [--quick] [--latency 0.01] [--output results.jsonl]
+
+* ``stat`` - ``STAT`` requests per second, in total and per connection.
+* ``body`` - ``BODY`` megabytes per second, written to a sink.
+
+Each is run with the :class:`asyncnntp.NNTPPool` of :class:`asyncnntp.NNTP`
+connections (``asyncore``) and with :class:`asyncnntp.AsyncNNTP`
+connections (``asyncio``), for a number of connections and pipeline depths,
+with and without TLS.  TLS needs the ``openssl`` binary for a self-signed
+certificate, without it those runs are skipped.
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import common
+
+import asyncnntp
+
+CONNECTIONS     = (1, 4, 8)
+PIPELINE_DEPTHS = (1, 10)
+
+class Server:
+    """
+    The ``server.py`` process, serving on ``port`` and, if it was given a
+    certificate, with TLS on ``ssl_port``.
+    """
+    def __init__(self, body_size, latency=0.0, certfile=None, keyfile=None):
+        command = [sys.executable,
+                   os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "server.py"),
+                   "--body-size", str(body_size), "--latency", str(latency)]
+        if certfile:
+            command += ["--certfile", certfile, "--keyfile", keyfile]
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE)
+        ports = self.process.stdout.readline().split()
+        if not ports:
+            self.process.wait()
+            raise RuntimeError("The server did not start")
+        self.port     = int(ports[0])
+        self.ssl_port = int(ports[1]) if len(ports) > 1 else None
+
+    def stop(self):
+        self.process.stdin.close()
+        self.process.wait()
+
+def make_certificate(directory):
+    """
+    Creates a self-signed certificate in ``directory`` with the ``openssl``
+    binary and returns the paths of the certificate and its key, or ``None``
+    if it could not be created.
+    """
+    certfile = os.path.join(directory, "cert.pem")
+    keyfile  = os.path.join(directory, "key.pem")
+    try:
+        subprocess.check_call(
+            ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes",
+             "-days", "1", "-subj", "/CN=localhost",
+             "-keyout", keyfile, "-out", certfile],
+            stdout=open(os.devnull, "w"), stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return certfile, keyfile
+
+def message_ids(command, count, run):
+    kind = "stat" if command == "STAT" else "body"
+    return ["<%s-%d-%d@bench>" % (kind, run, i) for i in range(count)]
+
+def discard(data):
+    pass
+
+_unverified_context = None
+
+def unverified_context():
+    """
+    Returns the context of the TLS connections, shared by all of them like
+    :func:`asyncnntp.default_ssl_context`, but which accepts the self-signed
+    certificate of the server.
+    """
+    global _unverified_context
+    if _unverified_context is None:
+        import ssl
+        _unverified_context = ssl.create_default_context()
+        _unverified_context.check_hostname = False
+        _unverified_context.verify_mode    = ssl.CERT_NONE
+    return _unverified_context
+
+class AsyncoreClient:
+    """
+    An :class:`asyncnntp.NNTPPool` of :class:`asyncnntp.NNTP` connections,
+    driven by ``asyncore.loop``.
+    """
+    name = "asyncore"
+
+    def __init__(self, port, connections, pipeline_depth, use_ssl):
+        self.pool = asyncnntp.NNTPPool("127.0.0.1", port,
+                                       connections=connections,
+                                       pipeline_depth=pipeline_depth,
+                                       use_ssl=use_ssl,
+                                       ssl_context=unverified_context(),
+                                       usenetrc=False)
+        self.wait(lambda: len(self.pool.ready()) == connections)
+
+    def wait(self, predicate, timeout=60):
+        start = common.timer()
+        while not predicate():
+            if common.timer() - start > timeout:
+                raise RuntimeError("Timed out")
+            asyncnntp.asyncore.loop(timeout=0.1, count=1)
+
+    def run(self, command, articles):
+        for article in articles:
+            if command == "STAT":
+                self.pool.stat(article)
+            else:
+                self.pool.body(article, sink=discard)
+        self.wait(self.pool.done)
+
+    def close(self):
+        for conn in self.pool.connections:
+            conn.close()
+
+class AsyncioClient:
+    """
+    :class:`asyncnntp.AsyncNNTP` connections which are handed the requests
+    in turn.
+    """
+    name = "asyncio"
+
+    def __init__(self, port, connections, pipeline_depth, use_ssl):
+        context = unverified_context() if use_ssl else None
+        self.loop = asyncnntp.asyncio.new_event_loop()
+        self.connections = self.loop.run_until_complete(
+            asyncnntp.asyncio.gather(*[
+                asyncnntp.AsyncNNTP.connect("127.0.0.1", port,
+                                            pipeline_depth=pipeline_depth,
+                                            use_ssl=use_ssl,
+                                            ssl_context=context,
+                                            loop=self.loop)
+                for i in range(connections)]))
+
+    def run(self, command, articles):
+        futures = []
+        for i, article in enumerate(articles):
+            conn = self.connections[i % len(self.connections)]
+            if command == "STAT":
+                futures.append(conn.stat(article))
+            else:
+                futures.append(conn.body(article, sink=discard))
+        self.loop.run_until_complete(asyncnntp.asyncio.gather(*futures))
+
+    def close(self):
+        for conn in self.connections:
+            conn.close()
+        self.loop.close()
+
+def clients():
+    """
+    Returns the client classes that can be used with this Python.
+    """
+    result = []
+    if asyncnntp.asyncore is not None:
+        result.append(AsyncoreClient)
+    if asyncnntp.asyncio is not None:
+        result.append(AsyncioClient)
+    return result
+
+def benchmark(client_class, server, command, connections, pipeline_depth,
+              use_ssl, args, output):
+    if command == "STAT":
+        name, count = "stat", 20000
+    else:
+        name, count = "body", max(10, 400000000 // args.body_size)
+    if args.quick:
+        count //= 10
+
+    params = {"client": client_class.name, "connections": connections,
+              "pipeline_depth": pipeline_depth, "ssl": use_ssl,
+              "count": count, "latency": args.latency}
+    if command == "BODY":
+        params["body_size"] = args.body_size
+    if use_ssl and server.ssl_port is None:
+        output.skipped(name, params, "no certificate, openssl is missing")
+        return
+
+    client = client_class(server.ssl_port if use_ssl else server.port,
+                          connections, pipeline_depth, use_ssl)
+    try:
+        runs = iter(range(args.repeat))
+        elapsed = common.best_of(
+            args.repeat,
+            lambda: client.run(command, message_ids(command, count,
+                                                    next(runs))))
+    finally:
+        client.close()
+
+    if command == "STAT":
+        output.result(name, params, requests_per_sec=count / elapsed,
+                      per_connection=count / elapsed / connections)
+    else:
+        output.result(name, params,
+                      mb_per_sec=count * args.body_size / elapsed / 1e6,
+                      requests_per_sec=count / elapsed)
+
+def main():
+    parser = common.parser(__doc__.split("\n\n")[0])
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="delay of the server's responses in seconds")
+    parser.add_argument("--body-size", type=int, default=768000,
+                        help="size of the BODY responses")
+    args = parser.parse_args()
+    if args.repeat is None:
+        args.repeat = 1 if args.quick else 3
+    output = common.Output(args.output)
+
+    directory = tempfile.mkdtemp()
+    try:
+        certificate = make_certificate(directory) or (None, None)
+        server = Server(args.body_size, args.latency, *certificate)
+        try:
+            for client_class in clients():
+                for command in ("STAT", "BODY"):
+                    if args.filter not in command.lower():
+                        continue
+                    for use_ssl in (False, True):
+                        for connections in CONNECTIONS:
+                            for depth in PIPELINE_DEPTHS:
+                                benchmark(client_class, server, command,
+                                          connections, depth, use_ssl, args,
+                                          output)
+        finally:
+            server.stop()
+    finally:
+        shutil.rmtree(directory)
+    output.close()
+
+if __name__ == "__main__":
+    main()
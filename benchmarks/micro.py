@@ -0,0 +1,223 @@
+"""
+Micro-benchmarks of the client without a network: responses are fed to the
+receive path of a connection from memory, in chunks of a given size.
+
+    python micro.py [--quick] [--output results.jsonl]
+
+* ``handle_read`` - :class:`asyncnntp.NNTP` reading pipelined responses
+  through ``_handle_read``, for a number of response and chunk sizes.
+* ``buffer_updated`` - the same for :class:`asyncnntp.AsyncNNTP`.
+* ``request_finish`` - ``Request.finish`` of a received response.
+* ``do_callback`` - calling the callbacks of a completed request, by name
+  with ``_do_callback`` and as resolved when the request was added.
+"""
+import common
+
+import asyncnntp
+
+# Response sizes: a STAT response, a small body and a typical binary segment
+RESPONSES = (("stat", 0), ("body", 4096), ("body", 768000))
+
+CHUNK_SIZES = (1460, 16384, 262144)
+
+def response(kind, size):
+    """
+    Returns a response of ``kind`` with a body of about ``size`` bytes.
+    """
+    if kind == "stat":
+        return b"223 0 <message-id@example.com>\r\n"
+    line = b"x" * 126 + b"\r\n"
+    return (b"222 0 <message-id@example.com>\r\n" +
+            line * max(1, size // len(line)) + b".\r\n")
+
+class MemorySocket:
+    """
+    Hands out the loaded data in chunks of at most ``chunk_size`` bytes, like
+    a socket receiving it.  Sent data is discarded.
+    """
+    def __init__(self, chunk_size):
+        self.chunk_size = chunk_size
+        self.load(b"")
+
+    def load(self, data):
+        self.data = memoryview(data)
+        self.pos  = 0
+
+    def recv_into(self, buffer, nbytes=0):
+        count = min(len(buffer), nbytes or len(buffer), self.chunk_size,
+                    len(self.data) - self.pos)
+        buffer[:count] = self.data[self.pos:self.pos + count]
+        self.pos += count
+        return count
+
+    def send(self, data):
+        return len(data)
+
+    def close(self):
+        pass
+
+if asyncnntp.asyncore is not None:
+    class MemoryNNTP(asyncnntp.NNTP):
+        """
+        An :class:`asyncnntp.NNTP` that is connected to a
+        :class:`MemorySocket`.
+        """
+        def __init__(self, chunk_size, pipeline_depth=1):
+            asyncnntp.BaseNNTP.__init__(self, "localhost",
+                                        pipeline_depth=pipeline_depth)
+            asyncnntp.asynchat.async_chat.__init__(self)
+            self.socket      = MemorySocket(chunk_size)
+            self.connected   = True
+            self.established = True
+            self._connected  = True
+
+        def on_body(self, request):
+            pass
+
+class MemoryTransport:
+    def write(self, data):
+        pass
+
+    def is_closing(self):
+        return False
+
+# The connections below pipeline every request, as a server only responds to
+# the requests it has received
+def handle_read(kind, size, chunk_size, count):
+    conn = MemoryNNTP(chunk_size, count)
+    data = response(kind, size) * count
+
+    def run():
+        conn.socket.load(data)
+        command = conn.stat if kind == "stat" else conn.body
+        futures = [command("<message-id@example.com>") for i in range(count)]
+        while conn.socket.pos < len(data):
+            conn._handle_read()
+        assert futures[-1].done()
+    return data, run
+
+def buffer_updated(kind, size, chunk_size, count):
+    loop = asyncnntp.asyncio.new_event_loop()
+    conn = asyncnntp.AsyncNNTP("localhost", pipeline_depth=count, loop=loop)
+    conn.connection_made(MemoryTransport())
+    data = response(kind, size) * count
+    view = memoryview(data)
+
+    def run():
+        command = conn.stat if kind == "stat" else conn.body
+        futures = [command("<message-id@example.com>") for i in range(count)]
+        pos = 0
+        while pos < len(data):
+            buffer = conn.get_buffer(-1)
+            chunk  = min(len(buffer), chunk_size, len(data) - pos)
+            buffer[:chunk] = view[pos:pos + chunk]
+            pos += chunk
+            conn.buffer_updated(chunk)
+        assert futures[-1].done()
+    return data, run
+
+def received(size, count, sink):
+    """
+    Returns ``count`` requests that have received a ``BODY`` response with a
+    body of about ``size`` bytes, all but the terminator.
+    """
+    data = response("body", size)
+    status, _, body = data.partition(b"\r\n")
+    body = b"\r\n" + body[:-len(b".\r\n")]
+
+    requests = []
+    for i in range(count):
+        request = asyncnntp.Request(None, "BODY", "<message-id@example.com>",
+                                    sink=(lambda data: None) if sink else None)
+        request.handle_data(status)
+        request.handle_terminator()
+        request.handle_data(body)
+        requests.append(request)
+    return requests
+
+def request_finish(args, output):
+    for size in (0, 4096, 768000):
+        for sink in (False, True):
+            count = 200 if size > 100000 else 10000
+            if args.quick:
+                count //= 10
+            params = {"body_size": size, "sink": sink, "count": count}
+
+            best = None
+            for i in range(args.repeat):
+                requests = received(size, count, sink)
+                start = common.timer()
+                for request in requests:
+                    request.finish()
+                elapsed = common.timer() - start
+                best = elapsed if best is None else min(best, elapsed)
+            output.result("request_finish", params,
+                          us_per_call=best / count * 1e6)
+
+def do_callback(args, output):
+    if asyncnntp.asyncore is None:
+        output.skipped("do_callback", {}, "asyncore is not available")
+        return
+
+    count = 20000 if args.quick else 200000
+    conn = MemoryNNTP(16384)
+    request = asyncnntp.Request(conn, "BODY", "<message-id@example.com>",
+                                callbacks=(None, "on_body"))
+    request.handlers = conn._resolve_callbacks(request.get_callbacks())
+
+    def by_name():
+        for i in range(count):
+            conn._do_callback(("on_body",), request)
+
+    def resolved():
+        for i in range(count):
+            for handler in request.handlers:
+                handler(request)
+
+    for name, func in (("by_name", by_name), ("resolved", resolved)):
+        elapsed = common.best_of(args.repeat, func)
+        output.result("do_callback", {"lookup": name, "count": count},
+                      ns_per_call=elapsed / count * 1e9)
+
+def reads(name, setup, args, output):
+    for kind, size in RESPONSES:
+        for chunk_size in CHUNK_SIZES:
+            # About the same amount of work for every size
+            count = max(20, min(20000, 20000000 // max(size, 1000)))
+            if args.quick:
+                count = max(10, count // 10)
+            params = {"response": kind, "body_size": size,
+                      "chunk_size": chunk_size, "count": count}
+
+            data, run = setup(kind, size, chunk_size, count)
+            elapsed = common.best_of(args.repeat, run)
+            output.result(name, params,
+                          responses_per_sec=count / elapsed,
+                          mb_per_sec=len(data) / elapsed / 1e6)
+
+def main():
+    args = common.parser(__doc__.split("\n\n")[0]).parse_args()
+    if args.repeat is None:
+        args.repeat = 3 if args.quick else 5
+    output = common.Output(args.output)
+
+    benchmarks = [("request_finish", request_finish),
+                  ("do_callback", do_callback)]
+    if asyncnntp.asyncore is not None:
+        benchmarks.insert(0, ("handle_read", lambda args, output:
+                              reads("handle_read", handle_read, args,
+                                    output)))
+    else:
+        output.skipped("handle_read", {}, "asyncore is not available")
+    if asyncnntp.asyncio is not None:
+        benchmarks.insert(1, ("buffer_updated", lambda args, output:
+                              reads("buffer_updated", buffer_updated, args,
+                                    output)))
+
+    for name, benchmark in benchmarks:
+        if args.filter in name:
+            benchmark(args, output)
+    output.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Runs a :class:`mocknntp.MockNNTPServer` for the end-to-end benchmarks, in a
+process of its own so that it doesn't compete with the client for the GIL.
+Prints the port (and the TLS port, if a certificate is given) and serves
+until its standard input is closed.
+
+Articles are made up on demand: ``<stat-N@bench>`` has an empty body and
+``<body-N@bench>`` a body of ``--body-size`` bytes.
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+
+import mocknntp
+
+class Articles:
+    """
+    Makes up the articles the benchmarks ask for.
+    """
+    def __init__(self, body_size):
+        line = b"x" * 126 + b"\r\n"
+        body = line * max(1, body_size // len(line))
+        self.articles = {"stat": mocknntp.Article("<stat@bench>"),
+                         "body": mocknntp.Article("<body@bench>", body)}
+
+    def get(self, message_id):
+        kind = message_id[1:].partition("-")[0]
+        return self.articles.get(kind)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--body-size", type=int, default=768000)
+    parser.add_argument("--certfile")
+    parser.add_argument("--keyfile")
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+
+    articles = Articles(args.body_size)
+    servers = [mocknntp.MockNNTPServer(articles=articles,
+                                       latency=args.latency)]
+    if args.certfile:
+        context = mocknntp.MockNNTPServer.ssl_context_from(args.certfile,
+                                                           args.keyfile)
+        servers.append(mocknntp.MockNNTPServer(articles=articles,
+                                               latency=args.latency,
+                                               ssl_context=context))
+
+    for server in servers:
+        server.start()
+    sys.stdout.write(" ".join(str(server.port) for server in servers) + "\n")
+    sys.stdout.flush()
+
+    sys.stdin.read()
+    for server in servers:
+        server.stop()
+
+if __name__ == "__main__":
+    main()
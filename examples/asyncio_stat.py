@@ -0,0 +1,36 @@
+"""
+An example that uses the ``asyncio`` client to check whether a few articles
+exist, with the STAT commands pipelined on a single connection.
+"""
+import sys
+sys.path.append("../")
+
+import asyncio
+import asyncnntp
+import logging
+
+HOST = "news.newhost.com"
+PORT = 119
+USER = "username"
+PASS = "password"
+
+MESSAGE_IDS = ["<message-id-1>", "<message-id-2>", "<message-id-3>"]
+
+async def main():
+    # Connect and authenticate
+    conn = await asyncnntp.AsyncNNTP.connect(HOST, PORT, USER, PASS,
+                                             pipeline_depth=10)
+
+    # Each method returns a future which resolves to the completed request
+    requests = await asyncio.gather(*[conn.stat(message_id)
+                                      for message_id in MESSAGE_IDS])
+    for request in requests:
+        print("%s: %s" % (request.args[0], request.response_code))
+
+    await conn.quit()
+
+if __name__ == "__main__":
+    # Enable logging
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+
+    asyncio.run(main())
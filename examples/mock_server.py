@@ -0,0 +1,64 @@
+"""
+An example that downloads a file split into yEnc encoded articles from the
+local mock server in ``mocknntp``, over a slow and unreliable link.  No news
+server is needed.
+"""
+import sys
+sys.path.append("../")
+
+import asyncio
+import asyncnntp
+import mocknntp
+import os
+import shutil
+import tempfile
+
+PARTS     = 20
+PART_SIZE = 100000
+
+def nzb_file(server, data):
+    """
+    Adds ``data`` to the server as ``PARTS`` articles and returns the
+    :class:`asyncnntp.NZBFile` that refers to them.
+    """
+    nzb_file = asyncnntp.NZBFile('"example.bin" yEnc')
+    for number in range(1, PARTS + 1):
+        begin = (number - 1) * PART_SIZE
+        body = mocknntp.yenc_encode(data[begin:begin + PART_SIZE],
+                                    "example.bin", number, PARTS, begin + 1,
+                                    len(data))
+        message_id = "<part%d@example>" % number
+        server.add_article(message_id, body, groups=["alt.binaries.test"])
+        nzb_file.segments.append(asyncnntp.NZBSegment(
+            message_id, number, len(body), nzb_file))
+    return nzb_file
+
+async def main(server, files, directory):
+    connections = await asyncio.gather(*[
+        asyncnntp.AsyncNNTP.connect("127.0.0.1", server.port, "user",
+                                    "secret", pipeline_depth=4)
+        for i in range(4)])
+
+    downloader = asyncnntp.Downloader(connections, files, directory)
+    await downloader.start()
+    print("Done: %d, missing: %d, failed: %d" % (downloader.done,
+                                                downloader.missing,
+                                                downloader.failed))
+    for conn in connections:
+        conn.close()
+
+if __name__ == "__main__":
+    # 50ms round trips, 2 MB/s per connection and an occasional error
+    server = mocknntp.MockNNTPServer(users={"user": "secret"}, latency=0.05,
+                                     bandwidth=2000000, error_rate=0.05)
+    data = os.urandom(PARTS * PART_SIZE)
+    files = [nzb_file(server, data)]
+
+    directory = tempfile.mkdtemp()
+    try:
+        with server:
+            asyncio.run(main(server, files, directory))
+        with open(os.path.join(directory, "example.bin"), "rb") as f:
+            print("Identical: %s" % (f.read() == data))
+    finally:
+        shutil.rmtree(directory)
@@ -1,6 +1,8 @@
 """
-An example of a persistent NNTP client using ``asyncnntp``.  It detects an
-"idle" disconnect and then reconnects
+An example of a persistent NNTP client using ``asyncnntp``.  With
+``auto_reconnect`` it reconnects whenever the connection is lost, be it an
+"idle" disconnect by the server or a network error, and ``timeout`` drops a
+connection on which the server stopped responding.
 """
 import sys
 sys.path.append("../")
@@ -15,20 +17,10 @@ USER = "username"
 PASS = "password"
 
 class NNTP(asyncnntp.NNTP):
-    def on_disconnect(self, request):
+    def on_ready(self):
         """
-        Callback when the server disconnects us.
-        
-        This will ensure that if we're disconnected due to idleness that we
-        reconnect.
-        """
-        if "idle" in request.response_message.lower():
-            self.logger.info("Reconnecting...")
-            self.reconnect()
-
-    def on_ready(self, request):
-        """
-        Once this is called we are fully connected and authenticated.
+        Once this is called we are fully connected and authenticated, again
+        after every reconnect.
         """
         self.logger.info("Connected!")
 
@@ -40,7 +32,7 @@ if __name__ == "__main__":
     asyncnntp.loop_forever(timeout=1, count=2)
 
     # Create a NNTP connection
-    conn = NNTP(HOST, PORT, USER, PASS)
+    conn = NNTP(HOST, PORT, USER, PASS, auto_reconnect=True, timeout=60)
 
     # Just loop until killed
     try:
@@ -49,6 +41,5 @@ if __name__ == "__main__":
     except (KeyboardInterrupt, Exception):
         pass
     finally:
-        # Manually close the connection, note this will fire the
-        # ``on_quit`` callback and not the ``on_disconnect`` callback
+        # Manually close the connection, which is not reconnected
         conn.quit()
@@ -1,131 +1,171 @@
 """
-An example NZB verification utility using ``asyncnntp``.
+An NZB verification utility using ``asyncnntp``.  Every segment of the NZB is
+checked with a STAT command, pipelined over a number of connections, and the
+check stops as soon as the NZB can't be repaired with its par2 files.
+
+    python verify.py --host news.newshost.com --user username \\
+                     --password password release.nzb
 """
+from __future__ import print_function
+
 import sys
 sys.path.append("../")
 
+import argparse
 import asyncnntp
-import os
-import time
 import logging
+import time
 
-try:
-    from xml.etree import cElementTree as ET
-except:
-    from xml.etree import ElementTree as ET
-
-HOST = "news.newshost.com"
-PORT = 119
-USER = "username"
-PASS = "password"
-CONN = 20
-
-segments    = []
-available   = []
-missing     = []
-unknown     = []
-connections = []
-
-class NNTP(asyncnntp.NNTP):
-    def stat_next_article(self):
-        """
-        Grabs the next message-id from the queue and runs a STAT command.
-        """
-        if len(segments) > 0:
-            message_id = "<%s>" % segments.pop()
-
-            # Call the actual stat method
-            self.stat(message_id)
-
-    def on_ready(self):
-        """
-        Callback after the connection has been established and any
-        authentication has been completed.  We use this as an entry point to
-        begin checking message-ids.
-        """
-        # Start checking segments
-        self.stat_next_article()
-
-    def on_stat(self, request):
-        """
-        Callback after a STAT command has completed.
-        
-        According to the spec (https://tools.ietf.org/html/rfc3977)
-        the following codes are possible:
-
-            223 - Article exists
-            430 - No article with that message-id
-        """
-        # A stat command looks like "STAT <message-id>".  In the ``request``
-        # object ``command`` is "STAT" and ``args`` is ``('<message-id>',)``,
-        # so the first argument is the requested message-id.
-        message_id = request.args[0]
-        
-        if request.response_code == "223":
-            # This segment is available
-            available.append(message_id)
-        elif request.response_code == "430":
-            # This segment is not available
-            missing.append(message_id)
-        else:
-            # Could be a different 4xx error or a 5xx error.  A better
-            # implementation should check, but here we just mark it unknown.
-            unknown.append(message_id)
-        
-        # Check the next message-id
-        self.stat_next_article()
+def parse_args():
+    parser = argparse.ArgumentParser(description="Checks the completeness "
+                                                 "of an NZB.")
+    parser.add_argument("nzb", help="path of the NZB")
+    parser.add_argument("--host", required=True)
+    parser.add_argument("--port", type=int, default=119)
+    parser.add_argument("--user")
+    parser.add_argument("--password")
+    parser.add_argument("--ssl", action="store_true", default=None,
+                        help="use SSL (the default for port 563)")
+    parser.add_argument("--no-verify", action="store_true",
+                        help="accept any SSL certificate of the server")
+    parser.add_argument("--connections", type=int, default=20)
+    parser.add_argument("--pipeline", type=int, default=20,
+                        help="STAT commands in flight per connection")
+    parser.add_argument("--all", action="store_true",
+                        help="check every segment, even once the NZB is "
+                             "known to be unrecoverable")
+    parser.add_argument("--missing-cache", metavar="PATH",
+                        help="remember missing articles in PATH, so that "
+                             "they aren't checked again for a while")
+    parser.add_argument("--verbose", action="store_true",
+                        help="print the result of every missing segment")
+    parser.add_argument("--debug", action="store_true")
+    return parser.parse_args()
+
+class Progress:
+    """
+    Prints the results as they arrive.
+    """
+    def __init__(self, verifier, verbose=False):
+        self.verifier = verifier
+        self.verbose  = verbose
+        self.printed  = 0
+
+    def __call__(self, segment, status):
+        if self.verbose and status != "available":
+            print("\r%s: %s" % (segment.message_id, status))
+
+        now = time.time()
+        if now - self.printed >= 0.2:
+            self.printed = now
+            sys.stdout.write("\r%d/%d" % (self.verifier.checked,
+                                          self.verifier.total))
+            sys.stdout.flush()
+
+def ssl_context(args):
+    """
+    Returns the SSL context of the connections, one for all of them so that
+    they resume each other's TLS sessions.
+    """
+    if not args.no_verify:
+        return asyncnntp.default_ssl_context()
+    global _unverified_context
+    if _unverified_context is None:
+        import ssl
+        _unverified_context = ssl.create_default_context()
+        _unverified_context.check_hostname = False
+        _unverified_context.verify_mode    = ssl.CERT_NONE
+    return _unverified_context
+
+_unverified_context = None
+
+def verify_asyncore(args, files, negative_cache):
+    """
+    Checks the NZB with an :class:`asyncnntp.NNTPPool`, driving
+    ``asyncore.loop`` until the verifier is done.
+    """
+    import asyncore
+
+    pool = asyncnntp.NNTPPool(args.host, args.port, args.user, args.password,
+                              connections=args.connections,
+                              pipeline_depth=args.pipeline, use_ssl=args.ssl,
+                              ssl_context=ssl_context(args),
+                              negative_cache=negative_cache)
+    verifier = asyncnntp.Verifier(pool, files, stop_early=not args.all)
+    verifier.output = Progress(verifier, args.verbose)
+    future = verifier.start()
+    try:
+        while not future.done():
+            asyncore.loop(timeout=1, count=1)
+    finally:
+        pool.quit()
+    return verifier
+
+def verify_asyncio(args, files, negative_cache):
+    """
+    Checks the NZB with a list of :class:`asyncnntp.AsyncNNTP` connections.
+    """
+    import asyncio
+
+    loop = asyncio.new_event_loop()
+    connections = loop.run_until_complete(asyncio.gather(*[
+        asyncnntp.AsyncNNTP.connect(args.host, args.port, args.user,
+                                    args.password, use_ssl=args.ssl,
+                                    ssl_context=ssl_context(args),
+                                    pipeline_depth=args.pipeline, loop=loop,
+                                    negative_cache=negative_cache)
+        for i in range(args.connections)]))
+
+    verifier = asyncnntp.Verifier(connections, files, stop_early=not args.all)
+    verifier.output = Progress(verifier, args.verbose)
+    try:
+        loop.run_until_complete(verifier.start())
+    finally:
+        for conn in connections:
+            conn.close()
+        loop.close()
+    return verifier
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print "Usage: %s <nzb>" % sys.argv[0]
-        sys.exit(1)
-    
-    # Uncomment to enable logging
-    #logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+    args = parse_args()
+    if args.debug:
+        logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
 
-    path = os.path.abspath(os.path.expanduser(sys.argv[1]))
     try:
-        nzb = ET.parse(path)
-    except:
-        print "Couldn't parse NZB: %s" % path
+        files = asyncnntp.parse_nzb(args.nzb)
+    except (IOError, ValueError) as e:
+        print(e)
         sys.exit(2)
 
-    # Get all the segments from the NZB
-    for segment in nzb.findall(".//{http://www.newzbin.com/DTD/2003/nzb}segment"):
-        segments.append(segment.text)
-
-    num_segments = len(segments)
-    print "Found %d segments" % num_segments
+    print("Found %d segments in %d files" %
+          (sum(len(f.segments) for f in files), len(files)))
 
-    # Start the async loop - this runs in a separate thread
-    asyncnntp.loop_forever(timeout=1, count=2)
-
-    # Create the NNTP connections
-    for i in range(CONN):
-        connections.append(NNTP(HOST, PORT, USER, PASS))
+    negative_cache = None
+    if args.missing_cache:
+        negative_cache = asyncnntp.NegativeCache(path=args.missing_cache)
 
+    start = time.time()
     try:
-        count = 0
-        while count < num_segments:
-            count = len(available) + len(missing) + len(unknown)
-            
-            # Print out the progress
-            sys.stdout.write("\r%d/%d" % (count, num_segments))
-            sys.stdout.flush()
-            
-            # Sleep for a bit to avoid looping too fast
-            time.sleep(0.2)
-
-        sys.stdout.write("...Done\n")
-
-        print "Available = %s" % len(available)
-        print "Missing   = %s" % len(missing)
-        print "Unknown   = %s" % len(unknown)
+        if asyncnntp.asyncore is not None:
+            verifier = verify_asyncore(args, files, negative_cache)
+        else:
+            verifier = verify_asyncio(args, files, negative_cache)
     except KeyboardInterrupt:
-        pass
-    except Exception, e:
-        print "Exception = %s" % str(e)
+        sys.exit(1)
     finally:
-        # Disconnect all connections
-        for conn in connections:
-            conn.quit()
+        if negative_cache is not None:
+            negative_cache.save()
+
+    print("\r%d/%d checked in %.1fs" % (verifier.checked, verifier.total,
+                                         time.time() - start))
+    print("Available = %s" % verifier.available)
+    print("Missing   = %s" % verifier.missing)
+    print("Unknown   = %s" % verifier.unknown)
+    if verifier.recoverable is False:
+        print("Unrecoverable: %d bytes missing, %d recovery bytes left" %
+              (verifier.missing_bytes, verifier.recovery_bytes))
+        sys.exit(3)
+    elif not verifier.complete:
+        print("Incomplete, but repairable with par2")
+    else:
+        print("Complete")
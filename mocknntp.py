@@ -0,0 +1,760 @@
+"""
+mocknntp.py - A scriptable NNTP server for testing ``asyncnntp``.
+
+The server runs in background threads of the current process and listens on
+the loopback interface, so a client in the same process (or a benchmark in
+another one) can talk to it like to a real news server::
+
+    server = MockNNTPServer(users={"user": "secret"})
+    server.add_article("<part1@example>", body, groups=["alt.test"])
+    with server:
+        nntp = asyncnntp.NNTP("127.0.0.1", server.port, "user", "secret")
+        ...
+"""
+import bisect
+import random
+import socket
+import threading
+import time
+import zlib
+
+try:
+    import queue
+    import socketserver
+except ImportError:
+    # Python 2
+    import Queue as queue
+    import SocketServer as socketserver
+
+try:
+    import ssl
+except ImportError:
+    ssl = None
+
+CRLF = b'\r\n'
+
+# The fields of an overview line after the article number, see
+# ``LIST OVERVIEW.FMT``
+OVERVIEW_FMT = (b"Subject:", b"From:", b"Date:", b"Message-ID:",
+                b"References:", b":bytes", b":lines", b"Xref:full")
+
+# Commands that ``error_rate`` and ``drop_rate`` apply to, failing the others
+# would mostly break the client's handshake
+FAULT_COMMANDS = ("ARTICLE", "HEAD", "BODY", "STAT", "GROUP", "LISTGROUP",
+                  "OVER", "XOVER")
+
+def _bytes(value):
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode("utf-8")
+
+def yenc_encode(data, name="file.bin", part=None, total=None, begin=1,
+                size=None, line_length=128):
+    """
+    Returns ``data`` as a yEnc encoded article body, a single part unless
+    ``part`` is given.  ``begin`` is the (1-based) offset of the part within
+    the file of ``size`` bytes.
+    """
+    lines, line = [], bytearray()
+    for byte in bytearray(data):
+        byte = (byte + 42) & 255
+        # NUL, LF, CR and "=" are always escaped, as are a leading TAB,
+        # space and "." (which would have to be dot-stuffed)
+        if byte in (0, 10, 13, 61) or (not line and byte in (9, 32, 46)):
+            line += bytearray((61, (byte + 64) & 255))
+        else:
+            line.append(byte)
+        if len(line) >= line_length:
+            lines.append(bytes(line))
+            line = bytearray()
+    if line:
+        lines.append(bytes(line))
+
+    crc  = "%08x" % (zlib.crc32(data) & 0xffffffff)
+    size = size or len(data)
+    if part:
+        header = ["=ybegin part=%d total=%d line=%d size=%d name=%s" %
+                  (part, total or part, line_length, size, name),
+                  "=ypart begin=%d end=%d" % (begin, begin + len(data) - 1)]
+        trailer = "=yend size=%d part=%d pcrc32=%s" % (len(data), part, crc)
+    else:
+        header  = ["=ybegin line=%d size=%d name=%s" % (line_length, size,
+                                                        name)]
+        trailer = "=yend size=%d crc32=%s" % (len(data), crc)
+    return CRLF.join([_bytes(h) for h in header] + lines +
+                     [_bytes(trailer)]) + CRLF
+
+class Article:
+    """
+    An article of a :class:`MockNNTPServer`.  ``body`` is the raw body, with
+    lines terminated by CRLF but not dot-stuffed.  ``headers`` is a list of
+    (name, value) tuples, by default a minimal set of headers is made up.
+    """
+    def __init__(self, message_id, body=b"", headers=None):
+        self.message_id = message_id
+        self.body       = _bytes(body)
+        self.groups     = []    # (group, number)
+        if headers is None:
+            headers = [("From", "poster@example.com"),
+                       ("Subject", "Article %s" % message_id),
+                       ("Date", "Sat, 01 Jan 2022 00:00:00 +0000"),
+                       ("Message-ID", message_id)]
+        self.headers = headers
+
+    def header(self, name, default=""):
+        name = name.lower()
+        for key, value in self.headers:
+            if key.lower() == name:
+                return value
+        return default
+
+    @property
+    def head(self):
+        lines = ["%s: %s" % header for header in self.headers]
+        if self.groups and not self.header("Newsgroups"):
+            lines.append("Newsgroups: %s" % ",".join(
+                group for group, number in self.groups))
+        return CRLF.join(_bytes(line) for line in lines) + CRLF
+
+    def overview(self, number):
+        """
+        Returns the overview line of the article, without its CRLF.
+        """
+        xref = "Xref: mock %s" % " ".join(
+            "%s:%d" % entry for entry in self.groups) if self.groups else ""
+        fields = [str(number), self.header("Subject"), self.header("From"),
+                  self.header("Date"), self.message_id,
+                  self.header("References"), str(len(self.body)),
+                  str(self.body.count(CRLF)), xref]
+        return b"\t".join(_bytes(field.replace("\t", " "))
+                          for field in fields)
+
+class Group:
+    """
+    A newsgroup of a :class:`MockNNTPServer`, mapping article numbers to
+    message-ids.
+    """
+    def __init__(self, name):
+        self.name     = name
+        self.articles = {}
+        self.numbers  = []     # Sorted
+
+    @property
+    def low(self):
+        return self.numbers[0] if self.numbers else 1
+
+    @property
+    def high(self):
+        return self.numbers[-1] if self.numbers else 0
+
+    def add(self, message_id, number=None):
+        if number is None:
+            number = self.high + 1
+        if number not in self.articles:
+            bisect.insort(self.numbers, number)
+        self.articles[number] = message_id
+        return number
+
+    def range(self, first, last):
+        """
+        Returns the numbers of the articles from ``first`` to ``last``.
+        """
+        start = bisect.bisect_left(self.numbers, first)
+        end   = bisect.bisect_right(self.numbers, last)
+        return self.numbers[start:end]
+
+class _Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    allow_reuse_address = True
+    daemon_threads      = True
+    # The default of 5 stalls a pool that opens its connections at once
+    request_queue_size  = 128
+
+class _Handler(socketserver.BaseRequestHandler):
+    """
+    One client connection, see :class:`MockNNTPServer`.
+    """
+    def setup(self):
+        self.mock          = self.server.mock
+        self.sock          = self.request
+        self.rfile         = None
+        self.reader        = None
+        self.user          = None
+        self.authenticated = not self.mock.users
+        self.group         = None
+        self.number        = None   # The current article number
+        self.free_at       = 0.0    # See ``_write``
+        self.deflate       = None   # Set once ``COMPRESS DEFLATE`` is active
+        self.gzip          = None   # The ``XFEATURE COMPRESS`` arguments
+
+    def handle(self):
+        mock = self.mock
+        try:
+            if mock.ssl_context is not None:
+                self.sock = mock.ssl_context.wrap_socket(self.sock,
+                                                         server_side=True)
+            self.rfile = self.sock.makefile("rb")
+            mock._opened(self.sock)
+
+            # Commands are read as they arrive, so that the time a pipelined
+            # command was received is known when its turn comes
+            lines  = queue.Queue()
+            self.reader = threading.Thread(target=self._read, args=(lines,))
+            self.reader.daemon = True
+            self.reader.start()
+
+            self._write(_bytes(mock.greeting) + CRLF, time.time())
+            while True:
+                try:
+                    line, received = lines.get(timeout=mock.idle_timeout)
+                except queue.Empty:
+                    self._write(b"400 Idle timeout, closing connection" +
+                                CRLF, time.time())
+                    return
+                if not line:
+                    return
+                if not self._command(line.strip(), received):
+                    return
+        except (socket.error, ValueError) as e:
+            # Includes SSL errors, and the socket being closed by ``stop``
+            mock._log("Connection closed: %s" % e)
+        finally:
+            mock._closed(self.sock)
+
+    def _read(self, lines):
+        try:
+            for line in iter(self.rfile.readline, b""):
+                lines.put((line, time.time()))
+                if self._compress_requested(line):
+                    self._read_compressed(lines)
+                    break
+        except (socket.error, ValueError, zlib.error):
+            pass
+        lines.put((b"", time.time()))
+
+    def _compress_requested(self, line):
+        """
+        Returns whether ``line`` is a ``COMPRESS DEFLATE`` command that
+        ``_compress`` accepts.  The client sends nothing more until it has
+        the response, so the file object has nothing buffered beyond it.
+        """
+        words = line.decode("utf-8", "replace").upper().split()
+        return words == ["COMPRESS", "DEFLATE"] and \
+            "DEFLATE" in self.mock.compression
+
+    def _read_compressed(self, lines):
+        inflate = zlib.decompressobj(-zlib.MAX_WBITS)
+        pending = b""
+        while True:
+            data = self.sock.recv(65536)
+            if not data:
+                return
+            pending += inflate.decompress(data)
+            while CRLF in pending:
+                line, pending = pending.split(CRLF, 1)
+                lines.put((line + CRLF, time.time()))
+
+    def finish(self):
+        # A shutdown, as the reader's file object keeps the socket open
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        if self.reader is not None:
+            # Or it may still be running when the interpreter exits
+            self.reader.join(1.0)
+        if self.rfile is not None:
+            self.rfile.close()
+        self.sock.close()
+
+    def _command(self, line, received):
+        """
+        Handles a command line, returns ``False`` once the connection is to
+        be closed.
+        """
+        mock  = self.mock
+        words = line.decode("utf-8", "replace").split()
+        if not words:
+            return True
+        command, args = words[0].upper(), words[1:]
+        if command in ("MODE", "LIST") and args:
+            command = "%s %s" % (command, args.pop(0).upper())
+        mock._count(command)
+
+        fault = command.split()[0] in FAULT_COMMANDS
+        if fault and mock._chance(mock.drop_rate):
+            # Closed halfway through the response
+            response = self._respond(command, args)
+            self._write(response[:len(response) // 2], received)
+            return False
+        if fault and mock._chance(mock.error_rate):
+            response = b"403 Simulated failure" + CRLF
+        else:
+            response = self._respond(command, args)
+
+        self._write(response, received)
+        if command == "COMPRESS" and response.startswith(b"206"):
+            # Everything after the response is compressed
+            self.deflate = zlib.compressobj(6, zlib.DEFLATED,
+                                            -zlib.MAX_WBITS)
+        return command != "QUIT"
+
+    def _write(self, data, received):
+        """
+        Sends ``data`` no sooner than ``latency`` seconds after the command
+        was ``received``, at no more than ``bandwidth`` bytes per second.
+        """
+        mock = self.mock
+        delay = received + mock.latency - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        if self.deflate is not None:
+            data = self.deflate.compress(data) + \
+                   self.deflate.flush(zlib.Z_SYNC_FLUSH)
+
+        if not mock.bandwidth:
+            self.sock.sendall(data)
+            mock._sent(len(data))
+            return
+
+        # Sent in slices of about 10ms worth of data
+        step = max(1, int(mock.bandwidth / 100))
+        for start in range(0, len(data), step):
+            piece = data[start:start + step]
+            now = time.time()
+            if self.free_at > now:
+                time.sleep(self.free_at - now)
+            self.sock.sendall(piece)
+            mock._sent(len(piece))
+            self.free_at = max(now, self.free_at) + \
+                len(piece) / float(mock.bandwidth)
+
+    def _respond(self, command, args):
+        """
+        Returns the complete response to ``command``.
+        """
+        mock = self.mock
+        if command == "QUIT":
+            return b"205 Bye" + CRLF
+        if command == "AUTHINFO":
+            return self._authinfo(args)
+        if command == "CAPABILITIES":
+            return self._multiline(b"101 Capability list:",
+                                   self._capabilities())
+        if command == "COMPRESS":
+            return self._compress(args)
+        if not self.authenticated:
+            return b"480 Authentication required" + CRLF
+
+        if command == "MODE READER":
+            return b"200 Reader mode, posting not permitted" + CRLF
+        if command == "DATE":
+            return _bytes("111 %s" % time.strftime("%Y%m%d%H%M%S",
+                                                   time.gmtime())) + CRLF
+        if command in ("GROUP", "LISTGROUP"):
+            return self._group(command, args)
+        if command in ("ARTICLE", "HEAD", "BODY", "STAT"):
+            return self._article(command, args)
+        if command in ("OVER", "XOVER"):
+            return self._gzip(self._over(args))
+        if command == "XFEATURE":
+            return self._xfeature(args)
+        if command in ("HDR", "XHDR"):
+            return self._hdr(command, args)
+        if command == "LIST OVERVIEW.FMT":
+            return self._multiline(b"215 Order of fields in overview",
+                                   OVERVIEW_FMT)
+        if command in ("LIST", "LIST ACTIVE"):
+            return self._multiline(b"215 List of newsgroups", [
+                _bytes("%s %d %d n" % (group.name, group.high, group.low))
+                for group in sorted(mock.groups.values(),
+                                    key=lambda group: group.name)])
+        return b"500 Unknown command" + CRLF
+
+    def _multiline(self, status, lines):
+        data = [status]
+        for line in lines:
+            if line.startswith(b"."):
+                line = b"." + line
+            data.append(line)
+        data.append(b".")
+        return CRLF.join(data) + CRLF
+
+    def _capabilities(self):
+        capabilities = [b"VERSION 2", b"READER", b"OVER", b"HDR",
+                        b"LIST ACTIVE OVERVIEW.FMT",
+                        b"IMPLEMENTATION asyncnntp mock"]
+        if not self.authenticated:
+            capabilities.append(b"AUTHINFO USER")
+        if "DEFLATE" in self.mock.compression and self.deflate is None:
+            capabilities.append(b"COMPRESS DEFLATE")
+        return capabilities
+
+    def _compress(self, args):
+        if "DEFLATE" not in self.mock.compression:
+            return b"500 Unknown command" + CRLF
+        if self.deflate is not None:
+            return b"502 Compression already active" + CRLF
+        if [arg.upper() for arg in args] != ["DEFLATE"]:
+            return b"503 Compression algorithm not supported" + CRLF
+        return b"206 Compression active" + CRLF
+
+    def _authinfo(self, args):
+        if self.authenticated:
+            return b"502 Already authenticated" + CRLF
+        if len(args) != 2:
+            return b"501 Syntax error" + CRLF
+        kind, value = args[0].upper(), args[1]
+        if kind == "USER":
+            self.user = value
+            return b"381 Password required" + CRLF
+        if kind == "PASS":
+            if self.user is None:
+                return b"482 Authentication commands issued out of " \
+                       b"sequence" + CRLF
+            if self.mock.users.get(self.user) == value:
+                self.authenticated = True
+                return b"281 Authentication accepted" + CRLF
+            self.user = None
+            return b"481 Authentication failed" + CRLF
+        return b"501 Unknown AUTHINFO type" + CRLF
+
+    def _group(self, command, args):
+        name = args[0] if args else self.group
+        if name is None:
+            return b"412 No newsgroup selected" + CRLF
+        group = self.mock.groups.get(name)
+        if group is None:
+            return b"411 No such newsgroup" + CRLF
+
+        self.group  = name
+        self.number = group.numbers[0] if group.numbers else None
+        status = _bytes("211 %d %d %d %s" % (len(group.numbers), group.low,
+                                             group.high, name))
+        if command == "GROUP":
+            return status + CRLF
+
+        numbers = group.numbers
+        if len(args) > 1:
+            numbers = group.range(*self._range(args[1], group))
+        return self._multiline(status + b" list follows",
+                               [_bytes(number) for number in numbers])
+
+    def _range(self, text, group):
+        first, dash, last = text.partition("-")
+        first = int(first)
+        if not dash:
+            return first, first
+        return first, int(last) if last else max(group.high, first)
+
+    def _lookup(self, args):
+        """
+        Returns (status, number, article) for the article ``args`` refer
+        to, the status being ``None`` if it was found.
+        """
+        mock = self.mock
+        if args and args[0].startswith("<"):
+            article = mock.articles.get(args[0])
+            if article is None:
+                return b"430 No article with that message-id", 0, None
+            return None, 0, article
+
+        if self.group is None:
+            return b"412 No newsgroup selected", 0, None
+        if args:
+            try:
+                number = int(args[0])
+            except ValueError:
+                return b"501 Syntax error", 0, None
+        elif self.number is None:
+            return b"420 Current article number is invalid", 0, None
+        else:
+            number = self.number
+
+        message_id = mock.groups[self.group].articles.get(number)
+        article = mock.articles.get(message_id) if message_id else None
+        if article is None:
+            return b"423 No article with that number", 0, None
+        self.number = number
+        return None, number, article
+
+    def _article(self, command, args):
+        status, number, article = self._lookup(args)
+        if status is not None:
+            return status + CRLF
+
+        code = {"ARTICLE": 220, "HEAD": 221, "BODY": 222, "STAT": 223}
+        status = _bytes("%d %d %s" % (code[command], number,
+                                      article.message_id))
+        if command == "STAT":
+            return status + CRLF
+
+        data = []
+        if command in ("ARTICLE", "HEAD"):
+            data.append(article.head)
+        if command == "ARTICLE":
+            data.append(CRLF)
+        if command in ("ARTICLE", "BODY"):
+            data.append(article.body)
+
+        lines = b"".join(data).split(CRLF)
+        if not lines[-1]:
+            # The data ended with a CRLF
+            lines.pop()
+        return self._multiline(status, lines)
+
+    def _over(self, args):
+        mock = self.mock
+        if args and args[0].startswith("<"):
+            article = mock.articles.get(args[0])
+            if article is None:
+                return b"430 No article with that message-id" + CRLF
+            return self._multiline(b"224 Overview information follows",
+                                   [article.overview(0)])
+
+        if self.group is None:
+            return b"412 No newsgroup selected" + CRLF
+        group = mock.groups[self.group]
+        if args:
+            numbers = group.range(*self._range(args[0], group))
+        elif self.number is not None:
+            numbers = [self.number]
+        else:
+            return b"420 Current article number is invalid" + CRLF
+
+        lines = []
+        for number in numbers:
+            article = mock.articles.get(group.articles[number])
+            if article is not None:
+                lines.append(article.overview(number))
+        if not lines:
+            return b"423 No articles in that range" + CRLF
+        return self._multiline(b"224 Overview information follows", lines)
+
+    def _xfeature(self, args):
+        """
+        ``XFEATURE COMPRESS GZIP [TERMINATOR]``, with which the data blocks
+        of overview responses are sent compressed.
+        """
+        args = [arg.upper() for arg in args]
+        if "GZIP" not in self.mock.compression or \
+           args[:2] != ["COMPRESS", "GZIP"]:
+            return b"500 Unknown command" + CRLF
+        self.gzip = args[2:]
+        return b"290 Feature enabled" + CRLF
+
+    def _gzip(self, response):
+        """
+        Compresses the data block of an overview ``response`` once
+        ``XFEATURE COMPRESS GZIP`` is enabled.  The terminating line follows
+        the compressed data, unless ``TERMINATOR`` was given.
+        """
+        if self.gzip is None or not response.startswith(b"224"):
+            return response
+        status, block = response.split(CRLF, 1)
+        trailer = b""
+        if "TERMINATOR" not in self.gzip:
+            block, trailer = block[:-len(b"." + CRLF)], b"." + CRLF
+        return status + b" [COMPRESS=GZIP]" + CRLF + zlib.compress(block) + \
+            trailer
+
+    def _hdr(self, command, args):
+        if not args:
+            return b"501 Syntax error" + CRLF
+        name, args = args[0].lower(), args[1:]
+        if not args or args[0].startswith("<"):
+            # The current article, or one by message-id
+            status, number, article = self._lookup(args)
+            if status is not None:
+                return status + CRLF
+            articles = [(number, article)]
+        elif self.group is None:
+            return b"412 No newsgroup selected" + CRLF
+        else:
+            group = self.mock.groups[self.group]
+            articles = []
+            for number in group.range(*self._range(args[0], group)):
+                article = self.mock.articles.get(group.articles[number])
+                if article is not None:
+                    articles.append((number, article))
+            if not articles:
+                return b"423 No articles in that range" + CRLF
+
+        lines = []
+        for number, article in articles:
+            if name == ":bytes":
+                value = len(article.body)
+            elif name == ":lines":
+                value = article.body.count(CRLF)
+            elif name == "message-id":
+                value = article.message_id
+            else:
+                value = article.header(name)
+            lines.append(_bytes("%d %s" % (number, value)))
+        if command == "HDR":
+            return self._multiline(b"225 Headers follow", lines)
+        return self._multiline(b"221 Header follows", lines)
+
+class MockNNTPServer:
+    """
+    An NNTP server on ``host`` (the loopback interface) for tests and
+    benchmarks, see :func:`start`.  With the default ``port`` of 0 a free
+    port is picked, which is ``port`` once started.
+
+    It implements the greeting, ``AUTHINFO USER``/``PASS`` (required if
+    ``users``, a dict of user name to password, is given),
+    ``CAPABILITIES``, ``MODE READER``, ``GROUP``, ``LISTGROUP``, ``STAT``,
+    ``HEAD``, ``BODY``, ``ARTICLE``, ``OVER``/``XOVER``, ``HDR``/``XHDR``,
+    ``LIST``, ``LIST OVERVIEW.FMT``, ``DATE`` and ``QUIT``.  ``compression``
+    lists the compression extensions to offer: "DEFLATE" for ``COMPRESS
+    DEFLATE`` (RFC 8054) and "GZIP" for ``XFEATURE COMPRESS GZIP``, which
+    compresses the overview.  Connections that send nothing for
+    ``idle_timeout`` seconds get a ``400`` response and are closed, like
+    many servers do.
+
+    ``articles`` maps message-ids to :class:`Article` objects, by default
+    it's filled with :func:`add_article`.  Any object with a ``get`` method
+    will do, e.g. one that makes up articles on demand.
+
+    The other arguments make the server behave like one far away:
+
+    * ``latency`` - every response is delayed until that many seconds after
+      its command was received, so pipelined commands overlap like over a
+      link with that round trip time.
+    * ``bandwidth`` - the bytes per second each connection sends at most.
+    * ``error_rate`` - the chance that a command gets a ``403`` response.
+    * ``drop_rate`` - the chance that the connection is closed halfway
+      through a response.
+
+    The faults only apply to the commands in ``FAULT_COMMANDS``.  They are
+    drawn from the server's own ``random``, a :py:class:`random.Random`, so
+    ``server.random.seed(...)`` repeats them.  ``ssl_context`` is a server
+    side :py:class:`ssl.SSLContext` to use TLS with, see
+    :func:`ssl_context_from`.
+    """
+    def __init__(self, host="127.0.0.1", port=0, articles=None, users=None,
+                 ssl_context=None, latency=0.0, bandwidth=None,
+                 error_rate=0.0, drop_rate=0.0, idle_timeout=None,
+                 compression=(),
+                 greeting="200 asyncnntp mock server ready"):
+        self.host         = host
+        self.port         = port
+        self.articles     = {} if articles is None else articles
+        self.groups       = {}
+        self.users        = users or {}
+        self.ssl_context  = ssl_context
+        self.latency      = latency
+        self.bandwidth    = bandwidth
+        self.error_rate   = error_rate
+        self.drop_rate    = drop_rate
+        self.idle_timeout = idle_timeout
+        self.compression  = compression
+        self.greeting     = greeting
+        self.random       = random.Random()
+        self.verbose      = False
+
+        # Statistics
+        self.connections = 0
+        self.commands    = {}
+        self.bytes_sent  = 0
+
+        self._lock    = threading.Lock()
+        self._sockets = set()
+        self._server  = None
+        self._thread  = None
+
+    @staticmethod
+    def ssl_context_from(certfile, keyfile=None):
+        """
+        Returns a server side :py:class:`ssl.SSLContext` with the certificate
+        in ``certfile``.
+        """
+        context = ssl.SSLContext(getattr(ssl, "PROTOCOL_TLS_SERVER",
+                                         ssl.PROTOCOL_SSLv23))
+        context.load_cert_chain(certfile, keyfile)
+        return context
+
+    def add_article(self, message_id, body=b"", headers=None, groups=()):
+        """
+        Adds an article, returns the :class:`Article`.  It's numbered in
+        each of ``groups`` after the articles already there.
+        """
+        article = Article(message_id, body, headers)
+        for name in groups:
+            group = self.groups.get(name)
+            if group is None:
+                group = self.groups[name] = Group(name)
+            article.groups.append((name, group.add(message_id)))
+        self.articles[message_id] = article
+        return article
+
+    def add_group(self, name):
+        """
+        Adds an empty group, returns the :class:`Group`.
+        """
+        return self.groups.setdefault(name, Group(name))
+
+    def start(self):
+        """
+        Starts listening, returns the server.
+        """
+        self._server = _Server((self.host, self.port), _Handler)
+        self._server.mock = self
+        self.port = self._server.server_address[1]
+
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops listening and closes the open connections.
+        """
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._server = None
+        self.drop_connections()
+
+    def drop_connections(self):
+        """
+        Closes every open connection, without a response.
+        """
+        with self._lock:
+            sockets = list(self._sockets)
+        for sock in sockets:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _opened(self, sock):
+        with self._lock:
+            self.connections += 1
+            self._sockets.add(sock)
+
+    def _closed(self, sock):
+        with self._lock:
+            self._sockets.discard(sock)
+
+    def _count(self, command):
+        with self._lock:
+            self.commands[command] = self.commands.get(command, 0) + 1
+
+    def _sent(self, count):
+        with self._lock:
+            self.bytes_sent += count
+
+    def _chance(self, rate):
+        return rate > 0 and self.random.random() < rate
+
+    def _log(self, message):
+        if self.verbose:
+            print(message)
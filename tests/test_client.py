@@ -0,0 +1,870 @@
+"""
+Tests of the client against a :class:`mocknntp.MockNNTPServer`, with each
+of the connection classes this Python has.
+"""
+import io
+import os
+import subprocess
+import zlib
+
+import pytest
+
+import asyncnntp
+import mocknntp
+
+def wait(predicate, timeout=10):
+    """
+    Runs ``asyncore.loop`` until ``predicate`` returns ``True``.
+    """
+    start = asyncnntp.time.time()
+    while not predicate():
+        assert asyncnntp.time.time() - start < timeout, "Timed out"
+        asyncnntp.asyncore.loop(timeout=0.01, count=1)
+
+class AsyncoreClient:
+    """
+    An :class:`asyncnntp.NNTP` connection, driven by ``asyncore.loop``.
+    """
+    def __init__(self, server, **kwargs):
+        self.conn = asyncnntp.NNTP("127.0.0.1", server.port, usenetrc=False,
+                                   **kwargs)
+        wait(self.conn.ready)
+
+    def result(self, future):
+        wait(future.done)
+        return future.result()
+
+    def wait(self, predicate):
+        wait(predicate)
+
+    def close(self):
+        self.conn.close()
+
+class AsyncioClient:
+    """
+    An :class:`asyncnntp.AsyncNNTP` connection on an event loop of its own.
+    """
+    def __init__(self, server, **kwargs):
+        self.loop = asyncnntp.asyncio.new_event_loop()
+        self.conn = self.loop.run_until_complete(asyncnntp.AsyncNNTP.connect(
+            "127.0.0.1", server.port, loop=self.loop, **kwargs))
+
+    def result(self, future):
+        return self.loop.run_until_complete(
+            asyncnntp.asyncio.wait_for(future, 10))
+
+    def wait(self, predicate, timeout=10):
+        start = asyncnntp.time.time()
+        while not predicate():
+            assert asyncnntp.time.time() - start < timeout, "Timed out"
+            self.loop.run_until_complete(asyncnntp.asyncio.sleep(0.01))
+
+    def close(self):
+        self.conn.close()
+        self.loop.run_until_complete(asyncnntp.asyncio.sleep(0))
+        self.loop.close()
+
+CLIENTS = []
+if asyncnntp.asyncore is not None:
+    CLIENTS.append(AsyncoreClient)
+if asyncnntp.asyncio is not None:
+    CLIENTS.append(AsyncioClient)
+
+@pytest.fixture
+def server():
+    server = mocknntp.MockNNTPServer()
+    server.start()
+    yield server
+    server.stop()
+
+@pytest.fixture(params=CLIENTS, ids=lambda cls: cls.__name__)
+def connect(request, server):
+    """
+    Returns a function which opens a connection to ``server`` with the
+    given arguments, closed again after the test.
+    """
+    clients = []
+    def connect(**kwargs):
+        client = request.param(server, **kwargs)
+        clients.append(client)
+        return client
+    yield connect
+    for client in clients:
+        client.close()
+
+@pytest.fixture(scope="module")
+def certificate(tmpdir_factory):
+    """
+    Returns the paths of a self-signed certificate for 127.0.0.1 and its
+    key, made with the ``openssl`` binary.
+    """
+    if not asyncnntp._have_ssl:
+        pytest.skip("ssl is not available")
+    directory = tmpdir_factory.mktemp("tls")
+    certfile  = str(directory.join("cert.pem"))
+    keyfile   = str(directory.join("key.pem"))
+    try:
+        subprocess.check_call(
+            ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes",
+             "-days", "1", "-subj", "/CN=127.0.0.1",
+             "-addext", "subjectAltName=IP:127.0.0.1",
+             "-keyout", keyfile, "-out", certfile],
+            stdout=open(os.devnull, "w"), stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError):
+        pytest.skip("openssl could not create a certificate")
+    return certfile, keyfile
+
+@pytest.fixture
+def tls_server(certificate):
+    server = mocknntp.MockNNTPServer(
+        ssl_context=mocknntp.MockNNTPServer.ssl_context_from(*certificate))
+    server.start()
+    yield server
+    server.stop()
+
+def client_context(certificate):
+    """
+    Returns a client side context which trusts ``certificate``.
+    """
+    return asyncnntp.ssl.create_default_context(cafile=certificate[0])
+
+def payload(request):
+    return bytes(request.payload or b"")
+
+# Bodies that are easily framed wrongly: empty, lines that look like the
+# terminator or a status line, and lines that have to be dot-stuffed
+BODIES = [b"",
+          b"one line\r\n",
+          b".\r\n",
+          b"..\r\n.x\r\n",
+          b"222 0 <not-a-status@example>\r\n",
+          b"first\r\n\r\n.\r\n\r\nlast\r\n",
+          b"x" * 100000 + b"\r\n"]
+
+def test_pipelined_framing(server, connect):
+    for i, body in enumerate(BODIES):
+        server.add_article("<%d@test>" % i, body)
+    client = connect(pipeline_depth=8)
+
+    futures = []
+    for i in range(len(BODIES)):
+        message_id = "<%d@test>" % i
+        futures.append(("STAT", i, client.conn.stat(message_id)))
+        futures.append(("BODY", i, client.conn.body(message_id)))
+        futures.append(("HEAD", i, client.conn.head(message_id)))
+
+    for command, i, future in futures:
+        request = client.result(future)
+        assert request.command == command
+        if command == "STAT":
+            assert request.response_code == "223"
+        elif command == "BODY":
+            assert request.response_code == "222"
+            assert payload(request) == BODIES[i]
+        else:
+            assert request.response_code == "221"
+            assert b"Message-ID: <%d@test>" % i in payload(request)
+
+def test_compress_deflate(server, connect):
+    server.compression = ("DEFLATE",)
+    for i, body in enumerate(BODIES):
+        server.add_article("<%d@test>" % i, body)
+    client = connect(pipeline_depth=8, compress=True)
+    assert client.conn._inflate is not None
+    assert server.commands["COMPRESS"] == 1
+
+    futures = []
+    for i in range(len(BODIES)):
+        message_id = "<%d@test>" % i
+        futures.append((i, client.conn.body(message_id)))
+        futures.append((i, client.conn.stat(message_id)))
+    futures.append((None, client.conn.body("<missing@test>")))
+
+    for i, future in futures:
+        request = client.result(future)
+        if i is None:
+            assert request.response_code == "430"
+        elif request.command == "BODY":
+            assert payload(request) == BODIES[i]
+        else:
+            assert request.response_message.split()[-1] == "<%d@test>" % i
+    # The 100000 "x" alone would have been more
+    assert server.bytes_sent < 20000
+
+def test_dot_unstuffing(server, connect):
+    body = b"..\r\n...\r\n.x\r\nx.\r\n.\r\n"
+    server.add_article("<dots@test>", body)
+    client = connect()
+    assert payload(client.result(client.conn.body("<dots@test>"))) == body
+
+    sunk = []
+    client.result(client.conn.body("<dots@test>", sink=sunk.append))
+    assert b"".join(sunk) == body
+
+def test_dot_unstuffing_across_chunks():
+    # Without the CRLF of the last line, which is part of the terminator
+    block = b"\r\n..a\r\n..\r\nb.\r\n..."
+    for size in (1, 2, 3, 5):
+        decoder = asyncnntp.MultilineDecoder()
+        data = b"".join(decoder.feed(block[i:i + size])
+                        for i in range(0, len(block), size))
+        assert data + decoder.close() == b".a\r\n.\r\nb.\r\n..\r\n"
+
+def test_body_missing(server, connect):
+    server.add_article("<there@test>", b"here\r\n")
+    client = connect(pipeline_depth=4)
+    missing = client.conn.body("<missing@test>")
+    there   = client.conn.body("<there@test>")
+    assert client.result(missing).response_code == "430"
+    assert payload(client.result(there)) == b"here\r\n"
+
+def test_yenc_single_part(server, connect):
+    data = os.urandom(50000)
+    server.add_article("<yenc@test>", mocknntp.yenc_encode(data, "a.bin"))
+    client = connect()
+
+    decoder = asyncnntp.YencDecoder()
+    client.result(client.conn.body("<yenc@test>", sink=decoder))
+    assert decoder.valid
+    assert decoder.name == "a.bin"
+    assert bytes(decoder.data) == data
+
+def test_yenc_multipart(server, connect):
+    data = os.urandom(30000)
+    parts = [(1, 0, 12000), (2, 12000, 24000), (3, 24000, 30000)]
+    for part, start, end in parts:
+        server.add_article("<part%d@test>" % part, mocknntp.yenc_encode(
+            data[start:end], "b.bin", part, len(parts), start + 1,
+            len(data)))
+    client = connect(pipeline_depth=3)
+
+    output = bytearray(len(data))
+    def write(chunk, offset):
+        output[offset:offset + len(chunk)] = chunk
+
+    decoders = []
+    futures  = []
+    for part, start, end in parts:
+        decoders.append(asyncnntp.YencDecoder(write))
+        futures.append(client.conn.body("<part%d@test>" % part,
+                                        sink=decoders[-1]))
+    for future in futures:
+        client.result(future)
+    assert all(decoder.valid for decoder in decoders)
+    assert bytes(output) == data
+
+def test_yenc_corrupt():
+    data = os.urandom(1000)
+    encoded = bytearray(mocknntp.yenc_encode(data))
+    encoded[len(encoded) // 2] ^= 1
+    decoder = asyncnntp.YencDecoder()
+    decoder.feed(bytes(encoded))
+    assert decoder.done
+    assert not decoder.valid
+
+def test_yenc_preamble():
+    data = os.urandom(1000)
+    decoder = asyncnntp.YencDecoder()
+    decoder.feed(b"Posted by someone\r\n\r\n" + mocknntp.yenc_encode(data) +
+                 b"-- \r\nA signature\r\n")
+    assert decoder.valid
+    assert bytes(decoder.data) == data
+
+@pytest.mark.parametrize("wbits", [zlib.MAX_WBITS, zlib.MAX_WBITS | 16],
+                         ids=["zlib", "gzip"])
+@pytest.mark.parametrize("terminator, trailer", [
+    (b".\r\n", b""),      # Compressed along with the data
+    (b"", b".\r\n"),      # Sent uncompressed after the stream
+    (b"", b"")])           # Not sent at all
+def test_inflate(wbits, terminator, trailer):
+    lines = b"".join(b"..line %d\r\n" % i for i in range(2000))
+    compress = zlib.compressobj(6, zlib.DEFLATED, wbits)
+    data = compress.compress(lines + terminator) + compress.flush() + trailer
+
+    for size in (1, 7, 4096):
+        multiline = asyncnntp.MultilineDecoder()
+        output = []
+        inflate = asyncnntp.InflateDecoder(
+            lambda block: output.append(multiline.feed(block)), trailer=True)
+
+        # Whatever follows the compressed block is left alone
+        stream = data + b"223 0 <next@test>\r\n"
+        used = 0
+        for i in range(0, len(stream), size):
+            used += inflate.feed(stream[i:i + size])
+        assert inflate.done
+        assert used == len(data)
+        assert b"".join(output) + multiline.close() == \
+               b"".join(b".line %d\r\n" % i for i in range(2000))
+
+def test_xfeature_compress_gzip(server, connect):
+    server.compression = ("GZIP",)
+    for i in range(1, 101):
+        server.add_article("<%d@test>" % i, b"line\r\n", groups=["alt.test"])
+    client = connect(pipeline_depth=4, compress=True)
+    assert client.conn.overview_compression == "GZIP"
+    client.result(client.conn.group("alt.test"))
+
+    # The uncompressed terminating line isn't taken for the next response
+    futures = [client.conn.over("1-100"), client.conn.stat(5),
+               client.conn.over("50-"), client.conn.stat("<7@test>")]
+    request = client.result(futures[0])
+    assert "COMPRESS=GZIP" in request.response_message
+    assert list(request.overview.number) == list(range(1, 101))
+    assert request.overview[99].message_id == "<100@test>"
+    assert client.result(futures[1]).response_message == "5 <5@test>"
+    assert len(client.result(futures[2]).overview) == 51
+    assert client.result(futures[3]).response_message == "0 <7@test>"
+
+def test_inflate_invalid():
+    inflate = asyncnntp.InflateDecoder(lambda block: None)
+    with pytest.raises(asyncnntp.NNTPDataError):
+        inflate.feed(b"not compressed at all")
+
+def test_overview_parse():
+    fmt = ("Subject:", ":bytes", "From:", "Message-ID:", "Xref:full")
+    lines = [b"1\tFirst\t100\tposter@example\t<1@test>\tXref: mock a:1",
+             b"2\tSecond\tbad\tposter@example\t<2@test>",
+             b"3\t\t300\tother@example\t<3@test>\tXref: mock a:3 b:1"]
+    data = b"".join(line + b"\r\n" for line in lines)
+
+    overview = asyncnntp.Overview(fmt)
+    # Split lines and CRLFs between chunks
+    for start in range(0, len(data), 7):
+        overview.feed(data[start:start + 7])
+    assert list(overview.number) == [1, 2, 3]
+    assert list(overview.column("bytes")) == [100, 0, 300]
+    assert list(overview.column("subject")) == ["First", "Second", ""]
+    assert list(overview.column("xref")) == ["mock a:1", "", "mock a:3 b:1"]
+    senders = overview.column("from")
+    assert senders[0] is senders[1]
+
+    record = overview[-1]
+    assert record.number == 3
+    assert record.message_id == "<3@test>"
+    assert record["from"] == "other@example"
+    with pytest.raises(AttributeError):
+        record.lines
+    with pytest.raises(IndexError):
+        overview[3]
+
+    overview = asyncnntp.Overview(fmt, fields=("message-id",))
+    overview.feed(data)
+    assert list(overview.column("message-id")) == ["<1@test>", "<2@test>",
+                                                   "<3@test>"]
+    with pytest.raises(KeyError):
+        overview.column("subject")
+
+def test_over(server, connect):
+    for i in range(1, 21):
+        server.add_article("<%d@test>" % i, b"line\r\n" * i,
+                           groups=["alt.test"])
+    client = connect(pipeline_depth=4)
+    client.result(client.conn.group("alt.test"))
+
+    # Both are sent before the overview format is known
+    futures = [client.conn.over("1-20"),
+               client.conn.over("5-7", fields=("message-id", "lines"))]
+    overview = client.result(futures[0]).overview
+    assert len(overview) == 20
+    assert list(overview.number) == list(range(1, 21))
+    assert overview[0].subject == "Article <1@test>"
+    assert list(overview.column("lines")) == list(range(1, 21))
+    assert list(overview.column("bytes")) == [6 * i for i in range(1, 21)]
+    assert overview[19].xref == "mock alt.test:20"
+
+    overview = client.result(futures[1]).overview
+    assert [record.message_id for record in overview] == [
+        "<5@test>", "<6@test>", "<7@test>"]
+    assert server.commands["LIST OVERVIEW.FMT"] == 1
+
+    sunk = []
+    request = client.result(client.conn.over("20-", sink=sunk.append))
+    assert request.overview is None
+    assert b"".join(sunk).startswith(b"20\tArticle <20@test>\t")
+
+def test_overview_cache(server, connect, tmpdir):
+    for i in range(1, 26):
+        server.add_article("<%d@test>" % i, b"line\r\n", groups=["alt.test"])
+    client = connect(pipeline_depth=4)
+    path  = str(tmpdir.join("overview.db"))
+    cache = asyncnntp.OverviewCache(path)
+    cache.chunk_size = 10
+
+    assert client.result(cache.sync(client.conn, "alt.test")) == 25
+    assert server.commands["XOVER"] == 3
+    assert cache.water_marks(client.conn, "alt.test") == (1, 25)
+
+    # Only the new articles are fetched
+    for i in range(26, 31):
+        server.add_article("<%d@test>" % i, b"line\r\n", groups=["alt.test"])
+    assert client.result(cache.sync(client.conn, "alt.test")) == 5
+    assert server.commands["XOVER"] == 4
+    rows = list(cache.articles(client.conn, "alt.test", 29))
+    assert [(row[0], row[4]) for row in rows] == [(29, "<29@test>"),
+                                                  (30, "<30@test>")]
+
+    # The server expired articles, so must the cache
+    group = server.groups["alt.test"]
+    for number in range(1, 11):
+        del group.articles[number]
+        group.numbers.remove(number)
+    assert client.result(cache.sync(client.conn, "alt.test")) == 0
+    assert server.commands["XOVER"] == 4
+    assert cache.water_marks(client.conn, "alt.test") == (11, 30)
+    assert cache.count(client.conn, "alt.test") == 20
+    cache.close()
+
+    cache = asyncnntp.OverviewCache(path)
+    assert cache.count(client.conn, "alt.test") == 20
+    assert client.result(cache.sync(client.conn, "alt.test")) == 0
+    assert cache.water_marks(client.conn, "alt.test") == (11, 30)
+    cache.close()
+
+def add_subjects(server, numbers):
+    for number in numbers:
+        server.add_article("<%d@test>" % number, b"line\r\n",
+                           [("Subject", "Subject %d" % number)])
+        server.add_group("alt.test").add("<%d@test>" % number, number)
+
+def test_header_scan(server, connect):
+    # No articles 101-200, so the ranges there get a 423
+    numbers = list(range(1, 101)) + list(range(201, 301))
+    add_subjects(server, numbers)
+    server.latency = 0.02
+    client = connect(pipeline_depth=4)
+    client.result(client.conn.group("alt.test"))
+
+    # One range at a time, so each response takes the full latency
+    scan = asyncnntp.HeaderScan(client.conn, "Subject", 1, 300, window=1)
+    scan.chunk_size     = 40
+    scan.min_chunk_size = 10
+    scan.target_time    = 0.001
+    assert client.result(scan.start()) is scan
+    assert list(scan.numbers) == numbers
+    assert list(scan.values) == ["Subject %d" % number for number in numbers]
+    # The responses took far longer than the target time
+    assert scan.chunk_size == 10
+    assert server.commands["XHDR"] > 10
+
+    output = []
+    scan = asyncnntp.HeaderScan(client.conn, "Message-ID", 90, 210,
+                                output=lambda *args: output.append(args))
+    scan.chunk_size = 25
+    client.result(scan.start())
+    assert output == [(number, "<%d@test>" % number)
+                      for number in numbers if 90 <= number <= 210]
+
+@pytest.mark.skipif(asyncnntp.asyncore is None,
+                    reason="asyncore is not available")
+def test_header_scan_pool(server):
+    numbers = list(range(1, 501))
+    add_subjects(server, numbers)
+    pool = asyncnntp.NNTPPool("127.0.0.1", server.port, connections=3,
+                              usenetrc=False)
+    wait(lambda: len(pool.ready()) == 3)
+    futures = [conn.group("alt.test") for conn in pool.ready()]
+    wait(lambda: all(future.done() for future in futures))
+
+    scan = asyncnntp.HeaderScan(pool, ":bytes", 1, 500, window=6)
+    scan.chunk_size = scan.min_chunk_size = scan.max_chunk_size = 20
+    wait(scan.start().done)
+    assert scan.future.result() is scan
+    assert list(scan.numbers) == numbers
+    assert set(scan.values) == {"6"}
+    assert server.commands["HDR"] == 25
+    pool.quit()
+
+def test_negative_cache_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(asyncnntp.time, "time", lambda: now[0])
+    cache = asyncnntp.NegativeCache(ttl=80)
+    cache.batch_size = 2
+
+    cache.add("a:119", "<1@test>")
+    assert cache.contains("a:119", "<1@test>")
+    assert not cache.contains("b:119", "<1@test>")
+    assert not cache.contains("a:119", "<2@test>")
+
+    # A new window, the first one fills up and is sorted
+    now[0] += 30
+    for i in range(2, 6):
+        cache.add("a:119", "<%d@test>" % i)
+    assert len(cache) == 5
+    assert all(cache.contains("a:119", "<%d@test>" % i) for i in range(1, 6))
+
+    # The first window has expired
+    now[0] += 55
+    assert not cache.contains("a:119", "<1@test>")
+    assert cache.contains("a:119", "<2@test>")
+    cache.add("a:119", "<6@test>")
+    assert len(cache) == 5
+
+def test_negative_cache_save(monkeypatch, tmpdir):
+    now = [1000.0]
+    monkeypatch.setattr(asyncnntp.time, "time", lambda: now[0])
+    path  = str(tmpdir.join("negative"))
+    cache = asyncnntp.NegativeCache(ttl=80, path=path)
+    cache.add("a:119", "<1@test>")
+    now[0] += 30
+    cache.add("a:119", "<2@test>")
+    cache.add("b:119", "alt.test:3")
+    cache.save()
+
+    cache = asyncnntp.NegativeCache(ttl=80, path=path)
+    assert len(cache) == 3
+    assert cache.contains("a:119", "<1@test>")
+    assert cache.contains("b:119", "alt.test:3")
+
+    # Only what hasn't expired is loaded
+    now[0] += 55
+    cache = asyncnntp.NegativeCache(ttl=80, path=path)
+    assert len(cache) == 2
+    assert not cache.contains("a:119", "<1@test>")
+    assert cache.contains("a:119", "<2@test>")
+
+    with open(path, "wb") as f:
+        f.write(b"something else\n")
+    with pytest.raises(ValueError):
+        asyncnntp.NegativeCache(path=path)
+
+def test_negative_cache_lookups(server, connect):
+    server.add_article("<1@test>", b"line\r\n", groups=["alt.test"])
+    cache  = asyncnntp.NegativeCache()
+    client = connect(negative_cache=cache)
+    client.result(client.conn.group("alt.test"))
+
+    for i in range(2):
+        request = client.result(client.conn.stat("<missing@test>"))
+        assert request.response_code == "430"
+        request = client.result(client.conn.body(5))
+        assert request.response_code == "423"
+        request = client.result(client.conn.stat("<1@test>"))
+        assert request.response_code == "223"
+    assert server.commands["STAT"] == 3
+    assert server.commands["BODY"] == 1
+    assert cache.hits == 2
+
+@pytest.mark.skipif(asyncnntp.asyncore is None,
+                    reason="asyncore is not available")
+def test_tls_session_resumption(tls_server, certificate):
+    tls_server.add_article("<tls@test>", b"secret\r\n")
+    context = client_context(certificate)
+    client  = AsyncoreClient(tls_server, use_ssl=True, ssl_context=context)
+    assert not client.conn._tls.session_reused
+    client.close()
+
+    client = AsyncoreClient(tls_server, use_ssl=True, ssl_context=context)
+    assert client.conn._tls.session_reused
+    # The request is sent again on the new connection
+    future = client.conn.body("<tls@test>")
+    client.conn.reconnect()
+    assert payload(client.result(future)) == b"secret\r\n"
+    assert tls_server.connections == 3
+    assert client.conn._tls.session_reused
+    client.close()
+
+    # A context of its own, the first connection has nothing to resume
+    pool = asyncnntp.NNTPPool("127.0.0.1", tls_server.port, connections=3,
+                              usenetrc=False, use_ssl=True,
+                              ssl_context=client_context(certificate))
+    wait(lambda: len(pool.ready()) == 3)
+    assert [conn._tls.session_reused for conn in pool.connections] == [
+        False, True, True]
+    wait(pool.quit().done)
+
+@pytest.mark.parametrize("client_class", CLIENTS,
+                         ids=lambda cls: cls.__name__)
+def test_tls(tls_server, certificate, client_class):
+    for i, body in enumerate(BODIES + [BIG_BODY]):
+        tls_server.add_article("<%d@test>" % i, body)
+    # Records arrive split over several reads
+    tls_server.bandwidth = 2e6
+    client = client_class(tls_server, use_ssl=True, pipeline_depth=4,
+                          ssl_context=client_context(certificate))
+    try:
+        if client_class is AsyncoreClient and asyncnntp._have_memory_bio:
+            assert isinstance(client.conn._tls, asyncnntp.ssl.SSLObject)
+        futures = [client.conn.body("<%d@test>" % i)
+                   for i in range(len(BODIES) + 1)]
+        for body, future in zip(BODIES + [BIG_BODY], futures):
+            assert payload(client.result(future)) == body
+        assert client.result(client.conn.quit()).response_code == "205"
+    finally:
+        client.close()
+
+def test_auto_reconnect_replay(server, connect):
+    server.users = {"user": "secret"}
+    server.latency = 0.01
+    bodies = {}
+    for i in range(30):
+        bodies[i + 1] = b"body %d\r\n" % i
+        server.add_article("<r%d@test>" % i, bodies[i + 1],
+                           groups=["alt.test"])
+    client = connect(user="user", password="secret", pipeline_depth=4,
+                     auto_reconnect=True)
+    client.conn.reconnect_delay = 0.01
+    client.result(client.conn.group("alt.test"))
+
+    # By number, so they only succeed if the group is selected again
+    futures = [client.conn.body(number) for number in sorted(bodies)]
+    client.result(futures[0])
+    server.drop_connections()
+
+    for number, future in zip(sorted(bodies), futures):
+        request = client.result(future)
+        assert request.response_code == "222"
+        assert payload(request) == bodies[number]
+    assert server.connections == 2
+    assert client.conn.group_name == "alt.test"
+
+def test_auto_reconnect_sinks(server, connect):
+    server.add_article("<big@test>", BIG_BODY)
+    server.bandwidth = 1000000
+    client = connect(pipeline_depth=2, auto_reconnect=True)
+    client.conn.reconnect_delay = 0.01
+
+    seekable = io.BytesIO()
+    chunks = []
+    rewound = client.conn.body("<big@test>", sink=seekable)
+    failed  = client.conn.body("<big@test>", sink=chunks.append)
+
+    # Dropped partway through the first body, the second was sent as well
+    client.wait(lambda: seekable.tell() > len(BIG_BODY) // 4)
+    server.drop_connections()
+
+    assert client.result(rewound).response_code == "222"
+    assert seekable.getvalue() == BIG_BODY
+    # It had no data yet, so it's sent again too
+    assert client.result(failed).response_code == "222"
+    assert b"".join(chunks) == BIG_BODY
+
+    chunks = []
+    failed = client.conn.body("<big@test>", sink=chunks.append)
+    client.wait(lambda: chunks)
+    server.drop_connections()
+    with pytest.raises(asyncnntp.NNTPDataError):
+        client.result(failed)
+
+def test_auto_reconnect_idle(server, connect):
+    server.add_article("<idle@test>")
+    server.idle_timeout = 0.2
+    client = connect(auto_reconnect=True)
+    client.conn.reconnect_delay = 0.01
+
+    # The server closes the connection with a 400 response
+    asyncnntp.time.sleep(0.4)
+    request = client.result(client.conn.stat("<idle@test>"))
+    assert request.response_code == "223"
+    assert server.connections == 2
+
+def test_article_cache_handlers(server, connect):
+    server.add_article("<cached@test>", b"cached\r\n")
+    client = connect()
+    calls = []
+    client.conn.on_body = lambda request: calls.append(
+        ("on_body", request.response_code))
+    cache = asyncnntp.ArticleCache(client.conn)
+
+    # A miss and a hit are handled alike
+    for i in range(2):
+        request = client.result(cache.body("<cached@test>"))
+        assert payload(request) == b"cached\r\n"
+    assert cache.hits == 1
+    assert calls == [("on_body", "222"), ("on_body", "222")]
+
+@pytest.mark.skipif(asyncnntp.asyncore is None,
+                    reason="asyncore is not available")
+def test_pool_futures(server):
+    server.add_article("<pooled@test>", b"pooled\r\n", groups=["alt.test"])
+    pool = asyncnntp.NNTPPool("127.0.0.1", server.port, connections=2,
+                              usenetrc=False)
+    wait(lambda: len(pool.ready()) == 2)
+
+    future = pool.group("alt.test")
+    wait(future.done)
+    assert [request.response_code for request in future.result()] == \
+           ["211", "211"]
+
+    future = pool.body(1)
+    wait(future.done)
+    assert payload(future.result()) == b"pooled\r\n"
+
+    future = pool.quit()
+    wait(future.done)
+    assert [request.response_code for request in future.result()] == \
+           ["205", "205"]
+
+def test_request_keeps_sink():
+    # A sink that is used again must not lose what it already has
+    decoder = asyncnntp.YencDecoder()
+    decoder.feed(mocknntp.yenc_encode(b"kept"))
+    asyncnntp.Request(None, "BODY", "<next@test>", sink=decoder)
+    assert bytes(decoder.data) == b"kept"
+
+def post_nzb(server, files, segment_size):
+    """
+    Adds ``files``, a dict of name to data, to ``server`` as multipart yEnc
+    articles and returns their NZB.
+    """
+    xml = ['<?xml version="1.0"?>',
+           '<nzb xmlns="http://www.newzbin.com/DTD/2003/nzb">']
+    for name, data in sorted(files.items()):
+        parts = [data[i:i + segment_size]
+                 for i in range(0, len(data), segment_size)]
+        xml.append('<file poster="p" date="1" subject="&quot;%s&quot; yEnc">'
+                   '<groups><group>alt.test</group></groups><segments>'
+                   % name)
+        for number, part in enumerate(parts, 1):
+            message_id = "%s.%d@test" % (name, number)
+            server.add_article("<%s>" % message_id, mocknntp.yenc_encode(
+                part, name, number, len(parts),
+                (number - 1) * segment_size + 1, len(data)))
+            xml.append('<segment bytes="%d" number="%d">%s</segment>'
+                       % (len(part), number, message_id))
+        xml.append("</segments></file>")
+    xml.append("</nzb>")
+    return asyncnntp.parse_nzb(io.BytesIO("\n".join(xml).encode("utf-8")))
+
+def test_verifier(server, connect):
+    for i in range(40):
+        server.add_article("<%d@test>" % i)
+    message_ids = ["<%d@test>" % i for i in range(50)]
+    client = connect(pipeline_depth=4)
+
+    output = []
+    verifier = asyncnntp.Verifier(client.conn, message_ids,
+                                  lambda *args: output.append(args))
+    assert client.result(verifier.start()) is verifier
+    assert (verifier.available, verifier.missing, verifier.unknown) == \
+        (40, 10, 0)
+    assert sorted(segment.message_id for segment, status in output
+                  if status == "missing") == sorted(message_ids[40:])
+    assert verifier.recoverable is None
+
+    # Failures are retried, then reported as unknown
+    server.error_rate = 0.5
+    server.random.seed(1)
+    verifier = asyncnntp.Verifier(client.conn, message_ids)
+    client.result(verifier.start())
+    assert verifier.checked == 50
+    assert verifier.unknown > 0
+    assert server.commands["STAT"] > 100
+
+def test_verifier_stop_early(server, connect):
+    data  = asyncnntp.NZBFile('"data.bin" yEnc')
+    par2  = asyncnntp.NZBFile('"data.vol00+01.par2" yEnc')
+    for nzb_file, count in ((data, 20), (par2, 1)):
+        for i in range(count):
+            segment = asyncnntp.NZBSegment("%s.%d@test" % (nzb_file.filename,
+                                                           i),
+                                           i + 1, 1000, nzb_file)
+            nzb_file.segments.append(segment)
+            if nzb_file is par2 or i < 10:
+                server.add_article(segment.message_id)
+    client = connect()
+
+    # The second missing data segment is more than the par2 volume repairs
+    verifier = asyncnntp.Verifier(client.conn, [par2, data], window=1)
+    client.result(verifier.start())
+    assert verifier.stopped
+    assert not verifier.recoverable
+    assert (verifier.available, verifier.missing) == (10, 2)
+    assert not verifier.complete
+
+def test_downloader(server, connect, tmpdir):
+    files = {"a.bin": os.urandom(100000), "b.bin": os.urandom(25000)}
+    nzb = post_nzb(server, files, 10000)
+    directory = str(tmpdir.join("download"))
+    missing = server.articles.pop("<a.bin.4@test>")
+    client = connect(pipeline_depth=4)
+
+    downloader = asyncnntp.Downloader(client.conn, nzb, directory)
+    client.result(downloader.start())
+    assert (downloader.done, downloader.missing) == (12, 1)
+    assert not downloader.complete
+    with open(os.path.join(directory, "b.bin"), "rb") as f:
+        assert f.read() == files["b.bin"]
+
+    # Resumed, only the missing segment is fetched
+    server.articles[missing.message_id] = missing
+    downloader = asyncnntp.Downloader(client.conn, nzb, directory)
+    client.result(downloader.start())
+    assert (downloader.done, downloader.skipped) == (1, 12)
+    assert downloader.complete
+    for name, data in files.items():
+        with open(os.path.join(directory, name), "rb") as f:
+            assert f.read() == data
+
+# A body that takes a while at the ``bandwidth`` below, so connections can be
+# dropped partway through it
+BIG_BODY = (b"x" * 126 + b"\r\n") * 3200
+
+@pytest.mark.skipif(asyncnntp.asyncore is None,
+                    reason="asyncore is not available")
+def test_pool_requeue_sinks(server):
+    server.add_article("<big@test>", BIG_BODY)
+    server.bandwidth = 1000000
+
+    class Connection(asyncnntp.NNTP):
+        reconnect_delay = 0.01
+
+    pool = asyncnntp.NNTPPool("127.0.0.1", server.port, connections=2,
+                              connection_class=Connection,
+                              auto_reconnect=True, usenetrc=False)
+    wait(lambda: len(pool.ready()) == 2)
+
+    seekable = io.BytesIO()
+    seekable.write(b"before")
+    chunks = []
+    rewound = pool.body("<big@test>", sink=seekable)
+    failed  = pool.body("<big@test>", sink=chunks.append)
+    wait(lambda: seekable.tell() > 6 and chunks)
+    server.drop_connections()
+
+    wait(lambda: rewound.done() and failed.done())
+    assert seekable.getvalue() == b"before" + BIG_BODY
+    with pytest.raises(asyncnntp.NNTPDataError):
+        failed.result()
+    assert pool.done()
+    wait(pool.quit().done)
+
+@pytest.mark.skipif(asyncnntp.asyncore is None,
+                    reason="asyncore is not available")
+def test_metrics_pool_queue(server):
+    server.add_article("<metric@test>")
+    metrics = asyncnntp.Metrics()
+    pool = asyncnntp.NNTPPool("127.0.0.1", server.port, connections=2,
+                              pipeline_depth=2, metrics=metrics,
+                              usenetrc=False)
+    wait(lambda: len(pool.ready()) == 2)
+
+    futures = [pool.stat("<metric@test>") for i in range(50)]
+    snapshot = metrics.snapshot()
+    assert snapshot["pools"][0]["queued"] == 46
+    assert snapshot["queued"] == 50
+
+    wait(lambda: all(future.done() for future in futures))
+    snapshot = metrics.snapshot()
+    assert snapshot["queued"] == 0
+    assert snapshot["pools"][0]["completed"] == 50
+    assert snapshot["commands"]["STAT"]["count"] == 50
+    assert sum(conn["completed"] for conn in snapshot["connections"]) == 50
+    wait(pool.quit().done)
+
+def test_metrics(server, connect):
+    server.add_article("<metric@test>", b"x" * 1000 + b"\r\n")
+    metrics  = asyncnntp.Metrics()
+    exported = []
+    metrics.add_exporter(lambda conn, request: exported.append(request))
+    client = connect(pipeline_depth=4, metrics=metrics)
+
+    for future in [client.conn.body("<metric@test>") for i in range(10)]:
+        client.result(future)
+    snapshot = metrics.snapshot()
+    body = snapshot["commands"]["BODY"]
+    assert body["count"] == 10
+    assert body["bytes"] > 10000
+    assert sum(count for bound, count in body["histogram"]) == 10
+    assert len(exported) == 10
+    assert all(request.latency >= 0 for request in exported)